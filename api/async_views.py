@@ -0,0 +1,97 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from chat.delivery import message_notifier
+from .views import HomePageView, TweetDetailView, ProfileDetailView, ListCreateReplyView, MessageListView
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_DB_THREADS, thread_name_prefix='db')
+        return _executor
+
+
+def in_database_thread(func, *args, **kwargs):
+    """
+    Await func in the ASYNC_DB_THREADS pool. Django 4.0 has no async ORM, so the
+    blocking queries run there while the event loop keeps serving other requests,
+    and the pool size caps the database connections of a worker process.
+    With ASYNC_DB_THREADS = 0 func runs in the request's own thread like a sync view
+    """
+    if not settings.ASYNC_DB_THREADS:
+        return sync_to_async(func)(*args, **kwargs)
+
+    def call():
+        # Pool threads outlive requests, so they do what request_started and
+        # request_finished do for the connection of a request thread
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    # run_in_executor does not pass on the context variables of the request
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(get_executor(), context.run, call)
+
+
+def async_api_view(view_class, **initkwargs):
+    """An async Django view running a DRF view, authentication and rendering included, off the event loop"""
+    sync_view = view_class.as_view(**initkwargs)
+
+    def respond(request, *args, **kwargs):
+        response = sync_view(request, *args, **kwargs)
+        # The content is rendered lazily, force it while still in the database thread
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    @functools.wraps(sync_view)
+    async def view(request, *args, **kwargs):
+        return await in_database_thread(respond, request, *args, **kwargs)
+
+    return view
+
+
+home = async_api_view(HomePageView)
+tweet_detail = async_api_view(TweetDetailView)
+profile = async_api_view(ProfileDetailView)
+replies = async_api_view(ListCreateReplyView)
+message_list = async_api_view(MessageListView)
+
+
+async def messages(request, conversation_id):
+    """
+    MessageListView as a long-poll: with ?wait=<seconds> a read finding no new message
+    waits up to that long, at most MESSAGES_LONG_POLL_TIMEOUT, for the next one to be sent
+    instead of having the client poll the database
+    """
+    try:
+        wait = min(int(request.GET.get('wait', 0)), settings.MESSAGES_LONG_POLL_TIMEOUT)
+    except ValueError:
+        wait = 0
+    if request.method != 'GET' or wait <= 0:
+        return await message_list(request, conversation_id=conversation_id)
+
+    with message_notifier.listen(conversation_id) as listener:
+        response = await message_list(request, conversation_id=conversation_id)
+        if response.status_code != 200 or response.data['results']:
+            return response
+        if await listener.wait(wait) is None:
+            return response
+    return await message_list(request, conversation_id=conversation_id)
+
+
+# Authenticated by JWT like the DRF views, csrf_exempt of Django 4.0 would wrap it in a sync view
+messages.csrf_exempt = True
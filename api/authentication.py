@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+def auth_user_cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def forget_auth_user(user_id):
+    cache.delete(auth_user_cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication reading the user of a token from the cache, where it stays for
+    AUTH_USER_CACHE_TIMEOUT seconds or until the user is saved or deleted.
+    The counter columns of request.user can be that old, views that need them
+    read the user from the database
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        key = auth_user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            # Raises for unknown and inactive users, which are never cached
+            user = super().get_user(validated_token)
+            cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user
+
+
+def blacklist_cache_key(jti):
+    return f'token_blacklisted:{jti}'
+
+
+def remember_blacklist_status(token, blacklisted):
+    """Cache whether a refresh token is blacklisted, at most until it expires"""
+    timeout = int(token.payload['exp'] - aware_utcnow().timestamp())
+    if not blacklisted and settings.TOKEN_BLACKLIST_CACHE_TIMEOUT is not None:
+        timeout = min(timeout, settings.TOKEN_BLACKLIST_CACHE_TIMEOUT)
+    if timeout > 0:
+        cache.set(blacklist_cache_key(token.payload[api_settings.JTI_CLAIM]), blacklisted, timeout)
+
+
+class CachedRefreshToken(RefreshToken):
+    """RefreshToken looking its blacklist status up in the cache before the token_blacklist tables"""
+
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        blacklisted = cache.get(blacklist_cache_key(jti))
+        if blacklisted is None:
+            blacklisted = BlacklistedToken.objects.filter(token__jti=jti).exists()
+            remember_blacklist_status(self, blacklisted)
+        if blacklisted:
+            raise TokenError(_('Token is blacklisted'))
+
+    def blacklist(self):
+        # The outstanding and blacklisted rows are committed together
+        with transaction.atomic():
+            result = super().blacklist()
+        remember_blacklist_status(self, True)
+        return result
+
+    def set_jti(self):
+        super().set_jti()
+        # A token issued now is not blacklisted, its refresh needs no lookup
+        if 'exp' in self.payload:
+            remember_blacklist_status(self, False)
@@ -0,0 +1,140 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.response import Response
+from .viewer_state import wants_viewer_state
+
+# Per-process counters of the response cache, exposed by CacheStatsView
+response_cache_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def record_cache_stats(**values):
+    with _stats_lock:
+        response_cache_stats.update(values)
+
+
+def get_cache_stats():
+    with _stats_lock:
+        stats = dict(response_cache_stats)
+    stats.setdefault('hits', 0)
+    stats.setdefault('misses', 0)
+    stats.setdefault('evictions', 0)
+    stats.update(get_backend_stats())
+    return stats
+
+
+def get_backend_stats():
+    """Hit, miss and eviction counters of the Redis server, if the cache is one"""
+    if not hasattr(cache, '_cache') or not hasattr(cache._cache, 'get_client'):
+        return {}
+    info = cache._cache.get_client().info('stats')
+    return {
+        'backend_hits': info.get('keyspace_hits'),
+        'backend_misses': info.get('keyspace_misses'),
+        'backend_evictions': info.get('evicted_keys'),
+    }
+
+
+class StatsLocMemCache(LocMemCache):
+    """The local memory cache, counting the entries it drops when it is full"""
+
+    def _cull(self):
+        size = len(self._cache)
+        super()._cull()
+        record_cache_stats(evictions=size - len(self._cache))
+
+
+def version_key(resource):
+    return f'resource-version:{resource}'
+
+
+def new_version(changed=None):
+    """A version starts with the time the resource changed, 0 for a first version"""
+    return f'{changed or 0:.6f}:{uuid.uuid4().hex}'
+
+
+def changed_since(versions, started):
+    """Whether one of the versions was given out by an invalidate at or after started"""
+    for version in versions.values():
+        changed, _, _ = version.partition(':')
+        try:
+            if float(changed) >= started:
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+def invalidate(*resources):
+    """Give every resource a new version, which makes any response built from it stale"""
+    changed = time.time()
+    cache.set_many({version_key(resource): new_version(changed) for resource in resources}, None)
+
+
+def current_versions(resources):
+    """The version of every resource, resources that never changed get their first one"""
+    keys = {version_key(resource): resource for resource in resources}
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # A concurrent invalidate wins over the first version
+            cache.add(key, new_version(), None)
+    if len(versions) < len(keys):
+        versions = cache.get_many(keys)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+class CachedResponseMixin:
+    """
+    Serve GET requests from the cache until one of the resources the response was built
+    from is invalidated by the signals in api.signals. Views tell which resources a
+    response depends on with get_cache_dependencies
+    """
+    cache_timeout = None
+
+    def get_cache_dependencies(self, data):
+        raise NotImplementedError
+
+    def get_response_cache_key(self, request):
+        # The accepted media type can ask for another format, compact tweets for example
+        path = hashlib.md5(f'{request.get_full_path()}|{request.accepted_media_type}'.encode('utf-8')).hexdigest()
+        return f'response:{type(self).__name__}:{path}'
+
+    def get(self, request, *args, **kwargs):
+        if wants_viewer_state(request):
+            # Only cache what every viewer sees
+            return super().get(request, *args, **kwargs)
+        key = self.get_response_cache_key(request)
+        entry = cache.get(key)
+        if entry is not None and current_versions(entry['versions']) == entry['versions']:
+            record_cache_stats(hits=1)
+            return Response(entry['data'])
+        record_cache_stats(misses=1)
+
+        # Which resources the response depends on is only known once it is built, so a
+        # resource invalidated while building is caught by the time in its version
+        started = time.time()
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            versions = current_versions(self.get_cache_dependencies(response.data))
+            if changed_since(versions, started):
+                return response
+            timeout = self.cache_timeout or settings.RESPONSE_CACHE_TIMEOUT
+            cache.set(key, {'data': response.data, 'versions': versions}, timeout)
+        return response
+
+
+def tweet_dependencies(tweet):
+    """Resources a serialized tweet is built from"""
+    user_id = tweet['user_id'] if 'user_id' in tweet else tweet['user']['id']
+    dependencies = {f'tweet:{tweet["id"]}', f'user:{user_id}'}
+    if tweet.get('quoted_tweet'):
+        quoted = tweet['quoted_tweet']
+        dependencies |= {f'tweet:{quoted["id"]}', f'user:{quoted["user"]["id"]}'}
+    return dependencies
@@ -0,0 +1,50 @@
+from django.db.models import QuerySet
+from rest_framework.utils.serializer_helpers import ReturnList
+from core.models import Tweet
+from .serializers import CompactTweetSerializer
+
+
+def wants_compact_tweets(request):
+    """
+    Whether tweets are sent in the compact format, asked with ?tweets=compact or with
+    a tweets=compact parameter of the accepted media type, e.g.
+    Accept: application/json; tweets=compact
+    """
+    if request.query_params.get('tweets') == 'compact':
+        return True
+    params = (request.accepted_media_type or '').split(';')[1:]
+    return any(param.strip() == 'tweets=compact' for param in params)
+
+
+class CompactTweetsMixin:
+    """
+    List views of tweets answering compact requests with compact_serializer_class.
+    Compact tweets reference their author by user_id and the authors are serialized
+    once, in a users map next to the results: {'results': [...], 'users': {id: profile}}
+    """
+    compact_serializer_class = CompactTweetSerializer
+
+    def get_serializer_class(self):
+        if wants_compact_tweets(self.request):
+            return self.compact_serializer_class
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if (wants_compact_tweets(self.request) and isinstance(queryset, QuerySet)
+                and queryset.model is Tweet):
+            # Only the number of likes is shown
+            queryset = queryset.prefetch_related(None)
+        return queryset
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if hasattr(data.serializer, 'users'):
+            response.data['users'] = data.serializer.users
+        return response
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if isinstance(response.data, ReturnList) and hasattr(response.data.serializer, 'users'):
+            response.data = {'results': response.data, 'users': response.data.serializer.users}
+        return response
@@ -0,0 +1,78 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, body, to_email):
+    """Put an email in the outbox, the send_queued_emails worker delivers it"""
+    return OutboundEmail.objects.create(subject=subject, body=body, to_email=to_email)
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(settings.EMAIL_RETRY_BACKOFF * 2 ** (attempts - 1),
+                                 settings.EMAIL_RETRY_MAX_BACKOFF))
+
+
+def record_failure(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        email.status = OutboundEmail.FAILED
+        logger.error('Gave up sending email %s to %s after %s attempts: %s',
+                     email.id, email.to_email, email.attempts, error)
+    else:
+        email.next_attempt = now + retry_delay(email.attempts)
+        logger.warning('Sending email %s to %s failed, attempt %s: %s',
+                       email.id, email.to_email, email.attempts, error)
+
+
+def send_queued_emails(batch_size=None):
+    """
+    Send one batch of due emails over a single SMTP connection and return how
+    many were sent and how many failed. The rows stay locked until the batch is
+    done so several workers never send the same email
+    """
+    batch_size = batch_size or settings.EMAIL_QUEUE_BATCH_SIZE
+    now = timezone.now()
+    sent = failed = 0
+    with transaction.atomic():
+        emails = list(OutboundEmail.objects.select_for_update(skip_locked=True).filter(
+            status=OutboundEmail.PENDING, next_attempt__lte=now).order_by('next_attempt', 'id')[:batch_size])
+        if not emails:
+            return sent, failed
+
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as error:
+            # The server is unreachable, the whole batch waits for the next attempt
+            for email in emails:
+                record_failure(email, error, now)
+            failed = len(emails)
+        else:
+            try:
+                for email in emails:
+                    message = EmailMessage(subject=email.subject, body=email.body,
+                                           to=[email.to_email], connection=connection)
+                    try:
+                        connection.send_messages([message])
+                    except Exception as error:
+                        record_failure(email, error, now)
+                        failed += 1
+                    else:
+                        email.status = OutboundEmail.SENT
+                        email.attempts += 1
+                        email.date_sent = timezone.now()
+                        sent += 1
+            finally:
+                connection.close()
+        OutboundEmail.objects.bulk_update(
+            emails, ['status', 'attempts', 'next_attempt', 'last_error', 'date_sent'])
+    return sent, failed
+
@@ -0,0 +1,90 @@
+import datetime
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework import serializers
+from api.serializers import RelativeTimeField
+
+
+class DateSerializer(serializers.Serializer):
+    created = RelativeTimeField('created')
+
+
+# How the dates were rendered before RelativeTimeField, kept as the baseline
+def datetime_subtractor(new_datetime, old_datetime):
+    sub = new_datetime - old_datetime
+    total_seconds = sub.total_seconds()
+    seconds_for_all_days = (sub.days * 24 * 3600)
+    remainder = total_seconds - seconds_for_all_days  # if we don't consider the days
+    hours_left_complete = remainder / 3600
+    hours_left = int(remainder//3600)  # Hours
+    minutes_left_complete = (hours_left_complete -
+                             hours_left) * 60  # get the minutes
+    # decimal part of the number						Minutes
+    minutes_left = int(minutes_left_complete)
+    seconds_left_complete = (minutes_left_complete - minutes_left) * 60
+    seconds_left = int(seconds_left_complete)  # Seconds
+
+    answer = {}
+
+    if sub.days > 0:
+        answer['days'] = sub.days
+    else:
+        answer['days'] = 0
+
+    if hours_left > 0:
+        answer['hours'] = hours_left
+    else:
+        answer['hours'] = 0
+
+    if minutes_left > 0:
+        answer['minutes'] = minutes_left
+    else:
+        answer['minutes'] = 0
+
+    if seconds_left > 0:
+        answer['seconds'] = seconds_left
+    else:
+        answer['seconds'] = 0
+
+    return answer
+
+
+class Command(BaseCommand):
+    help = ('Time rendering the dates of a list of objects: a datetime.now() and '
+            'datetime_subtractor per object, the shared now of RelativeTimeField and epoch timestamps')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=10000)
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        dates = [now - datetime.timedelta(seconds=random.randrange(90 * 24 * 3600))
+                 for i in range(options['objects'])]
+
+        def per_object():
+            for date in dates:
+                now_aware = datetime.datetime.now().replace(tzinfo=datetime.timezone.utc)
+                {'created_ago': datetime_subtractor(now_aware, date), 'created': date}
+
+        def field(epoch):
+            def render():
+                # The context of one request
+                date_field = DateSerializer(context={'clock': (time.time(), epoch)}).fields['created']
+                for date in dates:
+                    date_field.to_representation(date)
+            return render
+
+        for name, render in (('datetime.now() per object', per_object),
+                             ('shared now', field(epoch=False)),
+                             ('epoch timestamps', field(epoch=True))):
+            best = min(self.time_run(render) for i in range(options['runs']))
+            self.stdout.write(f'{name}: {best * 1000:.1f}ms for {len(dates)} objects, '
+                              f'{best * 1e6 / len(dates):.2f}us each')
+
+    def time_run(self, render):
+        started = time.perf_counter()
+        render()
+        return time.perf_counter() - started
@@ -0,0 +1,53 @@
+import random
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+from core.models import Tweet, Like
+from api.serializers import TweetSerializer, CompactTweetSerializer
+
+
+class Command(BaseCommand):
+    help = ('Compare the payload size and serialization time of a page of tweets in the full '
+            'and the compact format, in a throwaway test database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=5)
+        parser.add_argument('--tweets', type=int, default=50, help='Tweets on the page')
+        parser.add_argument('--likes', type=int, default=20, help='Likes of every tweet')
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.create_page(options)
+            for name, serializer_class, queryset in (
+                    ('full', TweetSerializer, Tweet.objects.for_feed()),
+                    ('compact', CompactTweetSerializer, Tweet.objects.select_related('user'))):
+                payload = b''
+                started = time.perf_counter()
+                for i in range(options['runs']):
+                    serializer = serializer_class(list(queryset.order_by('-id')), many=True)
+                    data = {'results': serializer.data}
+                    if hasattr(serializer, 'users'):
+                        data['users'] = serializer.users
+                    payload = JSONRenderer().render(data)
+                elapsed_ms = (time.perf_counter() - started) * 1000 / options['runs']
+                self.stdout.write(f'{name}: {len(payload)} bytes, {elapsed_ms:.1f}ms per page of '
+                                  f'{options["tweets"]} tweets, queries included')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def create_page(self, options):
+        user_model = get_user_model()
+        users = [user_model.objects.create_user(
+            email=f'user{i}@example.com', username=f'user{i}', firstname='bench', lastname='mark',
+            password='benchmark', bio='A benchmark user with a bio of a usual length') for i in range(
+            max(options['authors'], options['likes']))]
+        authors = users[:options['authors']]
+        for i in range(options['tweets']):
+            tweet = Tweet.objects.create(content=f'benchmark tweet {i} ' * 8, user=random.choice(authors))
+            Like.objects.bulk_create([Like(user=user, tweet=tweet) for user in users[:options['likes']]])
+            Tweet.objects.filter(pk=tweet.pk).update(like_count=options['likes'])
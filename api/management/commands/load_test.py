@@ -0,0 +1,59 @@
+import statistics
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Send concurrent GET requests to a running server and report throughput and latency, '
+            'to compare gunicorn sync workers with the ASGI deployment')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url')
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--token', help='JWT access token sent with every request')
+        parser.add_argument('--timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        headers = {'Authorization': f'JWT {options["token"]}'} if options['token'] else {}
+
+        def fetch(i):
+            """The latency of one request and why it failed, None when it succeeded"""
+            started = time.perf_counter()
+            try:
+                request = urllib.request.Request(options['url'], headers=headers)
+                with urllib.request.urlopen(request, timeout=options['timeout']) as response:
+                    response.read()
+                    failure = None if response.status == 200 else f'HTTP {response.status}'
+            except urllib.error.HTTPError as error:
+                failure = f'HTTP {error.code}'
+            except urllib.error.URLError as error:
+                failure = str(error.reason)
+            except OSError as error:
+                failure = type(error).__name__
+            return failure, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(fetch, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency * 1000 for failure, latency in results if failure is None)
+        failures = Counter(failure for failure, latency in results if failure is not None)
+        self.stdout.write(f'{len(results)} requests, concurrency {options["concurrency"]}: '
+                          f'{len(latencies) / elapsed:.1f} req/s, {sum(failures.values())} errors')
+        for failure, count in failures.most_common():
+            self.stdout.write(f'  {count} x {failure}')
+        if len(latencies) >= 2:
+            percentiles = statistics.quantiles(latencies, n=100)
+            self.stdout.write(f'latency p50 {percentiles[49]:.0f}ms, p95 {percentiles[94]:.0f}ms, '
+                              f'p99 {percentiles[98]:.0f}ms, max {latencies[-1]:.0f}ms')
+        elif latencies:
+            # quantiles needs two data points
+            self.stdout.write(f'latency {latencies[0]:.0f}ms')
+        else:
+            raise CommandError(f'All {len(results)} requests failed')
@@ -0,0 +1,43 @@
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.emails import send_queued_emails
+
+logger = logging.getLogger('api.emails')
+
+
+class Command(BaseCommand):
+    help = 'Deliver the queued outbound emails, polling the outbox until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Stop once no email is due instead of polling')
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_QUEUE_BATCH_SIZE,
+                            help='Emails sent over one SMTP connection')
+        parser.add_argument('--interval', type=float, default=settings.EMAIL_QUEUE_POLL_INTERVAL,
+                            help='Seconds to wait when the outbox is empty')
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        started = time.perf_counter()
+        try:
+            while True:
+                batch_started = time.perf_counter()
+                sent, failed = send_queued_emails(options['batch_size'])
+                if sent or failed:
+                    total_sent += sent
+                    total_failed += failed
+                    elapsed = time.perf_counter() - batch_started
+                    logger.info('Sent %s emails, %s failed in %.2fs (%.1f emails/s)',
+                                sent, failed, elapsed, sent / elapsed)
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent {total_sent} emails, {total_failed} failed attempts in {elapsed:.2f}s '
+            f'({total_sent / elapsed:.1f} emails/s)'))
@@ -0,0 +1,168 @@
+import binascii
+import datetime
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate by filtering on the ordering fields of the last item of the previous page,
+    so a deep page costs the same as the first one unlike OFFSET based pagination
+    """
+    ordering = ('-id', )
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 50
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = queryset.order_by(*self.ordering)
+        return self.paginate_source(
+            lambda position, limit: list(
+                (queryset.filter(self.get_keyset_filter(position)) if position else queryset)[:limit]),
+            request)
+
+    def paginate_source(self, fetch_page, request):
+        """
+        Paginate anything that is not a queryset, fetch_page receives the decoded cursor
+        position (or None for the first page) and the number of items to return
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        try:
+            items = fetch_page(position, self.page_size + 1)
+        except (TypeError, ValueError, ValidationError):
+            # A cursor value the ordering field can't take, like a word in place of a date
+            if position is None:
+                raise
+            raise NotFound(self.invalid_cursor_message)
+        page = items[:self.page_size]
+        self.next_position = None
+        if len(items) > self.page_size:
+            self.next_position = self.get_position(page[-1])
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_keyset_filter(self, position):
+        """(a, b) < (x, y) written as a < x OR (a = x AND b < y) so it works on every database"""
+        keyset_filter = Q()
+        equal_fields = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            keyset_filter |= Q(**equal_fields, **{f'{name}__{lookup}': value})
+            equal_fields[name] = value
+        return keyset_filter
+
+    def get_position(self, item):
+        position = []
+        for field in self.ordering:
+            value = getattr(item, field.lstrip('-'))
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            position.append(value)
+        return position
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # Positions only hold the numbers and strings get_position writes
+        if any(isinstance(value, bool) or not isinstance(value, (int, float, str)) for value in position):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        encoded = b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class NotificationPagination(KeysetPagination):
+    # A notification moves back to the top when it gets a new event
+    ordering = ('-date_updated', '-id')
+
+
+class InboxPagination(KeysetPagination):
+    ordering = ('-date_updated', '-id')
+
+
+class MessagePagination(KeysetPagination):
+    # Oldest first, a client syncing from seq N reads forward
+    ordering = ('seq', )
+    max_page_size = 200
+
+
+class TweetPagination(KeysetPagination):
+    ordering = ('-date_created', '-id')
+
+
+class SearchPagination(KeysetPagination):
+    # rank is the relevance search_tweets annotates, best matches first
+    ordering = ('-rank', '-date_created', '-id')
+
+
+class TimelinePagination(KeysetPagination):
+    # timeline_created is when a tweet entered the home timeline
+    ordering = ('-timeline_created', '-id')
+
+
+class ReplyPagination(KeysetPagination):
+    ordering = ('-date_created', '-id')
+    max_page_size = 100
+
+
+class ConversationPagination(KeysetPagination):
+    # reply_count changes while a client pages, a branch would be skipped or shown twice
+    ordering = ('-id', )
+    max_page_size = 100
+
+
+class ThreadPagination(KeysetPagination):
+    ordering = ('path', )
+    max_page_size = 100
+
+
+class FollowPagination(KeysetPagination):
+    max_page_size = 100
@@ -0,0 +1,329 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from urllib.parse import parse_qs
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from chat.delivery import message_notifier
+from users.graph import follow_graph
+from .authentication import CachedJWTAuthentication
+from .serializers import CompactTweetSerializer, sideload_users
+
+logger = logging.getLogger(__name__)
+
+
+def tweets_channel(user_id):
+    return f'tweets:{user_id}'
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def conversation_channel(conversation_id):
+    return f'conversation:{conversation_id}'
+
+
+class Subscriber:
+    """One connection and the queue of messages waiting to be sent to it"""
+
+    def __init__(self, user_id, followings, hint=False):
+        self.user_id = user_id
+        self.hint = hint
+        self.channels = {user_channel(user_id), *(tweets_channel(pk) for pk in followings)}
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=settings.PUSH_QUEUE_SIZE)
+        # Messages dropped while the queue was full, they are still counted in a hint
+        self.missed = 0
+
+    def deliver(self, message):
+        # Called from the thread that published the message
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.missed += 1
+
+    async def next_event(self, timeout):
+        """
+        The next event to send, None when nothing was published for timeout seconds.
+        With hint the tweets published within PUSH_HINT_INTERVAL are only counted
+        """
+        try:
+            message = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if not self.hint and not self.missed:
+            return {'type': 'tweet', **message}
+        await asyncio.sleep(settings.PUSH_HINT_INTERVAL)
+        count = 1 + self.missed
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            count += 1
+        self.missed = 0
+        return {'type': 'new_tweets', 'count': count}
+
+
+class PushHub:
+    """The connections of this process by channel"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, subscriber):
+        with self.lock:
+            for channel in subscriber.channels:
+                self.subscribers[channel].add(subscriber)
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            for channel in subscriber.channels:
+                subscribers = self.subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self.subscribers[channel]
+
+    def dispatch(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+            if message.get('type') in ('follow', 'unfollow'):
+                # A connection listens to the users followed since it was opened
+                followed = tweets_channel(message['user_id'])
+                for subscriber in subscribers:
+                    if message['type'] == 'follow':
+                        subscriber.channels.add(followed)
+                        self.subscribers[followed].add(subscriber)
+                    else:
+                        subscriber.channels.discard(followed)
+                        self.subscribers.get(followed, set()).discard(subscriber)
+                return
+        for subscriber in subscribers:
+            subscriber.deliver(message)
+
+    def connection_count(self):
+        with self.lock:
+            return len(set().union(*self.subscribers.values()))
+
+
+class LocalBroker:
+    """Delivers to the connections of the publishing process only, enough for one worker and the tests"""
+
+    def start(self, dispatch):
+        self.dispatch = dispatch
+
+    def publish(self, channel, message):
+        self.dispatch(channel, message)
+
+
+class RedisBroker:
+    """Carries the messages between worker processes over Redis pub/sub at PUSH_REDIS_URL"""
+    prefix = 'push:'
+
+    def __init__(self):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured(
+                'PUSH_BROKER is api.realtime.RedisBroker but redis is not installed, '
+                'install requirements.txt or unset REDIS_URL')
+        self.client = redis.Redis.from_url(settings.PUSH_REDIS_URL)
+
+    def start(self, dispatch):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(f'{self.prefix}*')
+
+        def listen():
+            for item in pubsub.listen():
+                try:
+                    dispatch(item['channel'].decode()[len(self.prefix):], json.loads(item['data']))
+                except Exception:
+                    logger.exception('Could not dispatch the push message %r', item)
+
+        threading.Thread(target=listen, name='push-broker', daemon=True).start()
+
+    def publish(self, channel, message):
+        self.client.publish(f'{self.prefix}{channel}', json.dumps(message, cls=DjangoJSONEncoder))
+
+
+push_hub = PushHub()
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def dispatch(channel, message):
+    """Hand a message the broker received to the long-polls or the push connections of this process"""
+    kind, _, key = channel.partition(':')
+    if kind == 'conversation':
+        message_notifier.wake(int(key), message['seq'])
+    else:
+        push_hub.dispatch(channel, message)
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.PUSH_BROKER)()
+            _broker.start(dispatch)
+        return _broker
+
+
+def publish(channel, message):
+    """
+    Hand a message to the broker once the transaction commits. Pushing is best effort,
+    a broker error is logged and never fails the request that saved the change
+    """
+    def send():
+        try:
+            get_broker().publish(channel, message)
+        except Exception:
+            logger.exception('Could not publish to the push channel %s', channel)
+    transaction.on_commit(send)
+
+
+def publish_tweet(tweet, retweeted_by=None):
+    """
+    Push a new tweet, or a tweet retweeted_by a user, to the connected followers of
+    its author or of the retweeter, in the compact tweet format
+    """
+    # Serialized once for all the followers, so without viewer state
+    tweet.timeline_retweeted_by = retweeted_by
+    context = {}
+    message = {'tweet': CompactTweetSerializer(tweet, context=context).data,
+               'users': sideload_users([tweet.user], context)}
+    publish(tweets_channel((retweeted_by or tweet.user).id), message)
+
+
+def publish_follow(follower_id, user_id, follows=True):
+    """Make the open connections of follower_id start or stop listening to user_id"""
+    publish(user_channel(follower_id), {'type': 'follow' if follows else 'unfollow', 'user_id': user_id})
+
+
+def publish_message(conversation_id, seq):
+    """Wake the long-polls waiting for the next message of a conversation in every worker process"""
+    publish(conversation_channel(conversation_id), {'seq': seq})
+
+
+def encode_event(event):
+    return json.dumps(event, cls=DjangoJSONEncoder)
+
+
+class FeedStream:
+    """
+    ASGI application serving PUSH_PATH and passing every other request to Django.
+    PUSH_PATH streams the new tweets of the followed users over a WebSocket, or as
+    server-sent events to a plain GET. A tweet is published once on the channel of its
+    author, the PUSH_BROKER carries it to the PushHub of every worker process, which
+    hands it to the connections listening to that channel.
+    Browsers can't set headers on WebSockets and EventSource, so the access token can
+    also be sent as ?token=. With ?mode=hint only "N new tweets" counts are sent
+    """
+
+    def __init__(self, application):
+        self.application = application
+        # A broker that can't start fails the server at startup, not the first tweet
+        get_broker()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] in ('http', 'websocket') and scope['path'] == settings.PUSH_PATH:
+            if scope['type'] == 'websocket':
+                return await self.websocket(scope, receive, send)
+            return await self.event_stream(scope, receive, send)
+        return await self.application(scope, receive, send)
+
+    async def connect(self, scope):
+        """The Subscriber of an authenticated request, None when the token is missing or invalid"""
+        from .async_views import in_database_thread
+        query = parse_qs(scope.get('query_string', b'').decode())
+        raw_token = query.get('token', [None])[0]
+        headers = dict(scope.get('headers', []))
+        if raw_token is None and b'authorization' in headers:
+            parts = headers[b'authorization'].split()
+            raw_token = parts[1].decode() if len(parts) == 2 else None
+        if raw_token is None:
+            return None
+        authentication = CachedJWTAuthentication()
+        try:
+            user = await in_database_thread(
+                authentication.get_user, authentication.get_validated_token(raw_token))
+        except (InvalidToken, TokenError, AuthenticationFailed):
+            return None
+        followings = await in_database_thread(follow_graph.get_followings, user.id)
+        get_broker()
+        return Subscriber(user.id, followings, hint=query.get('mode', [None])[0] == 'hint')
+
+    async def stream(self, subscriber, receive, disconnect_type, send_event, send_keepalive):
+        """Send the subscriber's events until the client disconnects"""
+        async def wait_for_disconnect():
+            while (await receive())['type'] != disconnect_type:
+                pass
+
+        disconnected = asyncio.ensure_future(wait_for_disconnect())
+        push_hub.subscribe(subscriber)
+        try:
+            while True:
+                event = asyncio.ensure_future(subscriber.next_event(settings.PUSH_KEEPALIVE))
+                await asyncio.wait({event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    event.cancel()
+                    return
+                if event.result() is None:
+                    await send_keepalive()
+                else:
+                    await send_event(event.result())
+        finally:
+            push_hub.unsubscribe(subscriber)
+            disconnected.cancel()
+
+    async def websocket(self, scope, receive, send):
+        if (await receive())['type'] != 'websocket.connect':
+            return
+        subscriber = await self.connect(scope)
+        if subscriber is None:
+            await send({'type': 'websocket.close', 'code': 4401})
+            return
+        await send({'type': 'websocket.accept'})
+
+        async def send_event(event):
+            await send({'type': 'websocket.send', 'text': encode_event(event)})
+
+        async def send_keepalive():
+            await send_event({'type': 'keepalive'})
+
+        await self.stream(subscriber, receive, 'websocket.disconnect', send_event, send_keepalive)
+
+    async def event_stream(self, scope, receive, send):
+        # The stream does not go through the Django middleware, corsheaders included
+        cors_headers = []
+        origin = dict(scope.get('headers', [])).get(b'origin', b'').decode()
+        if origin in settings.CORS_ALLOWED_ORIGINS:
+            cors_headers = [(b'access-control-allow-origin', origin.encode()), (b'vary', b'Origin')]
+        subscriber = await self.connect(scope)
+        if subscriber is None:
+            await send({'type': 'http.response.start', 'status': 401,
+                        'headers': [(b'content-type', b'application/json'), *cors_headers]})
+            await send({'type': 'http.response.body',
+                        'body': b'{"detail": "Given token not valid for any token type"}'})
+            return
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'), *cors_headers]})
+
+        async def send_event(event):
+            body = f'event: {event["type"]}\ndata: {encode_event(event)}\n\n'
+            await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+
+        async def send_keepalive():
+            await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+
+        await self.stream(subscriber, receive, 'http.disconnect', send_event, send_keepalive)
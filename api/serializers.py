@@ -1,44 +1,107 @@
+import time
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
-import datetime
-from core.models import Tweet, Like, SaveTweet, Reply
+from django.db.models import Manager
+from core.counters import like_counts
+from chat.models import Conversation, Participant, Message
+from core.models import Tweet, Like, SaveTweet, Reply, Retweet, Notification
+from users.media import picture_url
 from users.models import Follow
-from .utils import  datetime_subtractor
+from .utils import time_since
+from .viewer_state import tweet_states, wants_viewer_state
+
+
+class PictureField(serializers.ImageField):
+    """A user picture, shown as the URL of its size_name resized copy"""
+
+    def __init__(self, size_name='large', **kwargs):
+        self.size_name = size_name
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return instance
+
+    def to_representation(self, user):
+        url = picture_url(user, self.source, self.size_name)
+        request = self.context.get('request', None)
+        if url and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+def serializer_clock(context):
+    """
+    The (now, epoch only) pair shared by every date of a response: one now per
+    request, and with ?timestamps=epoch the dates are bare epoch timestamps clients
+    turn into the time ago themselves
+    """
+    if 'clock' not in context:
+        request = context.get('request')
+        epoch = request is not None and request.GET.get('timestamps') == 'epoch'
+        context['clock'] = (time.time(), epoch)
+    return context['clock']
+
+
+class RelativeTimeField(serializers.ReadOnlyField):
+    """A datetime together with how long ago it was, e.g. {'created_ago': {...}, 'created': ...}"""
+
+    def __init__(self, key, **kwargs):
+        self.key = key
+        self.ago_key = f'{key}_ago'
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        now, epoch = serializer_clock(self.context)
+        timestamp = value.timestamp()
+        if epoch:
+            return int(timestamp)
+        return {self.ago_key: time_since(now, timestamp), self.key: value}
 
 
 class ProfileSerializer(serializers.ModelSerializer):
-    date_joined = serializers.SerializerMethodField('get_date_joined')
+    date_joined = RelativeTimeField('date_joined', source='join_date')
     tweet_number = serializers.SerializerMethodField('get_tweet_number')
     follows = serializers.SerializerMethodField('get_follows')
+    picture = PictureField(required=False)
+    background_picture = PictureField(required=False)
+    pictures = serializers.SerializerMethodField('get_pictures')
 
-    def get_date_joined(self, obj):
-        """A property that shows join date and time of a user in a usefull way"""
-        now = datetime.datetime.now()
-        now_aware = now.replace(tzinfo=datetime.timezone.utc)
-        return {'date_joined_ago': datetime_subtractor(now_aware, obj.join_date), 'date_joined': obj.join_date}
+    def __init__(self, *args, picture_size='large', **kwargs):
+        self.picture_size = picture_size
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fields['picture'].size_name = self.picture_size
+        return fields
 
     def get_tweet_number(self, obj):
         """Get the number of tweets created by this user"""
-        return obj.tweets.all().count()
+        return obj.tweet_count
 
     def get_follows(self, obj):
-        followers_objs = obj.followers.all()
-        followers = []
-        for follower_obj in followers_objs:
-            followers.append(follower_obj.follower.username)
-        followings_objs = obj.follows.all()
-        followings = []
-        for following_obj in followings_objs:
-            followings.append(following_obj.user.username)
-        return {'followings_count': len(followings), 'followers_count': len(followers)}
+        return {'followings_count': obj.following_count, 'followers_count': obj.followers_count}
+
+    def get_pictures(self, obj):
+        """The URL of every size of the profile picture"""
+        return {size_name: picture_url(obj, 'picture', size_name)
+                for size_name in settings.PICTURE_VARIANTS['picture']}
 
+    def update(self, instance, validated_data):
+        """Save only the edited fields, the counters keep the value other requests gave them"""
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
 
     class Meta:
         model = get_user_model()
         fields = ('id', 'email', 'username', 'firstname',
                    'lastname', 'bio', 'join_date', 'picture',
                     'date_joined', 'tweet_number', 'follows',
-                    'background_picture')
+                    'background_picture', 'pictures')
+        read_only_fields = ('email', 'username', 'join_date')
 
 
 class UserSignUpSerializer(serializers.ModelSerializer):
@@ -48,9 +111,37 @@ class UserSignUpSerializer(serializers.ModelSerializer):
                   'firstname', 'lastname', 'password')
 
 
+class TypeaheadUserSerializer(serializers.ModelSerializer):
+    picture = PictureField(size_name='small', read_only=True)
+
+    class Meta:
+        model = get_user_model()
+        fields = ('id', 'username', 'firstname', 'lastname', 'picture', 'followers_count')
+
+
+class QuotedTweetSerializer(serializers.ModelSerializer):
+    """The tweet a quote tweet comments on, without its likes"""
+    user = TypeaheadUserSerializer(read_only=True)
+    date_created = RelativeTimeField('created')
+
+    class Meta:
+        model = Tweet
+        fields = ('id', 'content', 'date_created', 'user')
+
+
+class QuotedTweetField(serializers.PrimaryKeyRelatedField):
+    """Written as the id of the quoted tweet, shown as the QuotedTweetSerializer of it"""
+
+    def use_pk_only_optimization(self):
+        return False
+
+    def to_representation(self, value):
+        return QuotedTweetSerializer(value, context=self.context).data
+
+
 class LikeSerializer(serializers.ModelSerializer):
     user = serializers.ReadOnlyField(source='user.username')
-    tweet = serializers.ReadOnlyField(source='tweet.id')
+    tweet = serializers.ReadOnlyField(source='tweet_id')
     class Meta:
         model = Like
         fields = ('id', 'tweet', 'user')
@@ -63,25 +154,63 @@ class FollowSerializer(serializers.ModelSerializer):
         model = Follow
         fields = ('id', 'user', 'follower')
 
+class TweetListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        tweets = list(data.all() if isinstance(data, Manager) else data)
+        # Read the like counts of the whole page at once
+        self.context['like_counts'] = like_counts(tweets)
+        if wants_viewer_state(self.context.get('request')):
+            self.context['viewer_states'] = tweet_states(self.context['request'].user, tweets)
+        return super().to_representation(tweets)
+
+
 class TweetSerializer(serializers.ModelSerializer):
-    user = ProfileSerializer(read_only=True)
+    user = ProfileSerializer(read_only=True, picture_size='small')
     firstname = serializers.ReadOnlyField(source='user.firstname')
     lastname = serializers.ReadOnlyField(source='user.lastname')
     likes = LikeSerializer(many=True, read_only=True)
-    date_created = serializers.SerializerMethodField('get_date_created')
+    like_count = serializers.SerializerMethodField('get_like_count')
+    date_created = RelativeTimeField('created')
+    quoted_tweet = QuotedTweetField(queryset=Tweet.objects.all(), required=False, allow_null=True)
+    retweeted_by = serializers.SerializerMethodField('get_retweeted_by')
+
+    def get_like_count(self, obj):
+        counts = self.context.get('like_counts', {})
+        if obj.id not in counts:
+            counts = like_counts([obj])
+        return counts[obj.id]
 
-    def get_date_created(self, obj):
-        """A property that shows creation date and time of a tweet in a usefull way"""
+    def get_retweeted_by(self, obj):
+        # Set by read_timeline on the home page tweets a followed user retweeted
+        retweeter = getattr(obj, 'timeline_retweeted_by', None)
+        return retweeter.username if retweeter else None
 
-        now = datetime.datetime.now()
-        # Add UTC to it so it's similar to django datetimefield default behavior
-        now_aware = now.replace(tzinfo=datetime.timezone.utc)
-        return {'created_ago': datetime_subtractor(now_aware, obj.date_created), 'created': obj.date_created}
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        request = self.context.get('request')
+        if wants_viewer_state(request):
+            states = self.context.get('viewer_states', {})
+            if instance.id not in states:
+                states = tweet_states(request.user, [instance])
+            data['viewer_state'] = states[instance.id]
+        return data
 
     class Meta:
         model = Tweet
-        fields = ('id', 'content', 'date_created', 'user',
-                  'firstname', 'lastname', 'likes')
+        fields = ('id', 'content', 'date_created', 'user', 'firstname', 'lastname', 'likes', 'like_count',
+                  'reply_count', 'retweet_count', 'quote_count', 'quoted_tweet', 'retweeted_by')
+        read_only_fields = ('reply_count', 'retweet_count', 'quote_count')
+        list_serializer_class = TweetListSerializer
+
+
+class SaveTweetListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        save_tweets = list(data.all() if isinstance(data, Manager) else data)
+        tweets = [save_tweet.tweet for save_tweet in save_tweets]
+        self.context['like_counts'] = like_counts(tweets)
+        if wants_viewer_state(self.context.get('request')):
+            self.context['viewer_states'] = tweet_states(self.context['request'].user, tweets)
+        return super().to_representation(save_tweets)
 
 
 class SaveTweetSerializer(serializers.ModelSerializer):
@@ -91,19 +220,126 @@ class SaveTweetSerializer(serializers.ModelSerializer):
     class Meta:
         model = SaveTweet
         fields = ('id', 'tweet', 'user')
+        list_serializer_class = SaveTweetListSerializer
+
+
+def sideload_users(users, context):
+    """The profiles of users by id, each serialized once for a whole compact response"""
+    profiles = ProfileSerializer(list(users), many=True, context=context, picture_size='small').data
+    return {profile['id']: profile for profile in profiles}
+
+
+class CompactTweetListSerializer(TweetListSerializer):
+    def to_representation(self, data):
+        tweets = list(data.all() if isinstance(data, Manager) else data)
+        self.users = sideload_users({tweet.user_id: tweet.user for tweet in tweets}.values(), self.context)
+        return super().to_representation(tweets)
+
+
+class CompactTweetSerializer(TweetSerializer):
+    """A tweet referencing its author by user_id and counting its likes instead of listing them"""
+
+    class Meta(TweetSerializer.Meta):
+        fields = ('id', 'content', 'date_created', 'user_id', 'like_count', 'reply_count',
+                  'retweet_count', 'quote_count', 'quoted_tweet', 'retweeted_by')
+        list_serializer_class = CompactTweetListSerializer
+
+
+class CompactSaveTweetListSerializer(SaveTweetListSerializer):
+    def to_representation(self, data):
+        save_tweets = list(data.all() if isinstance(data, Manager) else data)
+        self.users = sideload_users(
+            {save_tweet.tweet.user_id: save_tweet.tweet.user for save_tweet in save_tweets}.values(), self.context)
+        return super().to_representation(save_tweets)
+
+
+class CompactSaveTweetSerializer(SaveTweetSerializer):
+    tweet = CompactTweetSerializer(read_only=True)
+
+    class Meta(SaveTweetSerializer.Meta):
+        list_serializer_class = CompactSaveTweetListSerializer
+
+
+class RetweetSerializer(serializers.ModelSerializer):
+    user = serializers.ReadOnlyField(source='user.username')
+    tweet = serializers.ReadOnlyField(source='tweet_id')
+    date_created = RelativeTimeField('created')
+
+    class Meta:
+        model = Retweet
+        fields = ('id', 'tweet', 'user', 'date_created')
 
 
 class ReplySerializer(serializers.ModelSerializer):
-    user = ProfileSerializer(read_only=True)
-    tweet = serializers.ReadOnlyField(source='tweet.id')
-    date_created = serializers.SerializerMethodField('get_date_created')
+    user = ProfileSerializer(read_only=True, picture_size='small')
+    tweet = serializers.ReadOnlyField(source='tweet_id')
+    parent = serializers.PrimaryKeyRelatedField(queryset=Reply.objects.all(), required=False, allow_null=True)
+    date_created = RelativeTimeField('created')
+
+    class Meta:
+        model = Reply
+        fields = ('id', 'text', 'user', 'tweet', 'parent', 'depth', 'reply_count', 'date_created')
+        read_only_fields = ('depth', 'reply_count')
+        
+
+class NotificationListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        notifications = list(data.all() if isinstance(data, Manager) else data)
+        # Read the actors of the whole page at once
+        actor_ids = {actor_id for notification in notifications for actor_id in notification.actor_ids}
+        self.context['actors'] = get_user_model().objects.in_bulk(actor_ids) if actor_ids else {}
+        return super().to_representation(notifications)
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    """e.g. {'verb': 'like', 'actors': [<the latest likers>], 'actor_count': 42, 'tweet': {...}}"""
+    actors = serializers.SerializerMethodField('get_actors')
+    tweet = QuotedTweetSerializer(read_only=True)
+    date_updated = RelativeTimeField('updated')
+
+    def get_actors(self, obj):
+        actors = self.context.get('actors')
+        if actors is None:
+            actors = get_user_model().objects.in_bulk(obj.actor_ids)
+        users = [actors[actor_id] for actor_id in obj.actor_ids if actor_id in actors]
+        return TypeaheadUserSerializer(users, many=True, context=self.context).data
+
+    class Meta:
+        model = Notification
+        fields = ('id', 'verb', 'actors', 'actor_count', 'tweet', 'is_read', 'date_updated')
+        list_serializer_class = NotificationListSerializer
+
+
+class MessageSerializer(serializers.ModelSerializer):
+    sender = serializers.ReadOnlyField(source='sender_id')
+    date_created = RelativeTimeField('created')
+
+    class Meta:
+        model = Message
+        fields = ('id', 'seq', 'sender', 'text', 'date_created')
+        read_only_fields = ('seq', )
+
+
+class ParticipantSerializer(serializers.ModelSerializer):
+    user = TypeaheadUserSerializer(read_only=True)
+
+    class Meta:
+        model = Participant
+        fields = ('user', 'last_read_seq')
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    """A conversation of the inbox, unread is the number of messages after the user's read cursor"""
+    participants = ParticipantSerializer(many=True, read_only=True)
+    users = serializers.PrimaryKeyRelatedField(
+        queryset=get_user_model().objects.all(), many=True, write_only=True, allow_empty=False)
+    unread = serializers.SerializerMethodField('get_unread')
+    date_updated = RelativeTimeField('updated')
 
-    def get_date_created(self, obj):
-        now = datetime.datetime.now()
-        now_aware = now.replace(tzinfo=datetime.timezone.utc)
-        return {'created_ago': datetime_subtractor(now_aware, obj.date_created), 'created': obj.date_created}
+    def get_unread(self, obj):
+        return obj.last_seq - obj.last_read_seq
 
     class Meta:
-        model = Reply 
-        fields = ('id', 'text', 'user', 'tweet', 'date_created')
-        
\ No newline at end of file
+        model = Conversation
+        fields = ('id', 'participants', 'users', 'last_seq', 'unread', 'date_updated')
+        read_only_fields = ('last_seq', )
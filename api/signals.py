@@ -0,0 +1,80 @@
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from core.models import Tweet, Like, Reply, Retweet, SaveTweet
+from users.models import Follow
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from .authentication import blacklist_cache_key, forget_auth_user
+from .cache import invalidate
+
+
+def invalidate_on_change(*models):
+    """Connect a function returning the resources an instance change makes stale"""
+    def decorator(get_resources):
+        def receiver(sender, instance, raw=False, **kwargs):
+            if raw:
+                return
+            resources = get_resources(instance)
+            invalidate(*resources)
+            # Again once committed, a response built from the old rows in the meantime
+            # must not outlive the transaction
+            transaction.on_commit(lambda: invalidate(*resources))
+
+        for model in models:
+            post_save.connect(receiver, sender=model, weak=False)
+            post_delete.connect(receiver, sender=model, weak=False)
+        return get_resources
+    return decorator
+
+
+@invalidate_on_change(Tweet)
+def tweet_resources(tweet):
+    return [f'tweet:{tweet.id}', f'user:{tweet.user_id}']
+
+
+@invalidate_on_change(Like)
+def like_resources(like):
+    return [f'tweet:{like.tweet_id}', f'likes:{like.tweet_id}']
+
+
+@invalidate_on_change(Reply, Retweet, SaveTweet)
+def tweet_child_resources(instance):
+    return [f'tweet:{instance.tweet_id}']
+
+
+@invalidate_on_change(Follow)
+def follow_resources(follow):
+    return [f'user:{follow.user_id}', f'user:{follow.follower_id}',
+            f'followers:{follow.user_id}', f'followings:{follow.follower_id}']
+
+
+@invalidate_on_change(get_user_model())
+def user_resources(user):
+    return [f'user:{user.id}']
+
+
+def forget_cached_user(sender, instance, raw=False, **kwargs):
+    if not raw:
+        forget_auth_user(instance.pk)
+
+
+post_save.connect(forget_cached_user, sender=get_user_model())
+post_delete.connect(forget_cached_user, sender=get_user_model())
+
+
+def forget_blacklist_status(sender, instance, raw=False, **kwargs):
+    """Tokens blacklisted or released outside CachedRefreshToken, in the admin for example"""
+    if raw:
+        return
+    try:
+        jti = instance.token.jti
+    except ObjectDoesNotExist:
+        # Deleted along with its expired outstanding token
+        return
+    cache.delete(blacklist_cache_key(jti))
+
+
+post_save.connect(forget_blacklist_status, sender=BlacklistedToken)
+post_delete.connect(forget_blacklist_status, sender=BlacklistedToken)
@@ -1,9 +1,51 @@
-from rest_framework.test import APITestCase
+import asyncio
+import json
+import os
+import smtplib
+import sys
+import tempfile
+import threading
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
+from PIL import Image
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+from django.conf import settings
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends import locmem
+from django.core.management import CommandError, call_command
+from django.test import AsyncRequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.db import IntegrityError
-from core.models import Tweet, SaveTweet, Like
+from django.db import IntegrityError, connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from chat.messaging import send_message, start_conversation
+from core.models import Tweet, SaveTweet, Like, Reply, Retweet, NotificationEvent
+from core.notifications import aggregate_notifications, notify
+from core.timeline import fan_out_tweet, fan_out_retweet
+from core.trending import compute_trending
+from backend import middleware
+from users import graph
+from users.graph import follow_graph
 from users.models import Follow
+from users.typeahead import typeahead_index
+from . import async_views
+from .authentication import CachedJWTAuthentication
+from .cache import invalidate
+from .realtime import FeedStream, RedisBroker, push_hub
+from .utils import time_since
+from .views import ProfileDetailView, TweetDetailView
+from .emails import queue_email, send_queued_emails
+from .models import OutboundEmail
 
 
 class TestSignUpView(APITestCase):
@@ -120,6 +162,9 @@ class TestHomePageView(APITestCase):
 
 
 class TestExploreView(APITestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_explore_view_allow_get(self):
         """Test explore page works for get method"""
         response = self.client.get(reverse('explore'))
@@ -165,11 +210,12 @@ class TestBookMarksListView(APITestCase):
 
         self.assertEqual(book_mark_response.status_code, 200)
 
-        self.assertEqual(book_mark_response.data[0].get('id'), save_tweet.id)
+        self.assertEqual(book_mark_response.data['results'][0].get('id'), save_tweet.id)
 
 
 class TestProfileView(APITestCase):
     def setUp(self):
+        cache.clear()
         self.new_user = get_user_model().objects.create_user(email='test_user@gmail.com', username='test_username',
                                                              firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
         self.new_user.refresh_from_db()
@@ -196,6 +242,94 @@ class TestProfileView(APITestCase):
                                              'bio': 'new bio'}, **{'HTTP_AUTHORIZATION': f'JWT {access_token}'})
         self.assertEqual(profile_response.status_code, 200)
 
+    def test_profile_update_saves_only_the_edited_fields(self):
+        """Test a profile edit keeps the counters other requests changed and can't change the email or username"""
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.new_user.email, 'password': 'testpassword'})
+        get_object = ProfileDetailView.get_object
+
+        def followed_while_editing(view):
+            user = get_object(view)
+            get_user_model().objects.filter(pk=user.pk).update(followers_count=F('followers_count') + 1)
+            return user
+
+        with mock.patch.object(ProfileDetailView, 'get_object', followed_while_editing):
+            response = self.client.patch(reverse('profile', args=[self.new_user.username]), {
+                'bio': 'new bio', 'email': 'other@gmail.com', 'username': 'other'},
+                HTTP_AUTHORIZATION=f'JWT {response.data["access"]}')
+        self.assertEqual(response.status_code, 200)
+        self.new_user.refresh_from_db()
+        self.assertEqual((self.new_user.bio, self.new_user.followers_count), ('new bio', 1))
+        self.assertEqual((self.new_user.email, self.new_user.username), ('test_user@gmail.com', 'test_username'))
+
+
+class TestProfilePictures(APITestCase):
+    """Uploaded pictures are resized into every size and stored in the file storage"""
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.TemporaryDirectory()
+        upload_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.addCleanup(upload_dir.cleanup)
+        settings_override = override_settings(
+            DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+            MEDIA_ROOT=media_root.name, MEDIA_UPLOAD_DIR=upload_dir.name, MEDIA_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.upload_dir = upload_dir.name
+        self.new_user = get_user_model().objects.create_user(email='test_user@gmail.com', username='test_username',
+                                                             firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.new_user.email, 'password': 'testpassword'})
+        self.headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+
+    def image_file(self, name, size=(800, 600), format='PNG'):
+        output = BytesIO()
+        Image.new('RGB', size, 'blue').save(output, format)
+        return SimpleUploadedFile(name, output.getvalue())
+
+    def test_upload_picture(self):
+        """Test a new picture is stored in every size and shown in the size each endpoint needs"""
+        response = self.client.patch(reverse('profile', args=[self.new_user.username]), {
+            'picture': self.image_file('me.png'), 'bio': 'new bio'}, format='multipart', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.new_user.refresh_from_db()
+        self.assertEqual(self.new_user.bio, 'new bio')
+        self.assertEqual(set(self.new_user.picture_variants), {'small', 'medium', 'large'})
+        for size_name, size in {'small': (48, 48), 'large': (400, 400)}.items():
+            with default_storage.open(self.new_user.picture_variants[size_name]) as variant:
+                self.assertEqual(Image.open(variant).size, size)
+        self.assertEqual(self.new_user.picture.name, self.new_user.picture_variants['large'])
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+        profile = self.client.get(reverse('profile', args=[self.new_user.username])).data
+        self.assertTrue(profile['picture'].endswith(self.new_user.picture_variants['large']))
+        self.assertTrue(profile['pictures']['medium'].endswith(self.new_user.picture_variants['medium']))
+        tweet = Tweet.objects.create(content='tweet', user=self.new_user)
+        detail = self.client.get(reverse('tweet-detail', args=[tweet.id])).data
+        self.assertTrue(detail['user']['picture'].endswith(self.new_user.picture_variants['small']))
+
+    def test_new_picture_deletes_the_old_sizes(self):
+        """Test the sizes of a replaced picture are deleted once the new ones are saved"""
+        url = reverse('profile', args=[self.new_user.username])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'picture': self.image_file('me.png')}, format='multipart', **self.headers)
+        self.new_user.refresh_from_db()
+        old_variants = self.new_user.picture_variants
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'picture': self.image_file('me2.png')}, format='multipart', **self.headers)
+        self.new_user.refresh_from_db()
+        self.assertFalse(any(default_storage.exists(name) for name in old_variants.values()))
+        self.assertTrue(all(default_storage.exists(name) for name in self.new_user.picture_variants.values()))
+
+    def test_invalid_picture(self):
+        """Test a file that is not an image is refused before anything is queued"""
+        response = self.client.patch(reverse('profile', args=[self.new_user.username]), {
+            'background_picture': SimpleUploadedFile('me.png', b'not an image')}, format='multipart', **self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
 
 class TestAddTweetView(APITestCase):
     def setUp(self):
@@ -239,6 +373,7 @@ class TestAddTweetView(APITestCase):
 
 class TestTweetDetailView(APITestCase):
     def setUp(self):
+        cache.clear()
         self.new_user = get_user_model().objects.create_user(email='test_user@gmail.com', username='test_username',
                                                              firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
         self.new_tweet = Tweet.objects.create(
@@ -272,6 +407,73 @@ class TestTweetDetailView(APITestCase):
         self.assertEqual(patch_response.status_code, 405)
 
 
+class TestTimestamps(APITestCase):
+    """The dates of a response are rendered from one now"""
+
+    def setUp(self):
+        cache.clear()
+        self.new_user = get_user_model().objects.create_user(email='test_user@gmail.com', username='test_username',
+                                                             firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.tweet = Tweet.objects.create(content='tweet', user=self.new_user)
+
+    def test_time_since(self):
+        """Test the difference is split into whole days, hours, minutes and seconds"""
+        self.assertEqual(time_since(90061.9, 0), {'days': 1, 'hours': 1, 'minutes': 1, 'seconds': 1})
+        self.assertEqual(time_since(0, 10), {'days': 0, 'hours': 0, 'minutes': 0, 'seconds': 0})
+
+    def test_relative_dates(self):
+        """Test dates come with the time since by default and as epoch timestamps on request"""
+        url = reverse('tweet-detail', args=[self.tweet.id])
+        date_created = self.client.get(url).data['date_created']
+        self.assertEqual(set(date_created), {'created_ago', 'created'})
+        self.assertEqual(date_created['created_ago']['days'], 0)
+        response = self.client.get(url + '?timestamps=epoch')
+        self.assertEqual(response.data['date_created'], int(self.tweet.date_created.timestamp()))
+        self.assertEqual(response.data['user']['date_joined'], int(self.new_user.join_date.timestamp()))
+
+
+class TestCompactTweets(APITestCase):
+    """The compact format sends each author once and no likes"""
+
+    def setUp(self):
+        cache.clear()
+        self.new_user = get_user_model().objects.create_user(email='test_user@gmail.com', username='test_username',
+                                                             firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.tweets = [Tweet.objects.create(content=f'tweet {i}', user=self.new_user) for i in range(3)]
+        Like.objects.create(user=self.new_user, tweet=self.tweets[0])
+        Tweet.objects.filter(pk=self.tweets[0].pk).update(like_count=1)
+        self.url = reverse('tweet-list', args=[self.new_user.username])
+
+    def test_query_parameter(self):
+        """Test ?tweets=compact references the author by id and counts the likes"""
+        response = self.client.get(self.url + '?tweets=compact')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.data['users']), [self.new_user.id])
+        self.assertEqual(response.data['users'][self.new_user.id]['username'], self.new_user.username)
+        tweet = response.data['results'][-1]
+        self.assertEqual(tweet['user_id'], self.new_user.id)
+        self.assertEqual(tweet['like_count'], 1)
+        self.assertNotIn('likes', tweet)
+        self.assertNotIn('user', tweet)
+
+    def test_accept_header(self):
+        """Test the format can be asked for in the Accept header and the full one stays the default"""
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json; tweets=compact')
+        self.assertIn('users', response.data)
+        response = self.client.get(self.url)
+        self.assertNotIn('users', response.data)
+        self.assertEqual(response.data['results'][0]['user']['id'], self.new_user.id)
+
+    def test_cached_explore(self):
+        """Test the cached Explore page keeps the full and the compact format apart"""
+        compute_trending()
+        compact = self.client.get(reverse('explore'), HTTP_ACCEPT='application/json; tweets=compact')
+        full = self.client.get(reverse('explore'))
+        self.assertEqual(len(compact.data['results']), 3)
+        self.assertIsInstance(full.data, list)
+        self.assertEqual(self.client.get(reverse('explore') + '?tweets=compact').data, compact.data)
+
+
 class TestTweetListView(APITestCase):
     def setUp(self):
         self.new_user = get_user_model().objects.create_user(email='test_user@gmail.com', username='test_username',
@@ -304,12 +506,55 @@ class TestTweetListView(APITestCase):
             content='test content', user=self.new_user)
         response = self.client.get(
             reverse('tweet-list', args=[self.new_user.username]))
-        self.assertEqual(response.data[0].get('content'), new_tweet.content)
-        self.assertEqual(response.data[0].get('id'), new_tweet.id)
+        self.assertEqual(response.data['results'][0].get('content'), new_tweet.content)
+        self.assertEqual(response.data['results'][0].get('id'), new_tweet.id)
+
+
+class TestConversation(APITestCase):
+    """Nested replies and the ranked conversation of a tweet"""
+
+    def setUp(self):
+        self.new_user = get_user_model().objects.create_user(email='test_user@gmail.com', username='test_username',
+                                                             firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.new_user.email, 'password': 'testpassword'})
+        self.headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+        self.tweet = Tweet.objects.create(content='tweet', user=self.new_user)
+        self.url = reverse('list-create-reply', args=[self.tweet.id])
+
+    def reply(self, parent=None):
+        response = self.client.post(self.url, {'text': 'reply', 'parent': parent}, **self.headers)
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_nested_replies(self):
+        """Test replies to replies show up in their thread and count towards their branch"""
+        quiet, busy = self.reply(), self.reply()
+        child = self.reply(busy)
+        self.reply(child)
+        replies = self.client.get(self.url).data['results']
+        self.assertEqual([reply['id'] for reply in replies], [busy, quiet])
+        ranked = self.client.get(reverse('conversation', args=[self.tweet.id])).data['results']
+        self.assertEqual([(reply['id'], reply['reply_count']) for reply in ranked], [(busy, 2), (quiet, 0)])
+        children = self.client.get(reverse('conversation', args=[self.tweet.id]) + f'?parent={busy}').data['results']
+        self.assertEqual([reply['id'] for reply in children], [child])
+        thread = self.client.get(reverse('reply-thread', args=[busy]) + '?page_size=2')
+        self.assertEqual([reply['depth'] for reply in thread.data['results']], [0, 1])
+        self.assertEqual(len(self.client.get(thread.data['next']).data['results']), 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.reply_count, 4)
+
+    def test_parent_of_another_tweet(self):
+        """Test a reply can't hang from a reply to another tweet"""
+        other = Tweet.objects.create(content='other tweet', user=self.new_user)
+        parent = Reply.objects.create(text='reply', user=self.new_user, tweet=other)
+        response = self.client.post(self.url, {'text': 'reply', 'parent': parent.id}, **self.headers)
+        self.assertEqual(response.status_code, 400)
 
 
 class TestFollowersListView(APITestCase):
     def setUp(self):
+        cache.clear()
         self.new_user1 = get_user_model().objects.create_user(email='test_user1@gmail.com', username='test_username1',
                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
         self.new_user2 = get_user_model().objects.create_user(email='test_user2@gmail.com', username='test_username2',
@@ -342,14 +587,15 @@ class TestFollowersListView(APITestCase):
             user=self.new_user1, follower=self.new_user2)
         response = self.client.get(
             reverse('followers', args=[self.new_user1.username]))
-        self.assertEqual(response.data[0].get(
+        self.assertEqual(response.data['results'][0].get(
             'username'), new_follow.follower.username)
-        self.assertEqual(response.data[0].get(
+        self.assertEqual(response.data['results'][0].get(
             'email'), new_follow.follower.email)
 
 
 class TestFollowingsListView(APITestCase):
     def setUp(self):
+        cache.clear()
         self.new_user1 = get_user_model().objects.create_user(email='test_user1@gmail.com', username='test_username1',
                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
         self.new_user2 = get_user_model().objects.create_user(email='test_user2@gmail.com', username='test_username2',
@@ -382,9 +628,9 @@ class TestFollowingsListView(APITestCase):
             user=self.new_user1, follower=self.new_user2)
         response = self.client.get(
             reverse('followings', args=[self.new_user2.username]))
-        self.assertEqual(response.data[0].get(
+        self.assertEqual(response.data['results'][0].get(
             'username'), new_follow.user.username)
-        self.assertEqual(response.data[0].get(
+        self.assertEqual(response.data['results'][0].get(
             'email'), new_follow.user.email)
 
 
@@ -545,3 +791,893 @@ class TestSuggestedUsersView(APITestCase):
         self.assertEqual(len(response.json()), 1)
         self.assertEqual(response.json()[0]['email'], self.new_user_3.email)
         self.assertEqual(response.json()[0]['username'], self.new_user_3.username)
+
+    def test_follow_check(self):
+        """Test the follow check finds existing follows and answers 404 for the others"""
+        follow_graph.build()
+        response = self.client.get(reverse('follow-check', args=[self.new_user_2.username]), **self.headers)
+        self.assertEqual(response.data['follower'], self.new_user_1.username)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('follow-check', args=[self.new_user_3.username]), **self.headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse([query for query in queries if 'users_follow' in query['sql']])
+        # A follow saved and committed by another process, which this process' graph never applied
+        Follow.objects.bulk_create([Follow(user=self.new_user_3, follower=self.new_user_1)])
+        cache.set(graph.VERSION_KEY, cache.get(graph.VERSION_KEY, 0) + 1, None)
+        with mock.patch('users.graph.threading.Thread') as thread, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse('follow-check', args=[self.new_user_3.username]), **self.headers)
+        self.assertEqual(response.status_code, 200)
+        thread.assert_called_once_with(target=follow_graph.rebuild_in_background, name='follow-graph', daemon=True)
+        follow_graph.rebuilding = False
+
+    def test_followed_users_leave_the_suggestions(self):
+        """Test following a suggested user refreshes the suggestions"""
+        self.client.get(reverse('suggested-users'), **self.headers)
+        self.client.post(reverse('user-follow'), {'user': self.new_user_3.id}, **self.headers)
+        response = self.client.get(reverse('suggested-users'), **self.headers)
+        self.assertEqual(response.json(), [])
+
+
+class TestHomeTimeline(APITestCase):
+    def setUp(self):
+        self.new_user_1 = get_user_model().objects.create_user(email='test_user1@gmail.com', username='test_username1',
+                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.new_user_2 = get_user_model().objects.create_user(email='test_user2@gmail.com', username='test_username2',
+                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.new_user_1.email, 'password': 'testpassword'})
+        self.headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Test following a user adds their tweets to the home page and unfollowing removes them"""
+        old_tweet = Tweet.objects.create(content='old tweet', user=self.new_user_2)
+        self.client.post(reverse('user-follow'), {'user': self.new_user_2.id}, **self.headers)
+        response = self.client.get(reverse('homepage'), **self.headers)
+        self.assertEqual([tweet['id'] for tweet in response.data['results']], [old_tweet.id])
+
+        self.client.delete(reverse('user-unfollow-with-username', args=[self.new_user_2.username]), **self.headers)
+        response = self.client.get(reverse('homepage'), **self.headers)
+        self.assertEqual(response.data['results'], [])
+
+    def test_new_tweet_fans_out_to_followers(self):
+        """Test a tweet created through the api shows up on the follower's home page"""
+        Follow.objects.create(user=self.new_user_2, follower=self.new_user_1)
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.new_user_2.email, 'password': 'testpassword'})
+        self.client.post(reverse('add_tweet'), {'content': 'new tweet'},
+                         **{'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'})
+
+        response = self.client.get(reverse('homepage'), **self.headers)
+        self.assertEqual(response.data['results'][0]['content'], 'new tweet')
+
+
+class TestKeysetPagination(APITestCase):
+    def setUp(self):
+        self.new_user = get_user_model().objects.create_user(email='test_user@gmail.com', username='test_username',
+                                                             firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.tweets = [Tweet.objects.create(content=f'tweet {i}', user=self.new_user) for i in range(5)]
+
+    def test_pages_follow_the_cursor(self):
+        """Test walking the next links returns every tweet once, newest first"""
+        seen = []
+        url = reverse('tweet-list', args=[self.new_user.username]) + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen += [tweet['id'] for tweet in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, [tweet.id for tweet in reversed(self.tweets)])
+
+    def test_page_size_is_capped(self):
+        """Test the page size can't go over the endpoint's max_page_size"""
+        for i in range(50):
+            Tweet.objects.create(content='more', user=self.new_user)
+        response = self.client.get(reverse('tweet-list', args=[self.new_user.username]) + '?page_size=1000')
+        self.assertEqual(len(response.data['results']), 50)
+
+    def test_invalid_cursor(self):
+        """Test a cursor that can't be decoded returns 404"""
+        response = self.client.get(reverse('tweet-list', args=[self.new_user.username]) + '?cursor=bad')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_of_the_wrong_types(self):
+        """Test a cursor holding values its ordering fields can't take returns 404"""
+        url = reverse('tweet-list', args=[self.new_user.username])
+        for position in ([{'date': 1}, 1], [None, 1], ['not a date', 1], ['2022-01-01T00:00:00+00:00', 'not an id']):
+            cursor = b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+            response = self.client.get(url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+    def test_search_pages_by_rank(self):
+        """Test search results come best match first and page with the cursor"""
+        best = Tweet.objects.create(content='tweet tweet match match', user=self.new_user)
+        seen = []
+        url = reverse('search-tweets') + '?search=tweet+match&page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [tweet['id'] for tweet in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, [best.id] + [tweet.id for tweet in reversed(self.tweets)])
+
+    def test_home_page_timeline_pages(self):
+        """Test the authenticated home page is paginated through the timeline"""
+        follower = get_user_model().objects.create_user(email='test_user2@gmail.com', username='test_username2',
+                                                        firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': follower.email, 'password': 'testpassword'})
+        headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+        self.client.post(reverse('user-follow'), {'user': self.new_user.id}, **headers)
+
+        first_page = self.client.get(reverse('homepage') + '?page_size=3', **headers)
+        second_page = self.client.get(first_page.data['next'], **headers)
+        self.assertEqual([tweet['id'] for tweet in first_page.data['results'] + second_page.data['results']],
+                         [tweet.id for tweet in reversed(self.tweets)])
+        self.assertIsNone(second_page.data['next'])
+
+
+class TestUserTypeahead(APITestCase):
+    def setUp(self):
+        for i in range(5):
+            get_user_model().objects.create_user(email=f'test{i}@gmail.com', username=f'typeahead{i}', firstname='test_firstname',
+                                                 lastname='test_lastname', password='testpassword')
+        typeahead_index.build()
+
+    def test_typeahead_results(self):
+        """Test the typeahead returns at most limit matching users with one query"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user-typeahead') + '?search=TypeAhead&limit=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 3)
+        self.assertTrue(all(user['username'].startswith('typeahead') for user in response.data))
+        self.assertEqual(len(queries), 1)
+
+    def test_empty_search(self):
+        """Test an empty search returns no users"""
+        response = self.client.get(reverse('user-typeahead'))
+        self.assertEqual(response.data, [])
+
+
+class TestResponseCache(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = get_user_model().objects.create_user(email='author@gmail.com', username='author', firstname='test_firstname',
+                                                           lastname='test_lastname', password='testpassword', is_active=True)
+        self.reader = get_user_model().objects.create_user(email='reader@gmail.com', username='reader', firstname='test_firstname',
+                                                           lastname='test_lastname', password='testpassword', is_active=True)
+        self.tweet = Tweet.objects.create(content='cached tweet', user=self.author)
+
+    def test_second_read_is_served_from_cache(self):
+        """Test an unchanged tweet is read from the database once"""
+        url = reverse('tweet-detail', args=[self.tweet.id])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.data['content'], 'cached tweet')
+        self.assertEqual(len(queries), 0)
+
+    def test_change_while_building_is_not_cached(self):
+        """Test a response is not cached when one of its resources changes while it is built"""
+        url = reverse('tweet-detail', args=[self.tweet.id])
+        get_cache_dependencies = TweetDetailView.get_cache_dependencies
+
+        def edited_while_building(view, data):
+            # The edit commits after the tweet was read, before the versions are
+            Tweet.objects.filter(pk=self.tweet.pk).update(content='edited')
+            invalidate(f'tweet:{self.tweet.id}')
+            return get_cache_dependencies(view, data)
+
+        with mock.patch.object(TweetDetailView, 'get_cache_dependencies', edited_while_building):
+            self.assertEqual(self.client.get(url).data['content'], 'cached tweet')
+        self.assertEqual(self.client.get(url).data['content'], 'edited')
+
+    def test_changes_invalidate_the_responses_built_from_them(self):
+        """Test likes, tweet edits and follows make the cached responses stale"""
+        tweet_url = reverse('tweet-detail', args=[self.tweet.id])
+        profile_url = reverse('profile', args=[self.author.username])
+        followers_url = reverse('followers', args=[self.author.username])
+        for url in (tweet_url, profile_url, followers_url):
+            self.client.get(url)
+        Like.objects.create(user=self.reader, tweet=self.tweet)
+        self.assertEqual(len(self.client.get(tweet_url).data['likes']), 1)
+        self.tweet.content = 'edited'
+        self.tweet.save()
+        self.assertEqual(self.client.get(tweet_url).data['content'], 'edited')
+        Follow.objects.create(user=self.author, follower=self.reader)
+        get_user_model().objects.filter(pk=self.author.pk).update(followers_count=1)
+        self.assertEqual(self.client.get(profile_url).data['follows']['followers_count'], 1)
+        self.assertEqual(len(self.client.get(followers_url).data['results']), 1)
+
+    def test_cache_stats(self):
+        """Test the cache stats count hits and misses and are only shown to admins"""
+        self.client.get(reverse('explore'))
+        self.client.get(reverse('explore'))
+        self.assertEqual(self.client.get(reverse('cache-stats')).status_code, 401)
+        self.author.is_staff = True
+        self.author.save()
+        response = self.client.post(reverse('token_obtain_pair'), {'email': self.author.email, 'password': 'testpassword'})
+        response = self.client.get(reverse('cache-stats'), HTTP_AUTHORIZATION=f'JWT {response.data["access"]}')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.data['hits'], 1)
+        self.assertGreaterEqual(response.data['misses'], 1)
+        self.assertIn('evictions', response.data)
+
+    def test_feed_stats(self):
+        """Test the feed stats count home page reads and are only shown to admins"""
+        self.assertEqual(self.client.get(reverse('feed-stats')).status_code, 401)
+        self.author.is_staff = True
+        self.author.save()
+        response = self.client.post(reverse('token_obtain_pair'), {'email': self.author.email, 'password': 'testpassword'})
+        headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+        self.client.get(reverse('homepage'), **headers)
+        response = self.client.get(reverse('feed-stats'), **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.data['reads'], 1)
+
+
+class TestViewerState(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.viewer = get_user_model().objects.create_user(email='viewer@gmail.com', username='viewer', firstname='test_firstname',
+                                                           lastname='test_lastname', password='testpassword', is_active=True)
+        self.author = get_user_model().objects.create_user(email='author@gmail.com', username='author', firstname='test_firstname',
+                                                           lastname='test_lastname', password='testpassword', is_active=True)
+        self.liked = Tweet.objects.create(content='liked', user=self.author)
+        self.saved = Tweet.objects.create(content='saved', user=self.author)
+        self.like = Like.objects.create(user=self.viewer, tweet=self.liked)
+        SaveTweet.objects.create(user=self.viewer, tweet=self.saved)
+        self.follow = Follow.objects.create(user=self.author, follower=self.viewer)
+        response = self.client.post(reverse('token_obtain_pair'), {'email': self.viewer.email, 'password': 'testpassword'})
+        self.headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+
+    def test_viewer_state_endpoint(self):
+        """Test the flags of several tweets and users come back with a constant number of queries"""
+        url = reverse('viewer-state') + f'?tweets={self.liked.id},{self.saved.id}&users=author,viewer,nobody'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tweets'][self.liked.id], {
+            'liked': True, 'like_id': self.like.id, 'bookmarked': False, 'following_author': True})
+        self.assertEqual(response.data['tweets'][self.saved.id]['bookmarked'], True)
+        self.assertEqual(response.data['users']['author'], {'following': True, 'follow_id': self.follow.id})
+        self.assertEqual(response.data['users']['nobody'], {'following': False, 'follow_id': None})
+        # The user, the tweets, then one query for likes, bookmarks, followed authors and followed users
+        self.assertEqual(len(queries), 6)
+
+    def test_viewer_state_needs_authentication(self):
+        """Test the endpoint is only for logged in users"""
+        self.assertEqual(self.client.get(reverse('viewer-state')).status_code, 401)
+
+    def test_inline_viewer_state(self):
+        """Test list and detail endpoints embed the flags when asked and never cache them"""
+        url = reverse('tweet-list', args=[self.author.username]) + '?include=viewer_state'
+        response = self.client.get(url, **self.headers)
+        states = {tweet['id']: tweet['viewer_state'] for tweet in response.data['results']}
+        self.assertTrue(states[self.liked.id]['liked'])
+        self.assertTrue(states[self.saved.id]['bookmarked'])
+        detail_url = reverse('tweet-detail', args=[self.liked.id])
+        self.assertNotIn('viewer_state', self.client.get(detail_url, **self.headers).data)
+        self.assertTrue(self.client.get(detail_url + '?include=viewer_state', **self.headers).data['viewer_state']['liked'])
+        response = self.client.get(reverse('bookmarks-list') + '?include=viewer_state', **self.headers)
+        self.assertTrue(response.data['results'][0]['tweet']['viewer_state']['bookmarked'])
+
+
+class TestLoadTestCommand(SimpleTestCase):
+    """load_test against a small HTTP server answering 200 on /ok and 404 everywhere else"""
+
+    def setUp(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200 if self.path == '/ok' else 404)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = f'http://127.0.0.1:{server.server_port}'
+
+    def test_one_success(self):
+        """Test a single successful request reports its latency instead of percentiles"""
+        output = StringIO()
+        call_command('load_test', f'{self.url}/ok', '--requests', '1', '--concurrency', '1', stdout=output)
+        self.assertIn('0 errors', output.getvalue())
+        self.assertIn('latency ', output.getvalue())
+
+    def test_failures(self):
+        """Test failed requests are counted by reason and a run without any success fails"""
+        output = StringIO()
+        with self.assertRaisesMessage(CommandError, 'All 3 requests failed'):
+            call_command('load_test', f'{self.url}/missing', '--requests', '3', '--concurrency', '2', stdout=output)
+        self.assertIn('3 x HTTP 404', output.getvalue())
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    """Counts the connections opened and refuses to deliver to bad@ addresses"""
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        if any(message.to[0].startswith('bad@') for message in messages):
+            raise smtplib.SMTPRecipientsRefused({})
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='api.tests.CountingEmailBackend', EMAIL_MAX_ATTEMPTS=2)
+class TestEmailQueue(APITestCase):
+    def test_signup_queues_the_verification_email(self):
+        """Test signing up stores the email in the outbox instead of sending it"""
+        self.client.post(reverse('signup'), data={'email': 'test_user@gmail.com', 'username': 'test_username',
+                                                  'firstname': 'test_firstname', 'lastname': 'test_lastname', 'password': 'testpassword'})
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.to_email, email.status), ('test_user@gmail.com', OutboundEmail.PENDING))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_worker_sends_a_batch_over_one_connection(self):
+        """Test the worker delivers every due email with a single connection"""
+        for i in range(3):
+            queue_email('subject', 'body', f'user{i}@gmail.com')
+        CountingEmailBackend.opened = 0
+        call_command('send_queued_emails', '--once', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT).exists())
+
+    def test_failures_are_retried_with_backoff(self):
+        """Test a failed email waits before its next attempt and is given up after EMAIL_MAX_ATTEMPTS"""
+        email = queue_email('subject', 'body', 'bad@gmail.com')
+        self.assertEqual(send_queued_emails(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.PENDING, 1))
+        self.assertGreater(email.next_attempt, timezone.now())
+        self.assertEqual(send_queued_emails(), (0, 0))
+        OutboundEmail.objects.update(next_attempt=timezone.now())
+        send_queued_emails()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.FAILED, 2))
+
+
+class TestAsyncViews(TransactionTestCase):
+    """The async views as served under ASGI, committed data so the database threads see it"""
+
+    def setUp(self):
+        cache.clear()
+        self.new_user = get_user_model().objects.create_user(email='test_user@gmail.com', username='test_username',
+                                                             firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.tweet = Tweet.objects.create(content='async tweet', user=self.new_user)
+        Reply.objects.create(text='async reply', user=self.new_user, tweet=self.tweet)
+        self.factory = AsyncRequestFactory()
+
+    async def test_read_views(self):
+        """Test the async views answer like their sync counterparts from the database thread pool"""
+        response = await async_views.tweet_detail(self.factory.get('/'), pk=self.tweet.id)
+        self.assertEqual(json.loads(response.content)['content'], 'async tweet')
+        response = await async_views.profile(self.factory.get('/'), username=self.new_user.username)
+        self.assertEqual(json.loads(response.content)['username'], self.new_user.username)
+        response = await async_views.replies(self.factory.get('/'), tweet_id=self.tweet.id)
+        self.assertEqual(json.loads(response.content)['results'][0]['text'], 'async reply')
+        response = await async_views.home(self.factory.get('/'))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(ASYNC_DB_THREADS=0)
+    async def test_request_thread_mode(self):
+        """Test the views also run without the thread pool"""
+        response = await async_views.tweet_detail(self.factory.get('/'), pk=self.tweet.id + 1)
+        self.assertEqual(response.status_code, 404)
+
+
+class TestQueryBudget(APITestCase):
+    """The number of queries of an endpoint must not grow with the size of the page"""
+    # With a cold cache, includes the query loading the user of the token and the
+    # one summing the like counter shards
+    budgets = {
+        'homepage': 7,
+        'homepage-anonymous': 3,
+        'tweet-list': 5,
+        'search-tweets': 4,
+        'search-users': 2,
+        'explore': 4,
+        'bookmarks-list': 5,
+        'followers': 3,
+        'followings': 3,
+        'list-like': 3,
+        'list-create-reply': 3,
+        'tweet-detail': 4,
+        'profile': 2,
+        'homepage-viewer-state': 10,
+        'homepage-compact': 7,
+        'bookmarks-compact': 5,
+        'conversation': 3,
+        'notifications': 3,
+    }
+
+    def setUp(self):
+        self.viewer = get_user_model().objects.create_user(email='viewer@gmail.com', username='viewer',
+                                                           firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.viewer.email, 'password': 'testpassword'})
+        self.headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+
+    def create_data(self, size):
+        """Create size authors followed by the viewer, each with a tweet that is liked, replied and saved"""
+        for i in range(size):
+            author = get_user_model().objects.create_user(email=f'author{size}_{i}@gmail.com', username=f'author{size}_{i}',
+                                                          firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+            self.client.post(reverse('user-follow'), {'user': author.id}, **self.headers)
+            Follow.objects.create(user=self.viewer, follower=author)
+            tweet = Tweet.objects.create(content=f'budget tweet {size}', user=author)
+            fan_out_tweet(tweet)
+            Like.objects.create(user=author, tweet=tweet)
+            Like.objects.create(user=self.viewer, tweet=tweet)
+            Reply.objects.create(text='reply', user=author, tweet=self.root_tweet)
+            SaveTweet.objects.create(user=self.viewer, tweet=tweet)
+            Like.objects.create(user=author, tweet=self.root_tweet)
+            fan_out_retweet(Retweet.objects.create(user=author, tweet=self.other_tweet))
+            notify(self.viewer.id, author.id, NotificationEvent.LIKE, self.root_tweet.id)
+            notify(self.viewer.id, author.id, NotificationEvent.RETWEET, self.other_tweet.id)
+            notify(self.viewer.id, author.id, NotificationEvent.FOLLOW)
+        aggregate_notifications()
+        compute_trending()
+
+    def count_queries(self, name, **kwargs):
+        urls = {
+            'homepage': reverse('homepage'),
+            'homepage-anonymous': reverse('homepage'),
+            'tweet-list': reverse('tweet-list', args=[self.viewer.username]),
+            'search-tweets': reverse('search-tweets') + '?search=budget',
+            'search-users': reverse('search-users') + '?search=author',
+            'explore': reverse('explore'),
+            'bookmarks-list': reverse('bookmarks-list'),
+            'followers': reverse('followers', args=[self.viewer.username]),
+            'followings': reverse('followings', args=[self.viewer.username]),
+            'list-like': reverse('list-like', args=[self.root_tweet.id]),
+            'list-create-reply': reverse('list-create-reply', args=[self.root_tweet.id]),
+            'tweet-detail': reverse('tweet-detail', args=[self.root_tweet.id]),
+            'profile': reverse('profile', args=[self.viewer.username]),
+            'homepage-viewer-state': reverse('homepage') + '?include=viewer_state',
+            'homepage-compact': reverse('homepage') + '?tweets=compact',
+            'bookmarks-compact': reverse('bookmarks-list') + '?tweets=compact',
+            'conversation': reverse('conversation', args=[self.root_tweet.id]),
+            'notifications': reverse('notifications'),
+        }
+        headers = {} if name == 'homepage-anonymous' else self.headers
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(urls[name], **headers)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_budget_per_endpoint(self):
+        """Test every list endpoint stays within its query budget for a small and a full page"""
+        self.root_tweet = Tweet.objects.create(content='budget root tweet', user=self.viewer)
+        self.other_tweet = Tweet.objects.create(content='budget retweeted tweet', user=self.viewer,
+                                                quoted_tweet=self.root_tweet)
+        self.create_data(2)
+        small = {name: self.count_queries(name) for name in self.budgets}
+        self.create_data(15)
+        large = {name: self.count_queries(name) for name in self.budgets}
+        for name, budget in self.budgets.items():
+            with self.subTest(endpoint=name):
+                self.assertEqual(small[name], large[name])
+                self.assertLessEqual(large[name], budget)
+
+
+class TestQueryBudgetMiddleware(APITestCase):
+    """The query count and database time every request reports and is held to"""
+
+    def setUp(self):
+        cache.clear()
+        self.new_user = get_user_model().objects.create_user(email='test_user@gmail.com', username='test_username',
+                                                             firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        Tweet.objects.create(content='budget tweet', user=self.new_user)
+        self.url = reverse('profile', args=[self.new_user.username])
+
+    @override_settings(QUERY_BUDGET_HEADERS=True)
+    def test_headers(self):
+        """Test the response tells how many queries ran and how long they took"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+        self.assertGreaterEqual(float(response['X-DB-Time']), 0)
+
+    @override_settings(QUERY_BUDGET_HEADERS=False)
+    def test_no_headers_by_default(self):
+        """Test the query count and time are kept out of the responses unless the headers are turned on"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-DB-Queries', response)
+        self.assertNotIn('X-DB-Time', response)
+
+    @override_settings(QUERY_BUDGET_MAX_QUERIES=0)
+    def test_log_over_budget(self):
+        """Test a request over the budget is logged and still answered"""
+        with self.assertLogs('backend.middleware', 'WARNING') as logs:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.url, logs.output[0])
+
+    @override_settings(QUERY_BUDGET_MAX_QUERIES=0, QUERY_BUDGET_ACTION='reject')
+    def test_reject_over_budget(self):
+        """Test a request over the budget fails in reject mode"""
+        with self.assertLogs('django.request', 'ERROR'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('queries', response.json()['detail'])
+
+    @override_settings(QUERY_BUDGET_MAX_DB_TIME=0, QUERY_BUDGET_ACTION='reject')
+    def test_reject_over_time_budget(self):
+        """Test the query after the database time ran out is not run and the request fails cleanly"""
+        with self.assertLogs('django.request', 'ERROR'):
+            response = self.client.get(reverse('tweet-list', args=[self.new_user.username]))
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('of queries', response.json()['detail'])
+        stats = middleware.QueryStats()
+        stats.duration = 1
+        token = middleware._request_stats.set(stats)
+        execute = mock.Mock()
+        try:
+            with self.assertRaises(middleware.QueryBudgetExceeded):
+                middleware.record_query(execute, 'SELECT 1', None, False, {})
+        finally:
+            middleware._request_stats.reset(token)
+        execute.assert_not_called()
+
+    @override_settings(QUERY_BUDGET_ACTION='off')
+    def test_off(self):
+        """Test nothing is counted when the budget is off"""
+        response = self.client.get(self.url)
+        self.assertNotIn('X-DB-Queries', response)
+
+
+class TestCachedJWTAuthentication(APITestCase):
+    """The users and blacklist statuses of tokens are read from the cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.new_user = get_user_model().objects.create_user(email='test_user@gmail.com', username='test_username',
+                                                             firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.tokens = self.client.post(reverse('token_obtain_pair'), {
+            'email': self.new_user.email, 'password': 'testpassword'}).data
+        self.request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'JWT {self.tokens["access"]}')
+
+    def test_user_cached(self):
+        """Test only the first request of a user loads it from the database"""
+        user, token = CachedJWTAuthentication().authenticate(self.request)
+        with self.assertNumQueries(0):
+            cached_user, token = CachedJWTAuthentication().authenticate(self.request)
+        self.assertEqual(cached_user, user)
+
+    def test_user_saved(self):
+        """Test a saved or deactivated user is loaded again"""
+        CachedJWTAuthentication().authenticate(self.request)
+        self.new_user.firstname = 'changed'
+        self.new_user.save()
+        user, token = CachedJWTAuthentication().authenticate(self.request)
+        self.assertEqual(user.firstname, 'changed')
+        self.new_user.is_active = False
+        self.new_user.save()
+        with self.assertRaises(AuthenticationFailed):
+            CachedJWTAuthentication().authenticate(self.request)
+
+    @override_settings(TOKEN_BLACKLIST_CACHE_TIMEOUT=None)
+    def test_refresh_blacklist(self):
+        """Test a rotated refresh token is refused without a blacklist lookup"""
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            reused = self.client.post(reverse('token_refresh'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(reused.status_code, 401)
+        cache.clear()
+        reused = self.client.post(reverse('token_refresh'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(reused.status_code, 401)
+        response = self.client.post(reverse('token_refresh'), {'refresh': response.data['refresh']})
+        self.assertEqual(response.status_code, 200)
+
+
+class TestRetweets(APITestCase):
+    def setUp(self):
+        self.new_user_1 = get_user_model().objects.create_user(email='test_user1@gmail.com', username='test_username1',
+                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.new_user_2 = get_user_model().objects.create_user(email='test_user2@gmail.com', username='test_username2',
+                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.new_user_1.email, 'password': 'testpassword'})
+        self.headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.new_user_2.email, 'password': 'testpassword'})
+        self.follower_headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+        Follow.objects.create(user=self.new_user_1, follower=self.new_user_2)
+        self.tweet = Tweet.objects.create(content='some test', user=self.new_user_2)
+
+    def test_retweet_reaches_the_followers(self):
+        """Test a retweet is counted once and shows up in the followers' home page"""
+        url = reverse('create-retweet', args=[self.tweet.id])
+        self.assertEqual(self.client.post(url, **self.headers).status_code, 201)
+        self.assertEqual(self.client.post(url, **self.headers).status_code, 400)
+        home = self.client.get(reverse('homepage'), **self.follower_headers).data['results']
+        self.assertEqual([(tweet['id'], tweet['retweeted_by']) for tweet in home],
+                         [(self.tweet.id, self.new_user_1.username)])
+        self.assertEqual(home[0]['retweet_count'], 1)
+
+        response = self.client.delete(reverse('delete-retweet', args=[self.tweet.id]), **self.headers)
+        self.assertEqual(response.status_code, 204)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.retweet_count, 0)
+        self.assertEqual(self.client.get(reverse('homepage'), **self.follower_headers).data['results'], [])
+
+    def test_quote_tweet(self):
+        """Test a quote tweet shows the tweet it quotes and counts towards its quotes"""
+        response = self.client.post(reverse('add_tweet'), {'content': 'quote', 'quoted_tweet': self.tweet.id},
+                                    **self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quoted_tweet']['user']['username'], self.new_user_2.username)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.quote_count, 1)
+        home = self.client.get(reverse('homepage'), **self.follower_headers).data['results']
+        self.assertEqual(home[0]['quoted_tweet']['id'], self.tweet.id)
+
+
+class TestNotifications(APITestCase):
+    def setUp(self):
+        self.author = get_user_model().objects.create_user(email='test_user1@gmail.com', username='test_username1',
+                                                           firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.author.email, 'password': 'testpassword'})
+        self.headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+        self.tweet = Tweet.objects.create(content='some test', user=self.author)
+        self.fans = []
+        for i in range(4):
+            fan = get_user_model().objects.create_user(email=f'fan{i}@gmail.com', username=f'fan{i}',
+                                                       firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+            response = self.client.post(reverse('token_obtain_pair'), {'email': fan.email, 'password': 'testpassword'})
+            self.client.post(reverse('create-like', args=[self.tweet.id]),
+                             HTTP_AUTHORIZATION=f'JWT {response.data["access"]}')
+            self.fans.append(fan)
+
+    def test_likes_are_grouped(self):
+        """Test the likes of a tweet become one notification with the latest likers"""
+        self.assertEqual(self.client.get(reverse('notifications-unread'), **self.headers).data, {'unread': 0})
+        call_command('aggregate_notifications', '--once', stdout=StringIO())
+        self.assertEqual(self.client.get(reverse('notifications-unread'), **self.headers).data, {'unread': 1})
+        notifications = self.client.get(reverse('notifications'), **self.headers).data['results']
+        self.assertEqual(len(notifications), 1)
+        self.assertEqual((notifications[0]['verb'], notifications[0]['actor_count']), ('like', 4))
+        self.assertEqual([actor['username'] for actor in notifications[0]['actors']], ['fan3', 'fan2', 'fan1'])
+        self.assertEqual(notifications[0]['tweet']['id'], self.tweet.id)
+
+    def test_mark_read(self):
+        """Test marking the notifications read resets the counter and starts a new notification"""
+        aggregate_notifications()
+        self.assertEqual(self.client.post(reverse('notifications-unread'), **self.headers).data, {'unread': 0})
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.unread_notifications, 0)
+        fan_headers = {'HTTP_AUTHORIZATION': 'JWT ' + self.client.post(reverse('token_obtain_pair'), {
+            'email': self.fans[0].email, 'password': 'testpassword'}).data['access']}
+        self.client.post(reverse('user-follow'), {'user': self.author.id}, **fan_headers)
+        aggregate_notifications()
+        notifications = self.client.get(reverse('notifications') + '?page_size=1', **self.headers).data
+        self.assertEqual([(n['verb'], n['is_read']) for n in notifications['results']], [('follow', False)])
+        self.assertEqual(self.client.get(notifications['next'], **self.headers).data['results'][0]['is_read'], True)
+
+    def test_notifications_need_authentication(self):
+        """Test the notifications of an anonymous user can't be read"""
+        self.assertEqual(self.client.get(reverse('notifications')).status_code, 401)
+
+
+class TestDirectMessages(APITestCase):
+    def setUp(self):
+        self.new_user_1 = get_user_model().objects.create_user(email='test_user1@gmail.com', username='test_username1',
+                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.new_user_2 = get_user_model().objects.create_user(email='test_user2@gmail.com', username='test_username2',
+                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.new_user_1.email, 'password': 'testpassword'})
+        self.headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.new_user_2.email, 'password': 'testpassword'})
+        self.other_headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+
+    def test_conversation(self):
+        """Test sending messages, syncing after a seq and reading them"""
+        response = self.client.post(reverse('messages'), {'users': [self.new_user_2.id]}, **self.headers)
+        self.assertEqual(response.status_code, 201)
+        url = reverse('conversation-messages', args=[response.data['id']])
+        for text in ('hi', 'how are you', 'bye'):
+            response = self.client.post(url, {'text': text}, **self.headers)
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['seq'], 3)
+
+        messages = self.client.get(url + '?after=1', **self.other_headers).data['results']
+        self.assertEqual([(message['seq'], message['text']) for message in messages], [(2, 'how are you'), (3, 'bye')])
+        inbox = self.client.get(reverse('messages'), **self.other_headers).data['results']
+        self.assertEqual((inbox[0]['last_seq'], inbox[0]['unread']), (3, 3))
+        self.client.post(reverse('conversation-read', args=[inbox[0]['id']]), {'seq': 2}, **self.other_headers)
+        inbox = self.client.get(reverse('messages'), **self.other_headers).data['results']
+        self.assertEqual(inbox[0]['unread'], 1)
+        self.assertEqual(self.client.post(reverse('messages'), {'users': [self.new_user_1.id]},
+                                          **self.other_headers).data['id'], inbox[0]['id'])
+
+    def test_only_participants_read_a_conversation(self):
+        """Test a user outside a conversation can't read or write it"""
+        new_user_3 = get_user_model().objects.create_user(email='test_user3@gmail.com', username='test_username3',
+                                                          firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        conversation_id = self.client.post(reverse('messages'), {'users': [new_user_3.id]}, **self.headers).data['id']
+        url = reverse('conversation-messages', args=[conversation_id])
+        self.assertEqual(self.client.get(url, **self.other_headers).status_code, 404)
+        self.assertEqual(self.client.post(url, {'text': 'hi'}, **self.other_headers).status_code, 404)
+        self.assertEqual(self.client.post(reverse('messages'), {'users': [self.new_user_1.id]},
+                                          **self.headers).status_code, 400)
+
+
+class TestMessageLongPoll(TransactionTestCase):
+    """The long-poll of api.async_views.messages, committed data so the database threads see it"""
+
+    def setUp(self):
+        cache.clear()
+        self.new_user_1 = get_user_model().objects.create_user(email='test_user1@gmail.com', username='test_username1',
+                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.new_user_2 = get_user_model().objects.create_user(email='test_user2@gmail.com', username='test_username2',
+                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.conversation = start_conversation(self.new_user_1.id, [self.new_user_2.id])
+        # AsyncRequestFactory takes the header names as they are in the ASGI scope
+        self.headers = {'authorization': f'JWT {RefreshToken.for_user(self.new_user_2).access_token}'}
+        self.factory = AsyncRequestFactory()
+
+    async def test_waits_for_the_next_message(self):
+        """Test a read with nothing new returns as soon as a message is sent"""
+        poll = asyncio.ensure_future(async_views.messages(
+            self.factory.get('/?after=0&wait=10', **self.headers), conversation_id=self.conversation.id))
+        await asyncio.sleep(0.5)
+        self.assertFalse(poll.done())
+        await async_views.in_database_thread(send_message, self.conversation.id, self.new_user_1.id, 'hi')
+        response = await asyncio.wait_for(poll, 5)
+        self.assertEqual([message['text'] for message in json.loads(response.content)['results']], ['hi'])
+
+    @override_settings(MESSAGES_LONG_POLL_TIMEOUT=1)
+    async def test_times_out(self):
+        """Test a read with nothing new returns an empty page after the timeout"""
+        response = await async_views.messages(
+            self.factory.get('/?wait=10', **self.headers), conversation_id=self.conversation.id)
+        self.assertEqual(json.loads(response.content)['results'], [])
+
+
+class ASGIConnection:
+    """Drives an ASGI application like the server does, for one connection"""
+
+    def __init__(self, application, scope):
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+        self.task = asyncio.ensure_future(application(scope, self.inbox.get, self.outbox.put))
+
+    async def output(self, timeout=5):
+        return await asyncio.wait_for(self.outbox.get(), timeout)
+
+    async def close(self, message_type):
+        await self.inbox.put({'type': message_type})
+        await asyncio.wait_for(self.task, 5)
+
+
+class TestFeedPush(TransactionTestCase):
+    """The new tweets stream of backend.asgi, with the local broker"""
+
+    def setUp(self):
+        cache.clear()
+        self.follower = get_user_model().objects.create_user(email='test_user1@gmail.com', username='test_username1',
+                                                             firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.author = get_user_model().objects.create_user(email='test_user2@gmail.com', username='test_username2',
+                                                           firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.token = RefreshToken.for_user(self.follower).access_token
+        self.application = FeedStream(async_views.home)
+
+    def scope(self, scope_type, query=''):
+        return {'type': scope_type, 'path': settings.PUSH_PATH, 'method': 'GET', 'headers': [],
+                'query_string': f'token={self.token}{query}'.encode()}
+
+    def post(self, user, url, data=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post(url, data or {})
+
+    def test_redis_broker_without_redis(self):
+        """Test the Redis broker fails with a clear error when redis is not installed"""
+        with mock.patch.dict(sys.modules, {'redis': None}), self.assertRaisesMessage(
+                ImproperlyConfigured, 'redis is not installed'):
+            RedisBroker()
+
+    def test_broker_errors_do_not_fail_the_write(self):
+        """Test a tweet is saved and answered with 201 when the broker can't publish it"""
+        broker = mock.Mock()
+        broker.publish.side_effect = ConnectionError('broker down')
+        with mock.patch('api.realtime.get_broker', return_value=broker), \
+                self.assertLogs('api.realtime', 'ERROR'):
+            response = self.post(self.author, reverse('add_tweet'), {'content': 'saved'})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(broker.publish.called)
+        self.assertTrue(Tweet.objects.filter(content='saved').exists())
+
+    async def test_event_stream(self):
+        """Test a follower's event stream gets the new tweet of the author"""
+        await async_views.in_database_thread(
+            self.post, self.follower, reverse('user-follow'), {'user': self.author.id})
+        connection = ASGIConnection(self.application, self.scope('http'))
+        start = await connection.output()
+        self.assertEqual((start['status'], dict(start['headers'])[b'content-type']), (200, b'text/event-stream'))
+
+        await async_views.in_database_thread(self.post, self.author, reverse('add_tweet'), {'content': 'pushed'})
+        body = (await connection.output())['body'].decode()
+        self.assertTrue(body.startswith('event: tweet\n'))
+        event = json.loads(body.split('data: ', 1)[1])
+        self.assertEqual((event['tweet']['content'], event['tweet']['user_id']), ('pushed', self.author.id))
+        self.assertIn(str(self.author.id), event['users'])
+        await connection.close('http.disconnect')
+        self.assertEqual(push_hub.connection_count(), 0)
+
+    @override_settings(PUSH_HINT_INTERVAL=0.2)
+    async def test_websocket_hints(self):
+        """Test a hint WebSocket counts the tweets of users followed after it connected"""
+        connection = ASGIConnection(self.application, self.scope('websocket', '&mode=hint'))
+        await connection.inbox.put({'type': 'websocket.connect'})
+        self.assertEqual((await connection.output())['type'], 'websocket.accept')
+        await async_views.in_database_thread(
+            self.post, self.follower, reverse('user-follow'), {'user': self.author.id})
+        for content in ('first', 'second'):
+            await async_views.in_database_thread(self.post, self.author, reverse('add_tweet'), {'content': content})
+        message = await connection.output()
+        self.assertEqual(json.loads(message['text']), {'type': 'new_tweets', 'count': 2})
+        await connection.close('websocket.disconnect')
+
+    async def test_invalid_token(self):
+        """Test a stream needs a valid access token"""
+        self.token = 'invalid'
+        connection = ASGIConnection(self.application, self.scope('websocket'))
+        await connection.inbox.put({'type': 'websocket.connect'})
+        self.assertEqual(await connection.output(), {'type': 'websocket.close', 'code': 4401})
+        connection = ASGIConnection(self.application, self.scope('http'))
+        self.assertEqual((await connection.output())['status'], 401)
+
+
+class TestCounterColumns(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.new_user_1 = get_user_model().objects.create_user(email='test_user1@gmail.com', username='test_username1',
+                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        self.new_user_2 = get_user_model().objects.create_user(email='test_user2@gmail.com', username='test_username2',
+                                                               firstname='test_firstname', lastname='test_lastname', password='testpassword', is_active=True)
+        response = self.client.post(reverse('token_obtain_pair'), {
+                                    'email': self.new_user_1.email, 'password': 'testpassword'})
+        self.headers = {'HTTP_AUTHORIZATION': f'JWT {response.data["access"]}'}
+
+    def test_counters_follow_the_views(self):
+        """Test creating and deleting through the api keeps the counter columns up to date"""
+        self.client.post(reverse('add_tweet'), {'content': 'new tweet'}, **self.headers)
+        tweet = Tweet.objects.get(content='new tweet')
+        self.client.post(reverse('create-like', args=[tweet.id]), **self.headers)
+        self.client.post(reverse('list-create-reply', args=[tweet.id]), {'text': 'reply'}, **self.headers)
+        self.client.post(reverse('user-follow'), {'user': self.new_user_2.id}, **self.headers)
+
+        tweet.refresh_from_db()
+        self.new_user_1.refresh_from_db()
+        self.new_user_2.refresh_from_db()
+        self.assertEqual((tweet.get_likes, tweet.reply_count), (1, 1))
+        self.assertEqual((self.new_user_1.tweet_count, self.new_user_1.following_count), (1, 1))
+        self.assertEqual(self.new_user_2.followers_count, 1)
+
+        like = Like.objects.get(tweet=tweet)
+        self.client.delete(reverse('delete-like', args=[like.id]), **self.headers)
+        self.client.delete(reverse('user-unfollow-with-username', args=[self.new_user_2.username]), **self.headers)
+        tweet.refresh_from_db()
+        self.new_user_2.refresh_from_db()
+        self.assertEqual(tweet.get_likes, 0)
+        self.assertEqual(self.new_user_2.followers_count, 0)
+
+        response = self.client.get(reverse('profile', args=[self.new_user_1.username]))
+        self.assertEqual(response.data['tweet_number'], 1)
+        self.assertEqual(response.data['follows'], {'followings_count': 0, 'followers_count': 0})
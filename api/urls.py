@@ -1,29 +1,46 @@
 from django.urls import path
+from django.conf import settings
 from . import views
-
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
-    TokenRefreshView,
     TokenVerifyView
 )
 
+if settings.ASYNC_VIEWS:
+    from . import async_views
+    home_view = async_views.home
+    tweet_detail_view = async_views.tweet_detail
+    profile_view = async_views.profile
+    replies_view = async_views.replies
+    messages_view = async_views.messages
+else:
+    home_view = views.HomePageView.as_view()
+    tweet_detail_view = views.TweetDetailView.as_view()
+    profile_view = views.ProfileDetailView.as_view()
+    replies_view = views.ListCreateReplyView.as_view()
+    messages_view = views.MessageListView.as_view()
+
 urlpatterns = [
     path('', views.SignUpView.as_view(), name='signup'),
     path('verify-email/', views.VerifyEmail.as_view(), name='verify-email'),
     path('token/', views.MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/refresh/', views.MyTokenRefreshView.as_view(), name='token_refresh'),
     path('token/verify/', TokenVerifyView.as_view(), name='token_verify'),
-    path('home', views.HomePageView.as_view(), name='homepage'),
-    path('search-tweets/', views.TweetListSearchResults.as_view(), name='search'),
-    path('search-users/', views.UserListSearchResults.as_view(), name='search'),
+    path('home', home_view, name='homepage'),
+    path('search-tweets/', views.TweetListSearchResults.as_view(), name='search-tweets'),
+    path('search-users/', views.UserListSearchResults.as_view(), name='search-users'),
+    path('search-users/typeahead', views.UserTypeaheadView.as_view(), name='user-typeahead'),
     path('explore', views.ExploreView.as_view(), name='explore'),
-    # path('notifications', views.NotificationsView.as_view(), name='notifications'),
-    # path('messages', views.MessagesView.as_view(), name='messages')  # Chat App
+    path('notifications', views.NotificationsView.as_view(), name='notifications'),
+    path('notifications/unread', views.UnreadNotificationsView.as_view(), name='notifications-unread'),
+    path('messages', views.ConversationListView.as_view(), name='messages'),
+    path('messages/<int:conversation_id>', messages_view, name='conversation-messages'),
+    path('messages/<int:conversation_id>/read', views.MarkConversationReadView.as_view(), name='conversation-read'),
     path('suggested-users', views.SuggestedUsersView.as_view(), name='suggested-users'),
     path('follow-request/', views.UserFollowView.as_view(), name='user-follow'),
     path('profiles/<int:pk>/follow/delete', views.UserUnfollowWithIdView.as_view(), name='user-unfollow-with-follow-obj-id'),
     path('unfollow/<str:username>', views.UserUnfollowWithUsernameView.as_view(), name='user-unfollow-with-username'),
-    path('profiles/<str:username>', views.ProfileDetailView.as_view(), name='profile'),
+    path('profiles/<str:username>', profile_view, name='profile'),
     path('follow/<str:username>/check', views.FollowCheckView.as_view(), name='follow-check'),
     path('profiles/<str:username>/followers', views.FollowersListView.as_view(), name='followers'),
     path('profiles/<str:username>/followings', views.FollowingsListView.as_view(), name='followings'),
@@ -32,14 +49,21 @@ urlpatterns = [
     path('remove-like/<int:pk>', views.DeleteLikeView.as_view(), name='delete-like'),
     path('list-tweet-likes/<int:tweet_id>', views.ListLikeView.as_view(), name='list-like'),
     path('like/<int:tweet_id>/check', views.LikeCheckView.as_view(), name='like-check'),
+    path('viewer-state', views.ViewerStateView.as_view(), name='viewer-state'),
     # # path('<str:username>/lists', views.ListsView.as_view(), name='lists'),
     path('compose/tweet', views.AddTweetView.as_view(), name='add_tweet'),
     path('bookmarks', views.BookMarksListView.as_view(), name='bookmarks-list'),
     path('bookmarks/<int:tweet_id>/delete', views.BookMarkDeleteView.as_view(), name='bookmark-delete'),
     path('bookmarks/<int:tweet_id>/check', views.BookMarkCheckView.as_view(), name='bookmark-check'),
-    path('tweets/<int:pk>', views.TweetDetailView.as_view(), name='tweet-detail'),
+    path('tweets/<int:pk>', tweet_detail_view, name='tweet-detail'),
+    path('tweets/<int:tweet_id>/retweet', views.CreateRetweetView.as_view(), name='create-retweet'),
+    path('tweets/<int:tweet_id>/retweet/delete', views.DeleteRetweetView.as_view(), name='delete-retweet'),
     path('tweets/<int:tweet_id>/create-bookmark', views.BookMarksCreateView.as_view(), name='bookmarks-create'),
-    path('tweets/<int:tweet_id>/reply', views.ListCreateReplyView.as_view(), name='list-create-reply'),
+    path('tweets/<int:tweet_id>/reply', replies_view, name='list-create-reply'),
+    path('tweets/<int:tweet_id>/conversation', views.ConversationView.as_view(), name='conversation'),
+    path('replies/<int:pk>/thread', views.ReplyThreadView.as_view(), name='reply-thread'),
     path('check-email/', views.CheckEmailExists.as_view(), name='check-email'),
     path('check-username/', views.CheckUsernameExists.as_view(), name='check-username'),
+    path('cache-stats', views.CacheStatsView.as_view(), name='cache-stats'),
+    path('feed-stats', views.FeedStatsView.as_view(), name='feed-stats'),
 ]
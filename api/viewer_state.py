@@ -0,0 +1,39 @@
+from core.models import Like, SaveTweet
+from users.models import Follow
+
+# Most tweets or users a viewer-state request can ask about
+MAX_ITEMS = 100
+
+
+def wants_viewer_state(request):
+    """Whether the viewer's flags are embedded in the tweets, asked with ?include=viewer_state"""
+    return (request is not None and request.user.is_authenticated
+            and 'viewer_state' in request.query_params.get('include', '').split(','))
+
+
+def tweet_states(user, tweets):
+    """The liked, bookmarked and following_author flags of a user for every tweet, with three queries"""
+    tweet_ids = [tweet.id for tweet in tweets]
+    likes = dict(Like.objects.filter(user=user, tweet_id__in=tweet_ids).values_list('tweet_id', 'id'))
+    saved = set(SaveTweet.objects.filter(user=user, tweet_id__in=tweet_ids).values_list('tweet_id', flat=True))
+    followed = set(Follow.objects.filter(
+        follower=user, user_id__in={tweet.user_id for tweet in tweets}).values_list('user_id', flat=True))
+    return {
+        tweet.id: {
+            'liked': tweet.id in likes,
+            'like_id': likes.get(tweet.id),
+            'bookmarked': tweet.id in saved,
+            'following_author': tweet.user_id in followed,
+        }
+        for tweet in tweets
+    }
+
+
+def user_states(user, usernames):
+    """Whether a user follows each of usernames, with one query"""
+    follows = dict(Follow.objects.filter(follower=user, user__username__in=usernames).values_list(
+        'user__username', 'id'))
+    return {
+        username: {'following': username in follows, 'follow_id': follows.get(username)}
+        for username in usernames
+    }
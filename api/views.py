@@ -1,32 +1,62 @@
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from rest_framework import generics, permissions, filters, status
+from rest_framework import generics, permissions, filters, status, exceptions
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-# from datetime import datetime, timedelta, timezone
-from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from django.db import transaction
+from django.db.models import F, Prefetch, Value
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.sites.shortcuts import get_current_site
 from django.urls import reverse
 import jwt
 from django.conf import settings
 from django.contrib.auth.hashers import make_password
-import threading
 
-from .serializers import LikeSerializer, UserSignUpSerializer, TweetSerializer, SaveTweetSerializer, ProfileSerializer, FollowSerializer, ReplySerializer
-from core.models import Tweet, SaveTweet, Like, Reply
+from .serializers import LikeSerializer, UserSignUpSerializer, TweetSerializer, SaveTweetSerializer, CompactSaveTweetSerializer, ProfileSerializer, FollowSerializer, ReplySerializer, RetweetSerializer, TypeaheadUserSerializer, NotificationSerializer, ConversationSerializer, MessageSerializer
+from chat.messaging import mark_read, send_message, start_conversation
+from chat.models import Conversation, Participant, Message
+from core.models import Tweet, SaveTweet, Like, Reply, Retweet, Notification, NotificationEvent
+from core.counters import add_to_counter, add_like
+from core.notifications import notify, mark_notifications_read
+from core.search import search_tweets
+from core.threads import branches, count_new_reply, subtree, thread_parent
+from core.trending import trending_tweets
+from core.timeline import fan_out_tweet, fan_out_retweet, retract_retweet, backfill_timeline, prune_timeline, read_timeline, get_feed_stats
+from users.media import queue_picture
+from users.graph import follow_graph
 from users.models import Follow
-from .utils import OnlySameUserCanEditMixin, EmailRelatedClass
-
-
-class EmailThreading(threading.Thread):
-    def __init__(self, data) :
-        self.email = data
-        threading.Thread.__init__(self)
-    
-    def run(self):
-        EmailRelatedClass.send_email(self.email)
+from users.recommendations import drop_suggestion, suggested_users
+from users.typeahead import typeahead_index
+from .emails import queue_email
+from .authentication import CachedRefreshToken
+from .realtime import publish_follow, publish_tweet
+from .cache import CachedResponseMixin, get_cache_stats, tweet_dependencies
+from .compact import CompactTweetsMixin
+from .viewer_state import MAX_ITEMS, tweet_states, user_states
+from .pagination import TweetPagination, SearchPagination, TimelinePagination, ReplyPagination, ConversationPagination, ThreadPagination, FollowPagination, NotificationPagination, InboxPagination, MessagePagination
+from .utils import OnlySameUserCanEditMixin
+
+
+def unfollow(follow):
+    with transaction.atomic():
+        follow.delete()
+        add_to_counter(get_user_model(), follow.user_id, 'followers_count', -1)
+        add_to_counter(get_user_model(), follow.follower_id, 'following_count', -1)
+    publish_follow(follow.follower_id, follow.user_id, follows=False)
+
+
+def create_tweet(serializer, user):
+    with transaction.atomic():
+        tweet = serializer.save(user=user)
+        add_to_counter(get_user_model(), tweet.user_id, 'tweet_count', 1)
+        if tweet.quoted_tweet_id:
+            add_to_counter(Tweet, tweet.quoted_tweet_id, 'quote_count', 1)
+            notify(tweet.quoted_tweet.user_id, user.id, NotificationEvent.QUOTE, tweet.quoted_tweet_id)
+    fan_out_tweet(tweet)
+    publish_tweet(tweet)
 
 
 class SignUpView(generics.GenericAPIView):
@@ -44,10 +74,7 @@ class SignUpView(generics.GenericAPIView):
         # relative_link = reverse('verify-email')
         absolute_url = f'https://{current_site}/#/activate-account/{token}'
         email_body = f'Hi {user.username}, Welcome to Twitter Clone, Please use the link below to verify your email.\n{absolute_url}'
-
-        data = {'email_body': email_body,
-                'email_subject': 'Verify your email', 'to_email': user.email}
-        EmailThreading(data).start()
+        queue_email('Verify your email', email_body, user.email)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
@@ -84,33 +111,37 @@ class CheckUsernameExists(generics.GenericAPIView):
         return Response(False, status=status.HTTP_200_OK)
 
 
-class HomePageView(generics.ListCreateAPIView):
+class HomePageView(CompactTweetsMixin, generics.ListCreateAPIView):
     serializer_class = TweetSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = TimelinePagination
 
     def get_queryset(self):
-        if self.request.user.is_authenticated:
-            following_users = []
-            tweets = Tweet.objects.none()
-            follows = Follow.objects.filter(follower=self.request.user)
-            for follow in follows:
-                # now we have all the following users
-                following_users.append(follow.user)
-            for following_user in following_users:
-                # now we have all the tweets from those users
-                tweets = Tweet.objects.filter(user=following_user) | tweets
-            return tweets.order_by('-date_created')
-        return Tweet.objects.all().order_by('-date_created')
+        return Tweet.objects.for_feed().annotate(timeline_created=F('date_created'))
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            # Tweets of the followed users are pushed into the timeline when they are created
+            page = self.paginator.paginate_source(
+                lambda position, limit: read_timeline(request.user.id, limit, position), request)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return super().list(request, *args, **kwargs)
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        create_tweet(serializer, self.request.user)
 
 
-class TweetListSearchResults(generics.ListAPIView):
+class TweetListSearchResults(CompactTweetsMixin, generics.ListAPIView):
     serializer_class = TweetSerializer
-    search_fields = ['content']
-    filter_backends = (filters.SearchFilter, )
-    queryset = Tweet.objects.all()
+    pagination_class = SearchPagination
+
+    def get_queryset(self):
+        queryset = Tweet.objects.for_feed()
+        query = self.request.query_params.get('search', '').strip()
+        if not query:
+            return queryset.annotate(rank=Value(0))
+        return search_tweets(queryset, query)
 
 
 class UserListSearchResults(generics.ListAPIView):
@@ -120,21 +151,47 @@ class UserListSearchResults(generics.ListAPIView):
     queryset = get_user_model().objects.all()
 
 
-class ExploreView(generics.ListAPIView):
+class UserTypeaheadView(generics.ListAPIView):
+    """Users whose username or name starts with the search, for search-as-you-type"""
+    serializer_class = TypeaheadUserSerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        query = self.request.query_params.get('search', '').strip()
+        if not query:
+            return []
+        try:
+            limit = int(self.request.query_params.get('limit', settings.TYPEAHEAD_MAX_RESULTS))
+        except ValueError:
+            limit = settings.TYPEAHEAD_MAX_RESULTS
+        user_ids = typeahead_index.search(query, min(max(limit, 1), settings.TYPEAHEAD_MAX_RESULTS))
+        users = get_user_model().objects.in_bulk(user_ids)
+        return [users[user_id] for user_id in user_ids if user_id in users]
+
+
+class ExploreView(CachedResponseMixin, CompactTweetsMixin, generics.ListAPIView):
     serializer_class = TweetSerializer
-    # now = datetime.now(timezone.utc)
-    # yesterday = now - timedelta(days=1)
-    # queryset = Tweet.objects.filter(date_created__gte=yesterday) # Show the tweets from the last 24 hours -- not worth it for a small website
-    queryset = Tweet.objects.all().order_by('-date_created')[:20]
+    pagination_class = None
+    page_size = 20
+
+    def get_queryset(self):
+        return trending_tweets(self.page_size)
+
+    def get_cache_dependencies(self, data):
+        # The ranking itself only changes every TRENDING_MAX_AGE seconds
+        tweets = data['results'] if isinstance(data, dict) else data
+        return set().union(*(tweet_dependencies(tweet) for tweet in tweets))
 
 
-class BookMarksListView(generics.ListAPIView):
+class BookMarksListView(CompactTweetsMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = SaveTweetSerializer
+    compact_serializer_class = CompactSaveTweetSerializer
 
     def get_queryset(self):
         # Returns all the savetweet objects
-        return SaveTweet.objects.filter(user=self.request.user)
+        return SaveTweet.objects.filter(user=self.request.user).select_related('user').prefetch_related(
+            Prefetch('tweet', queryset=Tweet.objects.for_feed()))
 
 
 class BookMarksCreateView(generics.CreateAPIView):
@@ -173,18 +230,11 @@ class BookMarkCheckView(generics.RetrieveAPIView):
 
 class SuggestedUsersView(generics.ListAPIView):
     serializer_class = ProfileSerializer
+    pagination_class = None
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            followings = []
-            followings.append(self.request.user.username)
-            follow_objs = Follow.objects.filter(follower=self.request.user)
-            for follow_obj in follow_objs:
-                followings.append(follow_obj.user.username)
-            suggested_users = get_user_model().objects.exclude(username__in=followings).exclude(is_active=False)
-            if len(suggested_users) >3:
-                return suggested_users[:3]
-            return suggested_users
+            return suggested_users(self.request.user.id, 3)
         return get_user_model().objects.all()[:3]
 
 
@@ -194,7 +244,14 @@ class UserFollowView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def perform_create(self, serializer):
-        serializer.save(follower=self.request.user)
+        with transaction.atomic():
+            follow = serializer.save(follower=self.request.user)
+            add_to_counter(get_user_model(), follow.user_id, 'followers_count', 1)
+            add_to_counter(get_user_model(), follow.follower_id, 'following_count', 1)
+            notify(follow.user_id, follow.follower_id, NotificationEvent.FOLLOW)
+        backfill_timeline(follow.follower_id, follow.user_id)
+        publish_follow(follow.follower_id, follow.user_id)
+        drop_suggestion(follow.follower_id, follow.user_id)
 
 
 class UserUnfollowWithIdView(generics.DestroyAPIView):
@@ -204,6 +261,10 @@ class UserUnfollowWithIdView(generics.DestroyAPIView):
     def get_queryset(self):
         return Follow.objects.filter(follower=self.request.user)
 
+    def perform_destroy(self, instance):
+        prune_timeline(instance.follower_id, instance.user_id)
+        unfollow(instance)
+
 
 class UserUnfollowWithUsernameView(generics.DestroyAPIView):
     queryset = Follow.objects.all()
@@ -215,6 +276,10 @@ class UserUnfollowWithUsernameView(generics.DestroyAPIView):
         print(following_user)
         return get_object_or_404(Follow, user=following_user, follower=self.request.user)
 
+    def perform_destroy(self, instance):
+        prune_timeline(instance.follower_id, instance.user_id)
+        unfollow(instance)
+
 
 class FollowCheckView(generics.RetrieveAPIView):
     queryset = Follow.objects.all()
@@ -225,39 +290,57 @@ class FollowCheckView(generics.RetrieveAPIView):
         following_username = self.kwargs.get('username')
         following_user = get_object_or_404(
             get_user_model(), username=following_username)
-        return get_object_or_404(Follow, user=following_user, follower=self.request.user)
+        # Most checks are for users not followed, a current graph answers them without a query
+        if follow_graph.is_current() and not follow_graph.is_following(self.request.user.id, following_user.id):
+            raise Http404
+        follow = get_object_or_404(Follow, user=following_user, follower=self.request.user)
+        follow.follower = self.request.user
+        return follow
 
 
-class ProfileDetailView(generics.RetrieveUpdateAPIView):
+class ProfileDetailView(CachedResponseMixin, generics.RetrieveUpdateAPIView):
     queryset = get_user_model().objects.all()
     permission_classes = [OnlySameUserCanEditMixin]
     serializer_class = ProfileSerializer
     lookup_field = 'username'
 
+    def get_cache_dependencies(self, data):
+        return {f'user:{data["id"]}'}
+
     def perform_update(self, serializer):
-        instance = self.get_object()
         password = self.request.data.get('password', None)
+        if password and len(password) < 8:
+            raise ValidationError(
+                {'detail': 'Password can\'t be less than 8 characters long'})
+        # New pictures are resized and stored in the background, the response still
+        # shows the old ones
+        pictures = {field: serializer.validated_data.pop(field)
+                    for field in ('picture', 'background_picture') if field in serializer.validated_data}
+        instance = serializer.save()
         if password:
-            if len(password) < 8:
-                raise ValidationError(
-                    {'detail': 'Password can\'t be less than 8 characters long'})
             instance.set_password(password)
-            instance.save()
+            instance.save(update_fields=['password'])
+        for field, uploaded_file in pictures.items():
+            queue_picture(instance, field, uploaded_file)
 
 
-class TweetListView(generics.ListAPIView):
+class TweetListView(CompactTweetsMixin, generics.ListAPIView):
     serializer_class = TweetSerializer
+    pagination_class = TweetPagination
 
     def get_queryset(self):
         user = get_object_or_404(
             get_user_model(), username=self.kwargs.get('username'))
-        return Tweet.objects.filter(user=user)
+        return Tweet.objects.for_feed().filter(user=user)
 
 
-class TweetDetailView(generics.RetrieveAPIView):
-    queryset = Tweet.objects.all()
+class TweetDetailView(CachedResponseMixin, generics.RetrieveAPIView):
+    queryset = Tweet.objects.for_feed()
     serializer_class = TweetSerializer
 
+    def get_cache_dependencies(self, data):
+        return tweet_dependencies(data)
+
 
 class AddTweetView(generics.CreateAPIView):
     queryset = Tweet.objects.all()
@@ -265,33 +348,46 @@ class AddTweetView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        create_tweet(serializer, self.request.user)
 
 
-class FollowersListView(generics.ListAPIView):
+class FollowersListView(CachedResponseMixin, generics.ListAPIView):
     serializer_class = ProfileSerializer
+    pagination_class = FollowPagination
 
     def get_queryset(self):
+        # Paginated on the follow objects, then the followers are serialized
         username = self.kwargs.get('username')
-        user = get_object_or_404(get_user_model(), username=username)
-        followers_objs = user.followers.all()
-        followers = []
-        for follower_obj in followers_objs:
-            followers.append(follower_obj.follower)
-        return followers
+        self.user = get_object_or_404(get_user_model(), username=username)
+        return self.user.followers.select_related('follower')
+
+    def get_cache_dependencies(self, data):
+        return {f'user:{self.user.id}', f'followers:{self.user.id}'}.union(
+            f'user:{user["id"]}' for user in data['results'])
 
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer([follow.follower for follow in page], many=True)
+        return self.get_paginated_response(serializer.data)
 
-class FollowingsListView(generics.ListAPIView):
+
+class FollowingsListView(CachedResponseMixin, generics.ListAPIView):
     serializer_class = ProfileSerializer
+    pagination_class = FollowPagination
 
     def get_queryset(self):
         username = self.kwargs.get('username')
-        user = get_object_or_404(get_user_model(), username=username)
-        followings_objs = user.follows.all()
-        followings = []
-        for following_obj in followings_objs:
-            followings.append(following_obj.user)
-        return followings
+        self.user = get_object_or_404(get_user_model(), username=username)
+        return self.user.follows.select_related('user')
+
+    def get_cache_dependencies(self, data):
+        return {f'user:{self.user.id}', f'followings:{self.user.id}'}.union(
+            f'user:{user["id"]}' for user in data['results'])
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer([follow.user for follow in page], many=True)
+        return self.get_paginated_response(serializer.data)
 
 
 class CreateLikeView(generics.CreateAPIView):
@@ -301,7 +397,10 @@ class CreateLikeView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         tweet = get_object_or_404(Tweet, id=self.kwargs.get('tweet_id'))
-        serializer.save(user=self.request.user, tweet=tweet)
+        with transaction.atomic():
+            serializer.save(user=self.request.user, tweet=tweet)
+            add_like(tweet.id, 1)
+            notify(tweet.user_id, self.request.user.id, NotificationEvent.LIKE, tweet.id)
 
 
 class DeleteLikeView(generics.DestroyAPIView):
@@ -314,13 +413,55 @@ class DeleteLikeView(generics.DestroyAPIView):
             return super().destroy(request, *args, **kwargs)
         return Response(status.HTTP_401_UNAUTHORIZED)
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            add_like(instance.tweet_id, -1)
+
+
+class CreateRetweetView(generics.CreateAPIView):
+    queryset = Retweet.objects.all()
+    serializer_class = RetweetSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def perform_create(self, serializer):
+        tweet = get_object_or_404(Tweet, id=self.kwargs.get('tweet_id'))
+        if Retweet.objects.filter(user=self.request.user, tweet=tweet).exists():
+            raise exceptions.ValidationError({'tweet': 'This tweet is already retweeted.'})
+        with transaction.atomic():
+            retweet = serializer.save(user=self.request.user, tweet=tweet)
+            add_to_counter(Tweet, tweet.id, 'retweet_count', 1)
+            notify(tweet.user_id, self.request.user.id, NotificationEvent.RETWEET, tweet.id)
+        fan_out_retweet(retweet)
+        publish_tweet(tweet, retweeted_by=self.request.user)
+
+
+class DeleteRetweetView(generics.DestroyAPIView):
+    queryset = Retweet.objects.all()
+    serializer_class = RetweetSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_object(self):
+        return get_object_or_404(
+            Retweet.objects.select_related('tweet'), tweet_id=self.kwargs.get('tweet_id'), user=self.request.user)
 
-class ListLikeView(generics.ListAPIView):
+    def perform_destroy(self, instance):
+        retract_retweet(instance)
+        with transaction.atomic():
+            instance.delete()
+            add_to_counter(Tweet, instance.tweet_id, 'retweet_count', -1)
+
+
+class ListLikeView(CachedResponseMixin, generics.ListAPIView):
     serializer_class = LikeSerializer
 
     def get_queryset(self):
         tweet = get_object_or_404(Tweet, id=self.kwargs.get('tweet_id'))
-        return Like.objects.filter(tweet=tweet)
+        return Like.objects.filter(tweet=tweet).select_related('user')
+
+    def get_cache_dependencies(self, data):
+        tweet_id = self.kwargs.get('tweet_id')
+        return {f'tweet:{tweet_id}', f'likes:{tweet_id}'}
 
 
 class LikeCheckView(generics.RetrieveAPIView):
@@ -336,18 +477,141 @@ class LikeCheckView(generics.RetrieveAPIView):
 
 class ListCreateReplyView(generics.ListCreateAPIView):
     serializer_class = ReplySerializer
+    pagination_class = ReplyPagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
     def get_queryset(self):
+        # The replies to the tweet itself, the replies below them are in their thread
         tweet = get_object_or_404(Tweet, id=self.kwargs.get('tweet_id'))
-        return Reply.objects.filter(tweet=tweet)
+        return Reply.objects.filter(tweet=tweet, parent=None).select_related('user')
 
     def perform_create(self, serializer):
         tweet = get_object_or_404(Tweet, id=self.kwargs.get('tweet_id'))
-        serializer.save(user=self.request.user, tweet=tweet)
+        parent = serializer.validated_data.get('parent')
+        if parent is not None and parent.tweet_id != tweet.id:
+            raise exceptions.ValidationError({'parent': 'The reply is to another tweet'})
+        with transaction.atomic():
+            reply = serializer.save(user=self.request.user, tweet=tweet, parent=thread_parent(parent))
+            count_new_reply(reply)
+            notify(tweet.user_id, reply.user_id, NotificationEvent.REPLY, tweet.id)
+            if reply.parent is not None and reply.parent.user_id != tweet.user_id:
+                notify(reply.parent.user_id, reply.user_id, NotificationEvent.REPLY, tweet.id)
+
+
+class ConversationView(generics.ListAPIView):
+    """The replies to a tweet, or with ?parent=<id> to one of its replies, newest first"""
+    serializer_class = ReplySerializer
+    pagination_class = ConversationPagination
+
+    def get_queryset(self):
+        tweet = get_object_or_404(Tweet, id=self.kwargs.get('tweet_id'))
+        try:
+            parent_id = int(self.request.query_params['parent'])
+        except (KeyError, ValueError):
+            parent_id = None
+        return branches(tweet.id, parent_id).select_related('user')
+
+
+class ReplyThreadView(generics.ListAPIView):
+    """A reply and every reply below it, depth first"""
+    serializer_class = ReplySerializer
+    pagination_class = ThreadPagination
+
+    def get_queryset(self):
+        reply = get_object_or_404(Reply, id=self.kwargs.get('pk'))
+        return subtree(reply).select_related('user')
+
+
+class NotificationsView(generics.ListAPIView):
+    """The user's notifications, the ones with a new event first"""
+    serializer_class = NotificationSerializer
+    pagination_class = NotificationPagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Notification.objects.filter(recipient=self.request.user).select_related('tweet__user')
+
+
+class UnreadNotificationsView(generics.GenericAPIView):
+    """GET returns the number of unread notifications, POST marks them all read"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        # request.user can come from the authentication cache, the counter is read fresh
+        unread = get_user_model().objects.filter(pk=request.user.id).values_list(
+            'unread_notifications', flat=True).first()
+        return Response({'unread': unread or 0})
+
+    def post(self, request):
+        mark_notifications_read(request.user.id)
+        return Response({'unread': 0})
+
+
+class ConversationListView(generics.ListCreateAPIView):
+    """GET lists the user's conversations, latest message first, POST starts one with users"""
+    serializer_class = ConversationSerializer
+    pagination_class = InboxPagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        # last_read_seq comes from the same join as the participants__user filter
+        return Conversation.objects.filter(participants__user=self.request.user).annotate(
+            last_read_seq=F('participants__last_read_seq')).prefetch_related(
+            Prefetch('participants', queryset=Participant.objects.select_related('user')))
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = {user.id for user in serializer.validated_data['users']} - {request.user.id}
+        if not user_ids:
+            raise exceptions.ValidationError({'users': 'A conversation needs another user.'})
+        conversation = start_conversation(request.user.id, user_ids)
+        serializer = self.get_serializer(self.get_queryset().get(pk=conversation.pk))
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class MessageListView(generics.ListCreateAPIView):
+    """
+    The messages of a conversation in seq order, ?after=<seq> skips the ones a client
+    already has. POST appends a message
+    """
+    serializer_class = MessageSerializer
+    pagination_class = MessagePagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_conversation(self):
+        return get_object_or_404(
+            Conversation, pk=self.kwargs.get('conversation_id'), participants__user=self.request.user)
+
+    def get_queryset(self):
+        try:
+            after = int(self.request.query_params.get('after', 0))
+        except ValueError:
+            after = 0
+        return Message.objects.filter(conversation=self.get_conversation(), seq__gt=after)
+
+    def perform_create(self, serializer):
+        conversation = self.get_conversation()
+        serializer.instance = send_message(conversation.id, self.request.user.id, serializer.validated_data['text'])
+
+
+class MarkConversationReadView(generics.GenericAPIView):
+    """Move the user's read cursor of a conversation forward to the seq posted"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, conversation_id):
+        conversation = get_object_or_404(Conversation, pk=conversation_id, participants__user=request.user)
+        try:
+            seq = int(request.data.get('seq', conversation.last_seq))
+        except (TypeError, ValueError):
+            raise exceptions.ValidationError({'seq': 'A valid integer is required.'})
+        mark_read(conversation, request.user.id, seq)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = CachedRefreshToken
+
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
@@ -360,3 +624,50 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
+
+
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = CachedRefreshToken
+
+
+class MyTokenRefreshView(TokenRefreshView):
+    serializer_class = MyTokenRefreshSerializer
+
+
+class ViewerStateView(generics.GenericAPIView):
+    """
+    Whether the user liked and bookmarked each of ?tweets=1,2,3 and follows each of
+    ?users=name1,name2, instead of one check request per tweet and user
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            tweet_ids = [int(tweet_id) for tweet_id in request.query_params.get('tweets', '').split(',') if tweet_id]
+        except ValueError:
+            return Response({'error': 'tweets must be a comma separated list of ids'}, status=status.HTTP_400_BAD_REQUEST)
+        usernames = [username for username in request.query_params.get('users', '').split(',') if username]
+        if len(tweet_ids) > MAX_ITEMS or len(usernames) > MAX_ITEMS:
+            return Response({'error': f'Ask about at most {MAX_ITEMS} tweets and users'}, status=status.HTTP_400_BAD_REQUEST)
+
+        tweets = list(Tweet.objects.filter(id__in=tweet_ids).only('id', 'user_id'))
+        return Response({
+            'tweets': tweet_states(request.user, tweets) if tweet_ids else {},
+            'users': user_states(request.user, usernames) if usernames else {},
+        })
+
+
+class CacheStatsView(generics.GenericAPIView):
+    """Hit, miss and eviction counts of the response cache"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_cache_stats())
+
+
+class FeedStatsView(generics.GenericAPIView):
+    """Fan-out and home page read counts of this process, to tune FEED_FANOUT_FOLLOWER_THRESHOLD"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_feed_stats())
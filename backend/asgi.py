@@ -12,5 +12,13 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+# Serve the read heavy endpoints with the async views of api.async_views
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# The apps are loaded now, the push stream can import the api
+from api.realtime import FeedStream  # noqa: E402
+
+# New tweets are pushed at PUSH_PATH, every other request goes to Django
+application = FeedStream(django_application)
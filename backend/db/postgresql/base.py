@@ -0,0 +1,120 @@
+import threading
+from collections import deque
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+import psycopg2
+from psycopg2 import extensions
+
+
+class ConnectionPool:
+    """
+    At most size open connections shared by every thread of the process. A thread
+    asking for one while all of them are in use waits up to timeout seconds
+    """
+
+    def __init__(self, size, timeout):
+        self.timeout = timeout
+        self.idle = deque()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+
+    def get(self, connect, check=None):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError(f'No database connection became free within {self.timeout}s')
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return connect()
+                if not connection.closed and (check is None or check(connection)):
+                    return connection
+                connection.close()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, connection):
+        try:
+            if not connection.closed:
+                status = connection.get_transaction_status()
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    # The server went away
+                    connection.close()
+                else:
+                    if status != extensions.TRANSACTION_STATUS_IDLE:
+                        connection.rollback()
+                    with self.lock:
+                        self.idle.append(connection)
+        except psycopg2.Error:
+            connection.close()
+        finally:
+            self.slots.release()
+
+
+def is_alive(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(settings_dict, conn_params):
+    key = (settings_dict['NAME'], repr(sorted(conn_params.items())))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(settings_dict['POOL_SIZE'], settings_dict.get('POOL_TIMEOUT', 10))
+        return _pools[key]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL with two additions, both set in DATABASES:
+    CONN_HEALTH_CHECKS, which Django only supports from 4.1 on, checks a persistent
+    connection before the first query of every request so a connection the server
+    dropped while idle is replaced instead of failing the request.
+    POOL_SIZE > 0 borrows the connections from a pool of the process instead of
+    opening one per thread, closing the connection gives it back to the pool
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.health_check_pending = False
+
+    def get_new_connection(self, conn_params):
+        if not self.settings_dict.get('POOL_SIZE'):
+            return super().get_new_connection(conn_params)
+        self.pool = get_pool(self.settings_dict, conn_params)
+        check = is_alive if self.settings_dict.get('CONN_HEALTH_CHECKS') else None
+        connection = self.pool.get(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params), check)
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            self.pool.put(self.connection)
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # Runs when a request starts and finishes, the check waits for the next query
+        self.health_check_pending = self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    def ensure_connection(self):
+        if self.health_check_pending and self.connection is not None and not self.in_atomic_block:
+            self.health_check_pending = False
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
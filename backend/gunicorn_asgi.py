@@ -0,0 +1,11 @@
+# ASGI deployment: gunicorn -c backend/gunicorn_asgi.py backend.asgi:application
+# Each uvicorn worker keeps serving requests while the views wait on the database
+# in its pool of ASYNC_DB_THREADS threads, instead of one request per sync worker
+import multiprocessing
+import os
+
+bind = f'0.0.0.0:{os.getenv("PORT", "8000")}'
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+timeout = 30
+keepalive = 5
@@ -0,0 +1,146 @@
+import asyncio
+import contextvars
+import logging
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import JsonResponse
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that also runs in async mode, a sync only middleware would make
+    Django run every async view under ASGI in a thread of its own
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Tells Django this instance is a coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def over_budget(self):
+        return (self.count > settings.QUERY_BUDGET_MAX_QUERIES
+                or self.duration > settings.QUERY_BUDGET_MAX_DB_TIME)
+
+
+# The stats of the request being handled, context variables follow a request into
+# the threads sync_to_async and the async views run its queries in
+_request_stats = contextvars.ContextVar('request_query_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    # Checked before the query runs, a query that did run always hands back its result
+    if settings.QUERY_BUDGET_ACTION == 'reject':
+        if stats.count >= settings.QUERY_BUDGET_MAX_QUERIES:
+            raise QueryBudgetExceeded(
+                f'More than {settings.QUERY_BUDGET_MAX_QUERIES} queries in one request')
+        if stats.duration > settings.QUERY_BUDGET_MAX_DB_TIME:
+            raise QueryBudgetExceeded(
+                f'More than {settings.QUERY_BUDGET_MAX_DB_TIME}s of queries in one request')
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.duration += time.perf_counter() - started
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class QueryBudgetMiddleware:
+    """
+    Count the queries of every request and the time spent in them, report both in
+    the X-DB-Queries and X-DB-Time (milliseconds) headers when QUERY_BUDGET_HEADERS is
+    on and, depending on QUERY_BUDGET_ACTION, log ('log') or fail with a 500 ('reject')
+    the requests going over QUERY_BUDGET_MAX_QUERIES queries or QUERY_BUDGET_MAX_DB_TIME
+    seconds. A rejected request stops before its next query runs
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        connection_created.connect(install_query_recorder, dispatch_uid='install_query_recorder')
+        # Connections opened before the signal was connected
+        for connection in connections.all():
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if settings.QUERY_BUDGET_ACTION == 'off':
+            return self.get_response(request)
+        stats = QueryStats()
+        token = _request_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.report(request, response, stats)
+
+    async def __acall__(self, request):
+        if settings.QUERY_BUDGET_ACTION == 'off':
+            return await self.get_response(request)
+        stats = QueryStats()
+        token = _request_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.report(request, response, stats)
+
+    def report(self, request, response, stats):
+        if settings.QUERY_BUDGET_HEADERS:
+            response['X-DB-Queries'] = stats.count
+            response['X-DB-Time'] = f'{stats.duration * 1000:.1f}'
+        if stats.over_budget():
+            logger.warning('%s %s ran %s queries in %.1fms, budget %s queries and %.1fms',
+                           request.method, request.path, stats.count, stats.duration * 1000,
+                           settings.QUERY_BUDGET_MAX_QUERIES, settings.QUERY_BUDGET_MAX_DB_TIME * 1000)
+        return response
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, QueryBudgetExceeded):
+            return JsonResponse({'detail': str(exception)}, status=500)
@@ -1,6 +1,7 @@
 from pathlib import Path
 from datetime import timedelta
 import os
+import tempfile
 from dotenv import load_dotenv
 import dj_database_url
 import cloudinary
@@ -34,6 +35,7 @@ INSTALLED_APPS = [
     'core.apps.CoreConfig',
     'users.apps.UsersConfig',
     'api.apps.ApiConfig',
+    'chat.apps.ChatConfig',
     'rest_framework',
     'rest_framework_simplejwt',
     'rest_framework_simplejwt.token_blacklist',
@@ -41,9 +43,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.middleware.QueryBudgetMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'backend.middleware.AsyncWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -92,6 +95,21 @@ else:
     }
     }
 
+# Keep connections open for DB_CONN_MAX_AGE seconds instead of opening one per request,
+# checking them before the first query of a request
+DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 60))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    # Adds the health checks Django 4.1 brings and the optional connection pool
+    DATABASES['default']['ENGINE'] = 'backend.db.postgresql'
+    # With DB_POOL_SIZE > 0 the threads of a process (the ASYNC_DB_THREADS of an ASGI
+    # worker, the threads of a threaded WSGI worker) share that many connections and
+    # give them back to the pool after every request
+    DATABASES['default']['POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 0))
+    DATABASES['default']['POOL_TIMEOUT'] = 10
+    if DATABASES['default']['POOL_SIZE']:
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -132,16 +150,33 @@ if not DEBUG:
 MEDIA_URL = '/twitter-media/'
 
 MEDIA_ROOT = 'media'
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+# Without a Cloudinary account the pictures are stored in MEDIA_ROOT
+if os.getenv('CLOUDINARY_CLOUD_NAME'):
+    DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+else:
+    DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+
+# Uploaded pictures wait in MEDIA_UPLOAD_DIR until one of MEDIA_WORKERS threads crops
+# them to every PICTURE_VARIANTS size (width, height) and stores those, with
+# MEDIA_WORKERS = 0 the upload request processes them itself
+MEDIA_UPLOAD_DIR = os.getenv('MEDIA_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'twitter-uploads'))
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', 2))
+PICTURE_VARIANTS = {
+    'picture': {'small': (48, 48), 'medium': (128, 128), 'large': (400, 400)},
+    'background_picture': {'small': (600, 200), 'large': (1500, 500)},
+}
+PICTURE_QUALITY = 85
 
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
     'TEST_REQUEST_DEFAULT_FORMAT': 'json'
 }
 
@@ -177,6 +212,126 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Any Redis protocol server (Redis, KeyDB, Dragonfly...) when REDIS_URL is set,
+# otherwise a per-process local memory cache
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'api.cache.StatsLocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+# The user of an access token is cached for this many seconds, or until it is saved
+AUTH_USER_CACHE_TIMEOUT = 60
+# Whether a refresh token is blacklisted is cached until the token expires. A per-process
+# cache can't see the tokens other workers blacklist, so without Redis a token known not
+# to be blacklisted is looked up again after this many seconds
+TOKEN_BLACKLIST_CACHE_TIMEOUT = None if os.getenv('REDIS_URL') else 5
+# Cached responses are also dropped after this many seconds, which bounds how stale
+# the relative dates in them get
+RESPONSE_CACHE_TIMEOUT = 60
+
+# backend/asgi.py turns ASYNC_VIEWS on, then the home page, tweet, profile and reply
+# endpoints are async views running their queries in a pool of ASYNC_DB_THREADS threads
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS') == 'True'
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', 16))
+
+# Number of tweets kept in each user's materialized home timeline
+TIMELINE_DEPTH = 800
+# Tweets of accounts with at least this many followers are merged into home pages
+# at read time instead of being pushed into every follower's timeline
+FEED_FANOUT_FOLLOWER_THRESHOLD = 10000
+# A retweet moves a tweet back to the top of a timeline only when the timeline got
+# it more than this many seconds ago, otherwise the tweet stays where it is
+RETWEET_DEDUPE_WINDOW = 6 * 60 * 60
+
+# Replies nest at most this many levels deep, Reply.path holds 25 ids
+REPLY_MAX_DEPTH = 25
+
+# Explore shows the TRENDING_SIZE best scored tweets of the last TRENDING_WINDOW hours,
+# recomputed by compute_trending or in the background once it is TRENDING_MAX_AGE seconds old
+TRENDING_WINDOW = 48
+TRENDING_SIZE = 100
+TRENDING_MAX_AGE = 300
+TRENDING_GRAVITY = 1.5
+TRENDING_WEIGHTS = {'likes': 1, 'replies': 2, 'saves': 3}
+
+# The in-memory follow graph is rebuilt from the database after this many seconds.
+# Workers start from the dump_follow_graph snapshot at FOLLOW_GRAPH_SNAPSHOT if it is younger
+FOLLOW_GRAPH_MAX_AGE = 300
+FOLLOW_GRAPH_SNAPSHOT = os.getenv('FOLLOW_GRAPH_SNAPSHOT', '')
+
+# Follow suggestions kept per user and how users you may know are scored
+SUGGESTIONS_PER_USER = 20
+SUGGESTION_WEIGHTS = {'mutual': 1.0, 'follows_you': 2.0, 'popularity': 0.5}
+
+# 'row' adds likes to Tweet.like_count directly, 'sharded' spreads them over
+# LIKE_COUNTER_SHARDS rows per tweet and 'buffered' collects them in memory and
+# writes them to the shards every LIKE_COUNTER_FLUSH_INTERVAL seconds
+LIKE_COUNTER_MODE = os.getenv('LIKE_COUNTER_MODE', 'sharded')
+LIKE_COUNTER_SHARDS = 16
+LIKE_COUNTER_FLUSH_INTERVAL = 1.0
+LIKE_COUNT_CACHE_TIMEOUT = 5
+
+# 'postgres' searches tweets with the GIN indexed tsvector, 'index' with the
+# TweetSearchToken table, 'auto' picks postgres whenever the database is PostgreSQL
+TWEET_SEARCH_BACKEND = os.getenv('TWEET_SEARCH_BACKEND', 'auto')
+TWEET_SEARCH_CONFIG = 'english'
+
+# The in-memory typeahead index is rebuilt from the database after this many seconds
+TYPEAHEAD_INDEX_MAX_AGE = 300
+TYPEAHEAD_MAX_RESULTS = 10
+
+# Requests running more queries or spending longer in the database than this are
+# logged by QueryBudgetMiddleware, 'reject' fails them instead and 'off' stops counting
+QUERY_BUDGET_MAX_QUERIES = int(os.getenv('QUERY_BUDGET_MAX_QUERIES', 20))
+QUERY_BUDGET_MAX_DB_TIME = float(os.getenv('QUERY_BUDGET_MAX_DB_TIME', 0.5))
+QUERY_BUDGET_ACTION = os.getenv('QUERY_BUDGET_ACTION', 'log')
+# The X-DB-Queries and X-DB-Time headers tell anyone how heavy a request is, only sent when on
+QUERY_BUDGET_HEADERS = DEBUG or os.getenv('QUERY_BUDGET_HEADERS') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # Set FEED_LOG_LEVEL=INFO to see the fan-out decisions and DEBUG for the read time merges
+        'core.timeline': {
+            'handlers': ['console'],
+            'level': os.getenv('FEED_LOG_LEVEL', 'WARNING'),
+        },
+        # Requests over the query budget
+        'backend.middleware': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        # Pictures that failed to process
+        'users.media': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        # Delivery failures and the throughput of send_queued_emails
+        'api.emails': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+        # The throughput of aggregate_notifications
+        'core.notifications': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
 DEFAULT_FROM_EMAIL = os.getenv('EMAIL_HOST_USER')
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -185,6 +340,38 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 
+# Emails are queued in the OutboundEmail table and delivered by send_queued_emails.
+# A failed email is retried after EMAIL_RETRY_BACKOFF seconds, doubling every attempt
+EMAIL_QUEUE_BATCH_SIZE = 100
+EMAIL_QUEUE_POLL_INTERVAL = 5
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BACKOFF = 30
+EMAIL_RETRY_MAX_BACKOFF = 3600
+
+# Likes, replies, follows, retweets and quotes are appended to the NotificationEvent log
+# and folded into Notification rows by aggregate_notifications, a notification shows
+# its NOTIFICATION_ACTORS_SHOWN latest actors
+NOTIFICATION_BATCH_SIZE = 500
+NOTIFICATION_POLL_INTERVAL = 1
+NOTIFICATION_ACTORS_SHOWN = 3
+
+# Under ASGI a read of new messages can wait this many seconds at most for the next one
+MESSAGES_LONG_POLL_TIMEOUT = 25
+
+# Under ASGI, PUSH_PATH streams the new tweets of the followed users over a WebSocket or
+# as server-sent events. The broker carries them, and the wake-ups of the message
+# long-polls, to every worker process. The local one only reaches the process they
+# were sent from
+PUSH_PATH = '/api/feed/stream'
+PUSH_BROKER = 'api.realtime.RedisBroker' if os.getenv('REDIS_URL') else 'api.realtime.LocalBroker'
+PUSH_REDIS_URL = os.getenv('REDIS_URL')
+# Tweets waiting for a slow connection, the ones past that are only counted
+PUSH_QUEUE_SIZE = 100
+# With ?mode=hint, the tweets of this many seconds make one "N new tweets" event
+PUSH_HINT_INTERVAL = 2
+# Seconds between keepalives of an idle connection
+PUSH_KEEPALIVE = 25
+
 
 CLOUDINARY_STORAGE = {
     'CLOUD_NAME':  os.getenv('CLOUDINARY_CLOUD_NAME'),
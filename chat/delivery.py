@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class ConversationListener:
+    """A long-poll waiting for the next message of a conversation, see MessageNotifier.listen"""
+
+    def __init__(self, notifier, conversation_id):
+        self.notifier = notifier
+        self.conversation_id = conversation_id
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+    def __enter__(self):
+        self.notifier.add(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.notifier.remove(self)
+
+    def wake(self, seq):
+        # Called from the thread that committed the message
+        self.loop.call_soon_threadsafe(self._set_seq, seq)
+
+    def _set_seq(self, seq):
+        if not self.future.done():
+            self.future.set_result(seq)
+
+    async def wait(self, timeout):
+        """The seq of the message sent since listening started, None after timeout seconds"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class MessageNotifier:
+    """
+    Wakes the long-polls of a conversation when a message is sent. The message is
+    published on the PUSH_BROKER, which wakes the listeners of every worker process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = defaultdict(set)
+
+    def listen(self, conversation_id):
+        """
+        Start listening before reading the conversation, a message committed between
+        the read and the wait then still wakes the listener
+        """
+        return ConversationListener(self, conversation_id)
+
+    def add(self, listener):
+        with self._lock:
+            self._listeners[listener.conversation_id].add(listener)
+
+    def remove(self, listener):
+        with self._lock:
+            listeners = self._listeners.get(listener.conversation_id)
+            if listeners is not None:
+                listeners.discard(listener)
+                if not listeners:
+                    del self._listeners[listener.conversation_id]
+
+    def publish(self, conversation_id, seq):
+        # The broker lives with the push stream, which imports the chat app
+        from api.realtime import publish_message
+        publish_message(conversation_id, seq)
+
+    def wake(self, conversation_id, seq):
+        """Wake the listeners of this process, called by the broker"""
+        with self._lock:
+            listeners = list(self._listeners.get(conversation_id, ()))
+        for listener in listeners:
+            listener.wake(seq)
+
+
+message_notifier = MessageNotifier()
@@ -0,0 +1,55 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .delivery import message_notifier
+from .models import Conversation, Participant, Message
+
+
+def direct_key(user_id, other_id):
+    return ':'.join(str(pk) for pk in sorted((user_id, other_id)))
+
+
+def start_conversation(user_id, other_ids):
+    """
+    The conversation between a user and other_ids. Two users share a single
+    conversation, every group started is a new one
+    """
+    other_ids = sorted(set(other_ids) - {user_id})
+    key = direct_key(user_id, other_ids[0]) if len(other_ids) == 1 else None
+    if key is not None:
+        conversation = Conversation.objects.filter(direct_key=key).first()
+        if conversation is not None:
+            return conversation
+    try:
+        with transaction.atomic():
+            conversation = Conversation.objects.create(direct_key=key)
+            Participant.objects.bulk_create(
+                [Participant(conversation=conversation, user_id=pk) for pk in [user_id, *other_ids]])
+    except IntegrityError:
+        # Both users started their conversation at the same time
+        return Conversation.objects.get(direct_key=key)
+    return conversation
+
+
+def send_message(conversation_id, sender_id, text):
+    """
+    Append a message to a conversation. Bumping last_seq locks the conversation row
+    until the message is committed, so seqs are given out in commit order without gaps
+    """
+    with transaction.atomic():
+        Conversation.objects.filter(pk=conversation_id).update(
+            last_seq=F('last_seq') + 1, date_updated=timezone.now())
+        seq = Conversation.objects.filter(pk=conversation_id).values_list('last_seq', flat=True).get()
+        message = Message.objects.create(conversation_id=conversation_id, seq=seq, sender_id=sender_id, text=text)
+        # The sender has read their own message
+        Participant.objects.filter(conversation_id=conversation_id, user_id=sender_id).update(last_read_seq=seq)
+        transaction.on_commit(lambda: message_notifier.publish(conversation_id, seq))
+    return message
+
+
+def mark_read(conversation, user_id, seq):
+    """Move a participant's read cursor forward to seq, never back or past the last message"""
+    seq = min(seq, conversation.last_seq)
+    Participant.objects.filter(conversation=conversation, user_id=user_id).update(
+        last_read_seq=Greatest(F('last_read_seq'), seq))
@@ -0,0 +1,64 @@
+from django.db import models
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+
+class Conversation(models.Model):
+    """Direct messages between two or more users"""
+    # Set on a conversation between two users to "<smaller id>:<bigger id>", so there is one per pair
+    direct_key = models.CharField(max_length=41, unique=True, null=True, blank=True)
+    # seq of the last message, the next message gets last_seq + 1
+    last_seq = models.PositiveBigIntegerField(default=0)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_updated = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'conversation {self.id}'
+
+
+class Participant(models.Model):
+    """A user in a conversation and how far they have read it"""
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name='participants')
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='conversations')
+    # The messages up to this seq are read, messages carry no read flag of their own
+    last_read_seq = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'conversation'], name='A user is in a conversation once'),
+        ]
+
+    def __str__(self):
+        return f'user {self.user_id} read conversation {self.conversation_id} up to {self.last_read_seq}'
+
+
+class Message(models.Model):
+    """
+    A message, numbered by seq inside its conversation. Messages are only appended,
+    a client syncs with the messages after the last seq it has
+    """
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, db_index=False, related_name='messages')
+    seq = models.PositiveBigIntegerField()
+    sender = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='sent_messages')
+    text = models.TextField(max_length=10000)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Also the index the messages of a conversation are read in seq order from
+            models.UniqueConstraint(
+                fields=['conversation', 'seq'], name='A seq is used once in a conversation'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Messages are append only')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f'message {self.seq} of conversation {self.conversation_id}'
@@ -0,0 +1,67 @@
+import asyncio
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from .delivery import MessageNotifier
+from .messaging import mark_read, send_message, start_conversation
+from .models import Participant, Message
+
+
+class TestMessaging(TestCase):
+    def setUp(self):
+        self.new_user1 = get_user_model().objects.create_user(email='test@gmail.com', username='test_username',
+                                                              firstname='test_firstname', lastname='test_lastname', password='test_password')
+        self.new_user2 = get_user_model().objects.create_user(email='test2@gmail.com', username='test_username2',
+                                                              firstname='test_firstname2', lastname='test_lastname2', password='test_password2')
+        self.conversation = start_conversation(self.new_user1.id, [self.new_user2.id])
+
+    def test_direct_conversation_is_shared(self):
+        """Test two users always get the same conversation and a group gets a new one"""
+        self.assertEqual(start_conversation(self.new_user2.id, [self.new_user1.id]), self.conversation)
+        new_user3 = get_user_model().objects.create_user(email='test3@gmail.com', username='test_username3',
+                                                         firstname='test_firstname3', lastname='test_lastname3', password='test_password3')
+        group = start_conversation(self.new_user1.id, [self.new_user2.id, new_user3.id])
+        self.assertNotEqual(group, self.conversation)
+        self.assertEqual(group.participants.count(), 3)
+
+    def test_messages_are_numbered(self):
+        """Test every message gets the next seq of its conversation and the sender has read it"""
+        seqs = [send_message(self.conversation.id, self.new_user1.id, f'message {i}').seq for i in range(3)]
+        self.assertEqual(seqs, [1, 2, 3])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_seq, 3)
+        self.assertEqual(list(Message.objects.filter(conversation=self.conversation, seq__gt=1).values_list(
+            'text', flat=True)), ['message 1', 'message 2'])
+        cursors = dict(Participant.objects.values_list('user_id', 'last_read_seq'))
+        self.assertEqual(cursors, {self.new_user1.id: 3, self.new_user2.id: 0})
+
+    def test_messages_are_append_only(self):
+        """Test a sent message can't be changed"""
+        message = send_message(self.conversation.id, self.new_user1.id, 'message')
+        message.text = 'edited'
+        with self.assertRaises(ValueError):
+            message.save()
+
+    def test_read_cursor_only_moves_forward(self):
+        """Test the read cursor stays within the messages and never moves back"""
+        for i in range(2):
+            send_message(self.conversation.id, self.new_user1.id, f'message {i}')
+        self.conversation.refresh_from_db()
+        participant = Participant.objects.get(user=self.new_user2)
+        for seq, expected in ((5, 2), (1, 2)):
+            mark_read(self.conversation, self.new_user2.id, seq)
+            participant.refresh_from_db()
+            self.assertEqual(participant.last_read_seq, expected)
+
+
+class TestMessageNotifier(TestCase):
+    def test_listeners_are_woken(self):
+        """Test a message wakes the listeners of its conversation only"""
+        notifier = MessageNotifier()
+
+        async def listen():
+            with notifier.listen(1) as listener, notifier.listen(2) as other:
+                notifier.wake(1, 7)
+                return await listener.wait(1), await other.wait(0.01)
+
+        self.assertEqual(asyncio.run(listen()), (7, None))
+        self.assertEqual(notifier._listeners, {})
@@ -0,0 +1,179 @@
+import atexit
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from .models import Tweet, LikeCounterShard
+from .utils import count_related
+
+logger = logging.getLogger(__name__)
+
+def add_to_counter(model, pk, field, delta):
+    """Atomically add delta to a counter column without reading the row first"""
+    model._base_manager.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def like_count_cache_key(tweet_id):
+    return f'like_count:{tweet_id}'
+
+
+def add_to_like_shard(tweet_id, delta, shard=None):
+    """Add delta to one random shard so concurrent likes of the same tweet don't wait on one row"""
+    if shard is None:
+        shard = random.randrange(settings.LIKE_COUNTER_SHARDS)
+    shard_row = LikeCounterShard.objects.filter(tweet_id=tweet_id, shard=shard)
+    if not shard_row.update(count=F('count') + delta):
+        try:
+            with transaction.atomic():
+                LikeCounterShard.objects.create(tweet_id=tweet_id, shard=shard, count=delta)
+        except IntegrityError:
+            # Another request created the shard first
+            shard_row.update(count=F('count') + delta)
+    cache.delete(like_count_cache_key(tweet_id))
+
+
+class LikeCounterBuffer:
+    """
+    Collect like count changes in memory and write them to the shards every
+    LIKE_COUNTER_FLUSH_INTERVAL seconds, one write per tweet however many likes it got
+    """
+
+    def __init__(self):
+        self.pending = defaultdict(int)
+        self.lock = threading.Lock()
+        self.flusher = None
+
+    def add(self, tweet_id, delta):
+        with self.lock:
+            self.pending[tweet_id] += delta
+            if self.flusher is None or not self.flusher.is_alive():
+                self.start()
+
+    def start(self):
+        if self.flusher is None:
+            atexit.register(self.flush)
+        self.flusher = threading.Thread(target=self.run, name='like-counter', daemon=True)
+        self.flusher.start()
+
+    def run(self):
+        while True:
+            time.sleep(settings.LIKE_COUNTER_FLUSH_INTERVAL)
+            # The thread keeps its database connection between flushes
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing the like counters failed')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Write the pending likes, the ones that fail wait for the next flush"""
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(int)
+        for tweet_id, delta in pending.items():
+            if not delta:
+                continue
+            try:
+                add_to_like_shard(tweet_id, delta)
+            except Exception:
+                logger.exception('Could not write %s likes of tweet %s, retrying at the next flush',
+                                 delta, tweet_id)
+                with self.lock:
+                    self.pending[tweet_id] += delta
+        return len(pending)
+
+
+like_counter_buffer = LikeCounterBuffer()
+
+
+def add_like(tweet_id, delta):
+    """Count a new (delta=1) or removed (delta=-1) like the way LIKE_COUNTER_MODE says"""
+    mode = settings.LIKE_COUNTER_MODE
+    if mode == 'buffered':
+        transaction.on_commit(lambda: like_counter_buffer.add(tweet_id, delta))
+    elif mode == 'sharded':
+        add_to_like_shard(tweet_id, delta)
+    else:
+        add_to_counter(Tweet, tweet_id, 'like_count', delta)
+
+
+def like_counts(tweets):
+    """
+    Return the number of likes of every tweet by id: the like_count column plus the
+    shards that are not folded into it yet. Totals are cached for LIKE_COUNT_CACHE_TIMEOUT
+    seconds and a whole page of tweets is read with at most one query
+    """
+    counts = {tweet.id: tweet.like_count for tweet in tweets}
+    if settings.LIKE_COUNTER_MODE == 'row':
+        return counts
+    cached = cache.get_many([like_count_cache_key(tweet_id) for tweet_id in counts])
+    missing = []
+    for tweet_id in counts:
+        if like_count_cache_key(tweet_id) in cached:
+            counts[tweet_id] = cached[like_count_cache_key(tweet_id)]
+        else:
+            missing.append(tweet_id)
+    if missing:
+        shards = LikeCounterShard.objects.filter(tweet_id__in=missing).values(
+            'tweet_id').annotate(total=Sum('count')).values_list('tweet_id', 'total')
+        for tweet_id, total in shards:
+            counts[tweet_id] += total
+        cache.set_many({like_count_cache_key(tweet_id): counts[tweet_id] for tweet_id in missing},
+                       settings.LIKE_COUNT_CACHE_TIMEOUT)
+    return counts
+
+
+def fold_like_shards():
+    """Move the shard totals into Tweet.like_count and delete the shards"""
+    tweet_ids = list(LikeCounterShard.objects.values_list(
+        'tweet_id', flat=True).distinct())
+    for tweet_id in tweet_ids:
+        with transaction.atomic():
+            shards = list(LikeCounterShard.objects.select_for_update().filter(tweet_id=tweet_id))
+            LikeCounterShard.objects.filter(pk__in=[shard.pk for shard in shards]).delete()
+            add_to_counter(Tweet, tweet_id, 'like_count', sum(shard.count for shard in shards))
+    return len(tweet_ids)
+
+
+def counter_columns():
+    """(model, counter column, reverse relation it counts) of every denormalized counter"""
+    user_model = get_user_model()
+    return [
+        (Tweet, 'like_count', 'likes'),
+        (Tweet, 'reply_count', 'replies'),
+        (Tweet, 'retweet_count', 'retweets'),
+        (Tweet, 'quote_count', 'quotes'),
+        (user_model, 'tweet_count', 'tweets'),
+        (user_model, 'followers_count', 'followers'),
+        (user_model, 'following_count', 'follows'),
+    ]
+
+
+def unfolded_like_count():
+    """The total of the shards not folded into Tweet.like_count yet, as a correlated subquery"""
+    shards = LikeCounterShard.objects.filter(tweet_id=OuterRef('pk')).order_by().values(
+        'tweet_id').annotate(total=Sum('count')).values('total')
+    return Coalesce(Subquery(shards), 0)
+
+
+def reconcile_counter(model, field, related_name, dry_run=False, batch_size=1000):
+    """Set a counter column back to the real count on every row where it drifted"""
+    actual = count_related(model, related_name)
+    if model is Tweet and field == 'like_count':
+        # The shards count on top of the column, including the ones written since the last fold
+        actual = actual - unfolded_like_count()
+    drifted = list(model._base_manager.annotate(actual=actual).exclude(
+        **{field: F('actual')}).values_list('pk', flat=True))
+    if not dry_run:
+        for start in range(0, len(drifted), batch_size):
+            model._base_manager.filter(pk__in=drifted[start:start + batch_size]).update(
+                **{field: actual})
+    return len(drifted)
@@ -0,0 +1,41 @@
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.notifications import aggregate_notifications
+
+logger = logging.getLogger('core.notifications')
+
+
+class Command(BaseCommand):
+    help = 'Fold the notification log into the users\' notifications, polling the log until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Stop once the log is empty instead of polling')
+        parser.add_argument('--batch-size', type=int, default=settings.NOTIFICATION_BATCH_SIZE,
+                            help='Events folded in one transaction')
+        parser.add_argument('--interval', type=float, default=settings.NOTIFICATION_POLL_INTERVAL,
+                            help='Seconds to wait when the log is empty')
+
+    def handle(self, *args, **options):
+        total = 0
+        started = time.perf_counter()
+        try:
+            while True:
+                batch_started = time.perf_counter()
+                folded = aggregate_notifications(options['batch_size'])
+                if folded:
+                    total += folded
+                    elapsed = time.perf_counter() - batch_started
+                    logger.info('Folded %s notification events in %.2fs (%.0f events/s)',
+                                folded, elapsed, folded / elapsed)
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Folded {total} notification events in {elapsed:.2f}s'))
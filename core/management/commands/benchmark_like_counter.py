@@ -0,0 +1,63 @@
+import threading
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from django.test.utils import override_settings
+from core.counters import add_to_counter, add_to_like_shard, like_counts
+from core.models import Tweet
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of likes counted on the single Tweet.like_count row '
+            'and on the sharded counter with concurrent threads, in a throwaway test database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--likes', type=int, default=500,
+                            help='Likes counted by every thread')
+        parser.add_argument('--shards', type=int, default=16)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = get_user_model().objects.create_user(
+                email='benchmark@example.com', username='benchmark', firstname='bench',
+                lastname='mark', password='benchmark')
+            with override_settings(LIKE_COUNTER_MODE='sharded', LIKE_COUNTER_SHARDS=options['shards']):
+                for name, count_like in (
+                        ('single row', lambda tweet_id: add_to_counter(Tweet, tweet_id, 'like_count', 1)),
+                        (f'{options["shards"]} shards', lambda tweet_id: add_to_like_shard(tweet_id, 1))):
+                    tweet = Tweet.objects.create(content='viral tweet', user=user)
+                    self.run_benchmark(name, tweet, count_like, options['threads'], options['likes'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_benchmark(self, name, tweet, count_like, thread_count, likes):
+        errors = []
+
+        def like_many():
+            try:
+                for i in range(likes):
+                    try:
+                        count_like(tweet.id)
+                    except DatabaseError as error:
+                        errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=like_many) for i in range(thread_count)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        tweet.refresh_from_db()
+        total = thread_count * likes
+        self.stdout.write(
+            f'{name}: {total} likes from {thread_count} threads in {elapsed:.2f}s, '
+            f'{total / elapsed:.0f} likes/s, {len(errors)} errors, '
+            f'counted {like_counts([tweet])[tweet.id]}')
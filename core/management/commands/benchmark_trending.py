@@ -0,0 +1,88 @@
+import datetime
+import random
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from core.models import Tweet, Like, Reply, SaveTweet, TrendingTweet
+from core.trending import compute_trending, trending_tweets
+
+
+class Command(BaseCommand):
+    help = ('Time compute_trending and the Explore read on a synthetic dataset '
+            'in a throwaway test database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--tweets', type=int, default=1000000)
+        parser.add_argument('--likes', type=int, default=2000000)
+        parser.add_argument('--replies', type=int, default=200000)
+        parser.add_argument('--saves', type=int, default=200000)
+        parser.add_argument('--days', type=int, default=30,
+                            help='Tweets are spread over this many days')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            started = time.perf_counter()
+            self.create_dataset(options)
+            self.stdout.write(f'Created the dataset in {time.perf_counter() - started:.1f}s')
+
+            started = time.perf_counter()
+            count = compute_trending()
+            self.stdout.write(f'compute_trending: ranked {count} tweets in {time.perf_counter() - started:.2f}s')
+
+            for name, read_page in (
+                    ('ranking lookup', lambda: list(TrendingTweet.objects.filter(rank__lte=20).order_by('rank'))),
+                    ('Explore page with its likes', lambda: trending_tweets(20))):
+                runs = 20
+                started = time.perf_counter()
+                for i in range(runs):
+                    read_page()
+                elapsed_ms = (time.perf_counter() - started) * 1000 / runs
+                self.stdout.write(f'{name}: {elapsed_ms:.2f}ms per page of 20')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def create_dataset(self, options):
+        batch_size = options['batch_size']
+        user_model = get_user_model()
+        user_model.objects.bulk_create(
+            [user_model(email=f'user{i}@example.com', username=f'user{i}', firstname='bench',
+                        lastname='mark', password='!') for i in range(options['users'])],
+            batch_size=batch_size)
+        user_ids = list(user_model.objects.values_list('id', flat=True))
+
+        now = timezone.now()
+        span = options['days'] * 24 * 3600
+        date_created = Tweet._meta.get_field('date_created')
+        # bulk_create would stamp every tweet with the current time
+        date_created.auto_now_add = False
+        try:
+            for start in range(0, options['tweets'], batch_size):
+                count = min(batch_size, options['tweets'] - start)
+                Tweet.objects.bulk_create(
+                    [Tweet(content='benchmark tweet', user_id=random.choice(user_ids),
+                           date_created=now - datetime.timedelta(seconds=random.randrange(span)))
+                     for i in range(count)])
+        finally:
+            date_created.auto_now_add = True
+        tweet_ids = list(Tweet.objects.order_by('-date_created').values_list('id', flat=True))
+
+        def popular_tweet():
+            # Engagement is skewed towards a few recent tweets, like real traffic
+            return tweet_ids[int(len(tweet_ids) * random.random() ** 4)]
+
+        for model, total in ((Like, options['likes']), (SaveTweet, options['saves'])):
+            for start in range(0, total, batch_size):
+                model.objects.bulk_create(
+                    [model(user_id=random.choice(user_ids), tweet_id=popular_tweet())
+                     for i in range(min(batch_size, total - start))],
+                    ignore_conflicts=True)
+        for start in range(0, options['replies'], batch_size):
+            Reply.objects.bulk_create(
+                [Reply(text='benchmark reply', user_id=random.choice(user_ids), tweet_id=popular_tweet())
+                 for i in range(min(batch_size, options['replies'] - start))])
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core.trending import compute_trending
+
+
+class Command(BaseCommand):
+    help = 'Rank the trending tweets shown on the Explore page, run it every few minutes from cron'
+
+    def handle(self, *args, **options):
+        count = compute_trending()
+        self.stdout.write(self.style.SUCCESS(f'Ranked {count} trending tweets'))
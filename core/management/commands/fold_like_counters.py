@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core.counters import fold_like_shards
+
+
+class Command(BaseCommand):
+    help = 'Move the sharded like counts into Tweet.like_count'
+
+    def handle(self, *args, **options):
+        folded = fold_like_shards()
+        self.stdout.write(self.style.SUCCESS(f'Folded the like shards of {folded} tweets'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from core.models import Tweet
+from core.search import index_tweet, search_backend
+
+
+class Command(BaseCommand):
+    help = 'Recreate the tweet search token index from the Tweet table'
+
+    def handle(self, *args, **options):
+        if search_backend() != 'index':
+            self.stdout.write('Tweets are searched with PostgreSQL full-text search, nothing to rebuild')
+            return
+        count = 0
+        for tweet in Tweet.objects.only('id', 'content').iterator():
+            index_tweet(tweet)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} tweets'))
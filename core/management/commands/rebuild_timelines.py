@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from core.timeline import rebuild_timeline, rebuild_all_timelines
+
+
+class Command(BaseCommand):
+    help = 'Rebuild materialized home timelines from the Follow and Tweet tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help='Only rebuild the timelines of these users')
+
+    def handle(self, *args, **options):
+        usernames = options['usernames']
+        if not usernames:
+            count = rebuild_all_timelines()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} timelines'))
+            return
+
+        for username in usernames:
+            try:
+                user = get_user_model().objects.get(username=username)
+            except get_user_model().DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+            rebuild_timeline(user.id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(usernames)} timelines'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.counters import counter_columns, reconcile_counter, fold_like_shards
+from core.notifications import reconcile_unread_notifications
+from core.threads import reconcile_reply_counts
+
+
+class Command(BaseCommand):
+    help = 'Repair the denormalized like, reply, thread, tweet, follower, following and unread notification counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many rows drifted')
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            # Not needed for the like counts, which leave the shards out, but keeps them few
+            fold_like_shards()
+        for model, field, related_name in counter_columns():
+            with transaction.atomic():
+                drifted = reconcile_counter(
+                    model, field, related_name, dry_run=options['dry_run'])
+            self.stdout.write(
+                f'{model._meta.label}.{field}: {drifted} rows drifted')
+        with transaction.atomic():
+            drifted = reconcile_reply_counts(dry_run=options['dry_run'])
+        self.stdout.write(f'core.Reply.reply_count: {drifted} rows drifted')
+        with transaction.atomic():
+            drifted = reconcile_unread_notifications(dry_run=options['dry_run'])
+        self.stdout.write(f'users.CustomUser.unread_notifications: {drifted} rows drifted')
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Counters reconciled'))
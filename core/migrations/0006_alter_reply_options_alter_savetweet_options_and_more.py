@@ -0,0 +1,43 @@
+# Generated by Django 4.0 on 2026-10-18 06:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_alter_customuser_options'),
+        ('core', '0005_alter_reply_options'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='reply',
+            options={'ordering': ['-id'], 'verbose_name_plural': 'Replies'},
+        ),
+        migrations.AlterModelOptions(
+            name='savetweet',
+            options={'verbose_name_plural': 'Save Tweets'},
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='users.customuser')),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='core.tweet')),
+            ],
+            options={
+                'verbose_name_plural': 'Timeline Entries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['owner', '-created', '-tweet'], name='timeline_owner_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('owner', 'tweet'), name='A tweet shows up once in a timeline'),
+        ),
+    ]
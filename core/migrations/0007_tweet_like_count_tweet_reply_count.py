@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-18 06:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_alter_reply_options_alter_savetweet_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
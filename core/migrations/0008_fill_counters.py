@@ -0,0 +1,34 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_related(model, related_name):
+    # A copy of core.utils.count_related as it was when this migration was written
+    relation = model._meta.get_field(related_name)
+    field_name = relation.field.name
+    rows = relation.related_model._base_manager.filter(**{field_name: OuterRef('pk')})
+    return Coalesce(Subquery(rows.order_by().values(field_name).annotate(
+        count=Count('pk')).values('count')), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Tweet = apps.get_model('core', 'Tweet')
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Tweet.objects.update(like_count=count_related(Tweet, 'likes'),
+                         reply_count=count_related(Tweet, 'replies'))
+    CustomUser.objects.update(tweet_count=count_related(CustomUser, 'tweets'),
+                              followers_count=count_related(CustomUser, 'followers'),
+                              following_count=count_related(CustomUser, 'follows'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_tweet_like_count_tweet_reply_count'),
+        ('users', '0005_customuser_followers_count_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.0 on 2026-10-18 06:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_fill_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LikeCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='like_shards', to='core.tweet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='likecountershard',
+            constraint=models.UniqueConstraint(fields=('tweet', 'shard'), name='One row per like counter shard'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0 on 2026-10-18 06:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_likecountershard_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TweetSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='core.tweet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='tweetsearchtoken',
+            constraint=models.UniqueConstraint(fields=('token', 'tweet'), name='A token is indexed once per tweet'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+import re
+from django.conf import settings
+from django.db import migrations
+
+# The same expression as the SearchVector of core.search, with the same config
+CREATE_GIN_INDEX = (
+    "CREATE INDEX IF NOT EXISTS tweet_content_search_idx ON core_tweet "
+    "USING GIN (to_tsvector(%s::regconfig, COALESCE(content, '')))")
+DROP_GIN_INDEX = 'DROP INDEX IF EXISTS tweet_content_search_idx'
+
+# A copy of core.search.tokenize as it was when this migration was written
+TOKEN_RE = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 64
+
+
+def tokenize(text):
+    return list(dict.fromkeys(
+        token[:MAX_TOKEN_LENGTH] for token in TOKEN_RE.findall(text.lower())))
+
+
+def build_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_GIN_INDEX, [settings.TWEET_SEARCH_CONFIG])
+        return
+    Tweet = apps.get_model('core', 'Tweet')
+    TweetSearchToken = apps.get_model('core', 'TweetSearchToken')
+    for tweet in Tweet.objects.only('id', 'content').iterator():
+        TweetSearchToken.objects.bulk_create(
+            [TweetSearchToken(token=token, tweet_id=tweet.id) for token in tokenize(tweet.content)],
+            ignore_conflicts=True)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_GIN_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_tweetsearchtoken'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_search_index, drop_search_index),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.0 on 2026-10-18 06:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_tweet_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingTweet',
+            fields=[
+                ('tweet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='core.tweet')),
+                ('rank', models.PositiveIntegerField(db_index=True)),
+                ('score', models.FloatField()),
+                ('computed', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['date_created'], name='tweet_date_created_idx'),
+        ),
+    ]
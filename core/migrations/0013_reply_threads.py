@@ -0,0 +1,46 @@
+# Generated by Django 4.0 on 2026-10-18 07:16
+
+from django.db import migrations, models
+from django.db.models.functions import Cast, LPad
+import django.db.models.deletion
+
+
+def fill_paths(apps, schema_editor):
+    # Every existing reply is a reply to its tweet
+    Reply = apps.get_model('core', 'Reply')
+    Reply.objects.update(path=LPad(Cast('id', models.CharField()), 10, models.Value('0')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_trendingtweet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reply',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='core.reply'),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(fields=['tweet', 'parent', '-reply_count', '-id'], name='reply_branches_idx'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
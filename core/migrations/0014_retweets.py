@@ -0,0 +1,52 @@
+# Generated by Django 4.0 on 2026-10-18 07:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_customuser_picture_variants'),
+        ('core', '0013_reply_threads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timelineentry',
+            name='retweeted_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.customuser'),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='quote_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='quoted_tweet',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='quotes', to='core.tweet'),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='retweet_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Retweet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retweets', to='core.tweet')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retweets', to='users.customuser')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='retweet',
+            index=models.Index(fields=['user', '-date_created'], name='retweet_user_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='retweet',
+            constraint=models.UniqueConstraint(fields=('user', 'tweet'), name='A tweet is retweeted once by a user'),
+        ),
+    ]
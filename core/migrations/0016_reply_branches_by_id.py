@@ -0,0 +1,21 @@
+# Generated by Django 4.0 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_notifications'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='reply',
+            name='reply_branches_idx',
+        ),
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(fields=['tweet', 'parent', '-id'], name='reply_branches_idx'),
+        ),
+    ]
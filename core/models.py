@@ -1,5 +1,13 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+
+class TweetQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Fetch everything a serialized tweet shows with a fixed number of queries"""
+        return self.select_related('user', 'quoted_tweet__user').prefetch_related(
+            models.Prefetch('likes', queryset=Like.objects.select_related('user')))
 
 
 class Tweet(models.Model):
@@ -7,10 +15,28 @@ class Tweet(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(
         get_user_model(), on_delete=models.CASCADE, related_name='tweets')
+    # Kept up to date by the views, reconcile_counters repairs any drift.
+    # Likes can also be waiting in LikeCounterShard rows, read them with core.counters.like_counts
+    like_count = models.PositiveIntegerField(default=0)
+    reply_count = models.PositiveIntegerField(default=0)
+    retweet_count = models.PositiveIntegerField(default=0)
+    quote_count = models.PositiveIntegerField(default=0)
+    # Set on a quote tweet, the tweet it comments on
+    quoted_tweet = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='quotes')
+
+    objects = TweetQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Trending only scores the tweets of the last TRENDING_WINDOW hours
+            models.Index(fields=['date_created'], name='tweet_date_created_idx'),
+        ]
 
     @property
     def get_likes(self):
-        return self.likes.all().count()
+        from .counters import like_counts
+        return like_counts([self])[self.id]
     
     def __str__(self):
         return f'tweet {self.id} by {self.user.username}'
@@ -33,22 +59,139 @@ class Like(models.Model):
         return f'{self.user.username} liked tweet {self.tweet.id} by {self.tweet.user.username}'
 
 
+class LikeCounterShard(models.Model):
+    """Part of the likes of a tweet that are not folded into Tweet.like_count yet"""
+    tweet = models.ForeignKey(
+        Tweet, on_delete=models.CASCADE, related_name='like_shards')
+    shard = models.PositiveSmallIntegerField()
+    # Can go below zero when a like and its removal land on different shards
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tweet', 'shard'], name='One row per like counter shard'),
+        ]
+
+    def __str__(self):
+        return f'shard {self.shard} of tweet {self.tweet_id} likes'
+
+
+class TweetSearchToken(models.Model):
+    """One word of a tweet in the inverted index core.search falls back to"""
+    token = models.CharField(max_length=64)
+    tweet = models.ForeignKey(
+        Tweet, on_delete=models.CASCADE, related_name='search_tokens')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['token', 'tweet'], name='A token is indexed once per tweet'),
+        ]
+
+    def __str__(self):
+        return f'"{self.token}" in tweet {self.tweet_id}'
+
+
+# Width of the zero padded id of every reply in Reply.path
+REPLY_PATH_SEGMENT = 10
+
+
 class Reply(models.Model):
     text = models.TextField(max_length=200) #Make this required on the view
     user = models.ForeignKey(
         get_user_model(), on_delete=models.CASCADE, related_name='replies')
     tweet = models.ForeignKey(
         Tweet, on_delete=models.CASCADE, related_name='replies')
+    # None for a reply to the tweet itself
+    parent = models.ForeignKey(
+        'self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    # The ids of the replies from the top of the thread down to this one, so a
+    # thread is the replies whose path starts with its path, in depth first order
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Replies anywhere below this one, kept up to date by core.threads
+    reply_count = models.PositiveIntegerField(default=0)
     date_created = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f'reply to {self.tweet.user.username}\'s tweet by {self.user.username}'
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if adding and self.parent_id:
+            self.depth = self.parent.depth + 1
+        super().save(*args, **kwargs)
+        if adding and not self.path:
+            # The id is only known once the row exists
+            self.path = (self.parent.path if self.parent_id else '') + f'{self.id:0{REPLY_PATH_SEGMENT}d}'
+            Reply.objects.filter(pk=self.pk).update(path=self.path)
+
     class Meta:
         ordering = ['-id']
         verbose_name_plural = 'Replies'
+        indexes = [
+            # The branches of a tweet (parent is null) or of a reply, newest first
+            models.Index(fields=['tweet', 'parent', '-id'], name='reply_branches_idx'),
+        ]
 
-# class Retweet()
+class Retweet(models.Model):
+    """A user sharing a tweet with their followers, the timelines only reference it"""
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='retweets')
+    tweet = models.ForeignKey(
+        Tweet, on_delete=models.CASCADE, related_name='retweets')
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'tweet'], name='A tweet is retweeted once by a user'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-date_created'], name='retweet_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username} retweeted tweet {self.tweet_id}'
+
+
+class TimelineEntry(models.Model):
+    """A tweet pushed into the home timeline of one of its author's followers"""
+    owner = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='timeline_entries')
+    tweet = models.ForeignKey(
+        Tweet, on_delete=models.CASCADE, related_name='timeline_entries')
+    created = models.DateTimeField()
+    # The followed user whose retweet put the tweet here, None for their own tweets
+    retweeted_by = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'tweet'], name='A tweet shows up once in a timeline'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-created', '-tweet'],
+                         name='timeline_owner_created_idx'),
+        ]
+        verbose_name_plural = 'Timeline Entries'
+
+    def __str__(self):
+        return f'tweet {self.tweet_id} in {self.owner_id}\'s timeline'
+
+
+class TrendingTweet(models.Model):
+    """A tweet of the Explore page, the whole table is recomputed by core.trending"""
+    tweet = models.OneToOneField(
+        Tweet, on_delete=models.CASCADE, primary_key=True, related_name='trending')
+    rank = models.PositiveIntegerField(db_index=True)
+    score = models.FloatField()
+    computed = models.DateTimeField()
+
+    def __str__(self):
+        return f'tweet {self.tweet_id} trending at #{self.rank}'
 
 
 class SaveTweet(models.Model):
@@ -66,3 +209,54 @@ class SaveTweet(models.Model):
 
     def __str__(self):
         return f'{self.user.username} saved {self.tweet.id} tweet by {self.tweet.user.username}'
+
+
+class NotificationEvent(models.Model):
+    """
+    One action a user is notified of, appended to the log by the views and folded into
+    Notification rows by the aggregate_notifications worker. The log is only read in id
+    order, so it has no other index
+    """
+    LIKE = 'like'
+    REPLY = 'reply'
+    FOLLOW = 'follow'
+    RETWEET = 'retweet'
+    QUOTE = 'quote'
+    VERB_CHOICES = [(LIKE, 'Like'), (REPLY, 'Reply'), (FOLLOW, 'Follow'), (RETWEET, 'Retweet'), (QUOTE, 'Quote')]
+
+    recipient = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, db_index=False, related_name='+')
+    actor = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, db_index=False, related_name='+')
+    verb = models.CharField(max_length=10, choices=VERB_CHOICES)
+    tweet = models.ForeignKey(
+        Tweet, on_delete=models.CASCADE, null=True, blank=True, db_index=False, related_name='+')
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.verb} of user {self.actor_id} for user {self.recipient_id}'
+
+
+class Notification(models.Model):
+    """
+    The events of one verb on one tweet (or the follows) a user has not read yet,
+    e.g. "X and 41 others liked your tweet". Once read, the next event starts a new one
+    """
+    recipient = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='notifications')
+    verb = models.CharField(max_length=10, choices=NotificationEvent.VERB_CHOICES)
+    tweet = models.ForeignKey(
+        Tweet, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications')
+    # Ids of the latest NOTIFICATION_ACTORS_SHOWN actors, newest first, out of actor_count
+    actor_ids = models.JSONField(default=list)
+    actor_count = models.PositiveIntegerField(default=0)
+    is_read = models.BooleanField(default=False)
+    date_updated = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', '-date_updated', '-id'], name='notification_recipient_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.actor_count} {self.verb} for user {self.recipient_id}'
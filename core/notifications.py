@@ -0,0 +1,101 @@
+import logging
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .counters import add_to_counter
+from .models import Notification, NotificationEvent
+
+logger = logging.getLogger(__name__)
+
+
+def notify(recipient_id, actor_id, verb, tweet_id=None):
+    """Append an event to the notification log, nobody is notified of their own actions"""
+    if recipient_id == actor_id:
+        return None
+    return NotificationEvent.objects.create(
+        recipient_id=recipient_id, actor_id=actor_id, verb=verb, tweet_id=tweet_id)
+
+
+def aggregate_notifications(batch_size=None):
+    """
+    Fold one batch of the notification log into the unread Notification rows of its
+    recipients and return how many events were folded. The events are locked until
+    the batch is done so several workers never fold the same event twice
+    """
+    batch_size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+    with transaction.atomic():
+        events = list(NotificationEvent.objects.select_for_update(skip_locked=True).order_by(
+            'id').values_list('id', 'recipient_id', 'verb', 'tweet_id', 'actor_id')[:batch_size])
+        if not events:
+            return 0
+
+        # The actors of every (recipient, verb, tweet), oldest first
+        groups = {}
+        for _, recipient_id, verb, tweet_id, actor_id in events:
+            groups.setdefault((recipient_id, verb, tweet_id), []).append(actor_id)
+        recipient_ids = sorted({recipient_id for recipient_id, _, _ in groups})
+        # Locked in the same order as mark_notifications_read so the unread counters stay exact
+        list(get_user_model().objects.select_for_update().filter(
+            pk__in=recipient_ids).order_by('pk').values_list('pk', flat=True))
+
+        # Only the notifications the batch adds to, a recipient can have many others unread
+        keys = Q()
+        for recipient_id, verb, tweet_id in groups:
+            keys |= Q(recipient_id=recipient_id, verb=verb, tweet_id=tweet_id)
+        unread = {(notification.recipient_id, notification.verb, notification.tweet_id): notification
+                  for notification in Notification.objects.filter(keys, is_read=False)}
+        now = timezone.now()
+        updated, created = [], []
+        for key, actor_ids in groups.items():
+            notification = unread.get(key)
+            if notification is None:
+                recipient_id, verb, tweet_id = key
+                notification = Notification(recipient_id=recipient_id, verb=verb, tweet_id=tweet_id)
+                created.append(notification)
+            else:
+                updated.append(notification)
+            for actor_id in actor_ids:
+                # Only the shown actors are checked, an actor repeating an older action counts twice
+                if actor_id in notification.actor_ids:
+                    notification.actor_ids.remove(actor_id)
+                else:
+                    notification.actor_count += 1
+                notification.actor_ids.insert(0, actor_id)
+            del notification.actor_ids[settings.NOTIFICATION_ACTORS_SHOWN:]
+            notification.date_updated = now
+
+        Notification.objects.bulk_update(updated, ['actor_ids', 'actor_count', 'date_updated'], batch_size=500)
+        Notification.objects.bulk_create(created, batch_size=500)
+        for recipient_id, count in Counter(notification.recipient_id for notification in created).items():
+            add_to_counter(get_user_model(), recipient_id, 'unread_notifications', count)
+        NotificationEvent.objects.filter(pk__in=[event[0] for event in events]).delete()
+    logger.debug('Folded %s notification events into %s new and %s updated notifications',
+                 len(events), len(created), len(updated))
+    return len(events)
+
+
+def mark_notifications_read(user_id):
+    """Mark every notification of a user read and reset their unread counter"""
+    with transaction.atomic():
+        get_user_model().objects.select_for_update().filter(pk=user_id).values_list('pk', flat=True).first()
+        Notification.objects.filter(recipient_id=user_id, is_read=False).update(is_read=True)
+        get_user_model().objects.filter(pk=user_id).update(unread_notifications=0)
+
+
+def reconcile_unread_notifications(dry_run=False, batch_size=1000):
+    """Set the unread counter of every user where it drifted back to their unread notifications"""
+    user_model = get_user_model()
+    unread = Notification.objects.filter(recipient=OuterRef('pk'), is_read=False).order_by().values(
+        'recipient').annotate(count=Count('pk')).values('count')
+    actual = Coalesce(Subquery(unread), 0)
+    drifted = list(user_model._base_manager.annotate(actual=actual).exclude(
+        unread_notifications=F('actual')).values_list('pk', flat=True))
+    if not dry_run:
+        for start in range(0, len(drifted), batch_size):
+            user_model._base_manager.filter(pk__in=drifted[start:start + batch_size]).update(
+                unread_notifications=actual)
+    return len(drifted)
@@ -0,0 +1,61 @@
+import re
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, ExpressionWrapper, FloatField, IntegerField, Q, Value
+from django.db.models.functions import Cast
+from .models import TweetSearchToken
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 64
+
+
+def tokenize(text):
+    """Split a text into its distinct lowercase words"""
+    return list(dict.fromkeys(
+        token[:MAX_TOKEN_LENGTH] for token in TOKEN_RE.findall(text.lower())))
+
+
+def search_backend():
+    """'postgres' searches a GIN indexed tsvector, 'index' the TweetSearchToken table"""
+    backend = settings.TWEET_SEARCH_BACKEND
+    if backend == 'auto':
+        return 'postgres' if connection.vendor == 'postgresql' else 'index'
+    return backend
+
+
+def index_tweet(tweet):
+    """Replace the indexed tokens of a tweet, called whenever a tweet is saved"""
+    with transaction.atomic():
+        TweetSearchToken.objects.filter(tweet=tweet).delete()
+        TweetSearchToken.objects.bulk_create(
+            [TweetSearchToken(token=token, tweet=tweet) for token in tokenize(tweet.content)])
+
+
+def search_tweets(queryset, query):
+    """
+    Filter a tweet queryset down to the tweets matching query and annotate their
+    relevance as an integer rank, higher is better
+    """
+    if search_backend() == 'postgres':
+        return _search_postgres(queryset, query)
+    return _search_index(queryset, query)
+
+
+def _search_index(queryset, query):
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset.none()
+    # The last word may still be being typed
+    matches = Q(search_tokens__token__in=tokens) | Q(search_tokens__token__startswith=tokens[-1])
+    return queryset.filter(matches).annotate(rank=Count('search_tokens'))
+
+
+def _search_postgres(queryset, query):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+    # Same expression as the tweet_content_search_idx GIN index
+    vector = SearchVector('content', config=settings.TWEET_SEARCH_CONFIG)
+    search_query = SearchQuery(query, config=settings.TWEET_SEARCH_CONFIG)
+    rank = ExpressionWrapper(SearchRank(vector, search_query) * Value(1000), output_field=FloatField())
+    return queryset.annotate(search=vector).filter(search=search_query).annotate(
+        rank=Cast(rank, IntegerField()))
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import Tweet
+from .search import index_tweet, search_backend
+
+
+@receiver(post_save, sender=Tweet)
+def reindex_tweet(sender, instance, raw=False, **kwargs):
+    """Keep the token index in step with the tweets when the database has no full-text search"""
+    if raw or search_backend() != 'index':
+        return
+    index_tweet(instance)
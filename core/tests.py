@@ -1,7 +1,23 @@
-from django.test import TestCase
-from django.db import IntegrityError
+import datetime
+from io import StringIO
+from django.test import TestCase, override_settings
+from django.db import DatabaseError, IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from unittest import mock
 from django.contrib.auth import get_user_model
-from .models import Tweet, Like, Reply, SaveTweet
+from django.core.management import call_command
+from django.core.cache import cache
+from django.utils import timezone
+from users.models import Follow
+from .models import Tweet, Like, Reply, Retweet, SaveTweet, TimelineEntry, Notification, NotificationEvent, LikeCounterShard, TweetSearchToken, TrendingTweet
+from . import counters
+from .counters import add_like, like_counts, like_counter_buffer
+from .notifications import aggregate_notifications, mark_notifications_read, notify, reconcile_unread_notifications
+from .search import tokenize, search_tweets
+from .threads import ancestor_ids, branches, count_new_reply, reconcile_reply_counts, subtree, thread_parent
+from .trending import TRENDING_COMPUTED_KEY, TRENDING_LOCK_KEY, compute_trending, refresh_trending, trending_tweets
+from .timeline import (fan_out_tweet, fan_out_retweet, retract_retweet, prune_timeline, rebuild_timeline,
+                       read_timeline, get_feed_stats)
 
 
 class TestTweet(TestCase):
@@ -76,6 +92,61 @@ class TestReply(TestCase):
             Reply.objects.create(text='new test', tweet=self.tweet)
 
 
+class TestReplyThreads(TestCase):
+    def setUp(self):
+        self.new_user = get_user_model().objects.create_user(email='test@gmail.com', username='test_username',
+                                                             firstname='test_firstname', lastname='test_lastname', password='test_password')
+        self.tweet = Tweet.objects.create(content='some test', user=self.new_user)
+
+    def reply(self, parent=None):
+        reply = Reply.objects.create(text='reply', user=self.new_user, tweet=self.tweet,
+                                     parent=thread_parent(parent))
+        count_new_reply(reply)
+        return reply
+
+    def test_paths(self):
+        """Test a reply's path is the path of its parent followed by its own id"""
+        top = self.reply()
+        child = self.reply(top)
+        grandchild = self.reply(child)
+        self.assertEqual(grandchild.depth, 2)
+        self.assertTrue(grandchild.path.startswith(child.path))
+        self.assertEqual(ancestor_ids(grandchild.path), [top.id, child.id])
+        self.assertEqual(Reply.objects.get(pk=grandchild.pk).path, grandchild.path)
+
+    def test_subtree_and_branches(self):
+        """Test a thread comes depth first and the branches biggest first, with their sizes"""
+        small, big = self.reply(), self.reply()
+        child = self.reply(big)
+        grandchild = self.reply(child)
+        other_child = self.reply(big)
+        self.reply(small)
+        self.assertEqual(list(subtree(big).order_by('path')), [big, child, grandchild, other_child])
+        ranked = list(branches(self.tweet.id).order_by('-reply_count', '-id'))
+        self.assertEqual(ranked, [big, small])
+        self.assertEqual([reply.reply_count for reply in ranked], [3, 1])
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.reply_count, 6)
+
+    @override_settings(REPLY_MAX_DEPTH=2)
+    def test_max_depth(self):
+        """Test a reply to the deepest reply of a thread joins its branch"""
+        top = self.reply()
+        child = self.reply(top)
+        deeper = self.reply(child)
+        self.assertEqual((deeper.parent, deeper.depth), (top, 1))
+
+    def test_reconcile_reply_counts(self):
+        """Test the thread sizes are recomputed from the paths"""
+        top = self.reply()
+        self.reply(self.reply(top))
+        Reply.objects.filter(pk=top.pk).update(reply_count=0)
+        self.assertEqual(reconcile_reply_counts(dry_run=True), 1)
+        self.assertEqual(reconcile_reply_counts(), 1)
+        top.refresh_from_db()
+        self.assertEqual(top.reply_count, 2)
+
+
 class TestSaveTweet(TestCase):
     def setUp(self):
         self.new_user = get_user_model().objects.create_user(email='test@gmail.com', username='test_username',
@@ -103,3 +174,427 @@ class TestSaveTweet(TestCase):
         """Test integrity error for trying to create an already existing save tweet object"""
         with self.assertRaises(IntegrityError):
             SaveTweet.objects.create(user=self.new_user, tweet=self.tweet)
+
+
+class TestTimeline(TestCase):
+    def setUp(self):
+        self.new_user1 = get_user_model().objects.create_user(email='test@gmail.com', username='test_username',
+                                                              firstname='test_firstname', lastname='test_lastname', password='test_password')
+        self.new_user2 = get_user_model().objects.create_user(email='test2@gmail.com', username='test_username2',
+                                                              firstname='test_firstname2', lastname='test_lastname2', password='test_password2')
+        Follow.objects.create(user=self.new_user2, follower=self.new_user1)
+
+    @override_settings(TIMELINE_DEPTH=2)
+    def test_fan_out_trims_timeline(self):
+        """Test only the newest TIMELINE_DEPTH tweets are kept in a timeline"""
+        tweets = [Tweet.objects.create(content=f'tweet {i}', user=self.new_user2) for i in range(3)]
+        for tweet in tweets:
+            fan_out_tweet(tweet)
+        entries = TimelineEntry.objects.filter(owner=self.new_user1).order_by('-created', '-tweet_id')
+        self.assertEqual([entry.tweet_id for entry in entries], [tweets[2].id, tweets[1].id])
+
+    @override_settings(TIMELINE_DEPTH=2)
+    def test_fan_out_queries_do_not_grow_with_followers(self):
+        """Test pushing a tweet to more followers takes the same number of queries"""
+        def fan_out_queries():
+            tweet = Tweet.objects.create(content='some test', user=self.new_user2)
+            tweet.user.refresh_from_db()
+            with CaptureQueriesContext(connection) as queries:
+                fan_out_tweet(tweet)
+            return len(queries)
+
+        one_follower = fan_out_queries()
+        for i in range(3, 6):
+            follower = get_user_model().objects.create_user(
+                email=f'test{i}@gmail.com', username=f'test_username{i}', firstname='test_firstname',
+                lastname='test_lastname', password='test_password')
+            Follow.objects.create(user=self.new_user2, follower=follower)
+            for _ in range(3):
+                fan_out_queries()
+        self.assertEqual(fan_out_queries(), one_follower)
+        for follower_id in Follow.objects.filter(user=self.new_user2).values_list('follower_id', flat=True):
+            self.assertEqual(TimelineEntry.objects.filter(owner_id=follower_id).count(), 2)
+
+    def test_rebuild_timelines_command(self):
+        """Test the rebuild_timelines command recreates timelines from the follow table"""
+        tweet = Tweet.objects.create(content='some test', user=self.new_user2)
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.new_user1, tweet=tweet).exists())
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.new_user2).exists())
+
+    @override_settings(FEED_FANOUT_FOLLOWER_THRESHOLD=1)
+    def test_high_follower_tweets_are_pulled(self):
+        """Test tweets of accounts above the threshold are merged at read time instead of pushed"""
+        pushed_tweet = Tweet.objects.create(content='pushed', user=self.new_user1)
+        TimelineEntry.objects.create(owner=self.new_user1, tweet=pushed_tweet, created=pushed_tweet.date_created)
+        get_user_model().objects.filter(pk=self.new_user2.pk).update(followers_count=1)
+        self.new_user2.refresh_from_db()
+        pulled_tweet = Tweet.objects.create(content='pulled', user=self.new_user2)
+        fan_out_tweet(pulled_tweet)
+
+        self.assertFalse(TimelineEntry.objects.filter(tweet=pulled_tweet).exists())
+        self.assertEqual(read_timeline(self.new_user1.id), [pulled_tweet, pushed_tweet])
+        self.assertGreaterEqual(get_feed_stats()['fan_out_skipped'], 1)
+
+
+class TestRetweetTimeline(TestCase):
+    def setUp(self):
+        self.reader = get_user_model().objects.create_user(email='test@gmail.com', username='test_username',
+                                                           firstname='test_firstname', lastname='test_lastname', password='test_password')
+        self.retweeter = get_user_model().objects.create_user(email='test2@gmail.com', username='test_username2',
+                                                              firstname='test_firstname2', lastname='test_lastname2', password='test_password2')
+        self.author = get_user_model().objects.create_user(email='test3@gmail.com', username='test_username3',
+                                                           firstname='test_firstname3', lastname='test_lastname3', password='test_password3')
+        Follow.objects.create(user=self.retweeter, follower=self.reader)
+
+    def entry(self, tweet):
+        return TimelineEntry.objects.get(owner=self.reader, tweet=tweet)
+
+    def test_retweet_of_unfollowed_author(self):
+        """Test a retweet puts the tweet in the timeline and retracting it takes it out"""
+        tweet = Tweet.objects.create(content='some test', user=self.author)
+        retweet = Retweet.objects.create(user=self.retweeter, tweet=tweet)
+        fan_out_retweet(retweet)
+        self.assertEqual(self.entry(tweet).retweeted_by, self.retweeter)
+        timeline = read_timeline(self.reader.id)
+        self.assertEqual(timeline, [tweet])
+        self.assertEqual(timeline[0].timeline_retweeted_by, self.retweeter)
+
+        retract_retweet(retweet)
+        self.assertFalse(TimelineEntry.objects.filter(tweet=tweet).exists())
+
+    def test_retract_keeps_the_retweet_of_another_followed_user(self):
+        """Test retracting a retweet leaves the tweet with the followers of another retweeter"""
+        other = get_user_model().objects.create_user(email='test4@gmail.com', username='test_username4',
+                                                     firstname='test_firstname4', lastname='test_lastname4', password='test_password4')
+        Follow.objects.create(user=other, follower=self.reader)
+        tweet = Tweet.objects.create(content='some test', user=self.author)
+        retweet = Retweet.objects.create(user=self.retweeter, tweet=tweet)
+        fan_out_retweet(retweet)
+        other_retweet = Retweet.objects.create(user=other, tweet=tweet)
+        fan_out_retweet(other_retweet)
+        self.assertEqual(self.entry(tweet).retweeted_by, self.retweeter)
+
+        retract_retweet(retweet)
+        self.assertEqual((self.entry(tweet).created, self.entry(tweet).retweeted_by),
+                         (other_retweet.date_created, other))
+
+    def test_retweet_within_window_is_deduplicated(self):
+        """Test a recent tweet stays in place when retweeted, an old one moves to the top"""
+        Follow.objects.create(user=self.author, follower=self.reader)
+        tweet = Tweet.objects.create(content='some test', user=self.author)
+        fan_out_tweet(tweet)
+        fan_out_retweet(Retweet.objects.create(user=self.retweeter, tweet=tweet))
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.reader).count(), 1)
+        self.assertEqual((self.entry(tweet).created, self.entry(tweet).retweeted_by), (tweet.date_created, None))
+
+        Retweet.objects.all().delete()
+        TimelineEntry.objects.filter(tweet=tweet).update(created=timezone.now() - datetime.timedelta(days=2))
+        retweet = Retweet.objects.create(user=self.retweeter, tweet=tweet)
+        fan_out_retweet(retweet)
+        self.assertEqual((self.entry(tweet).created, self.entry(tweet).retweeted_by), (retweet.date_created, self.retweeter))
+
+        retract_retweet(retweet)
+        self.assertEqual((self.entry(tweet).created, self.entry(tweet).retweeted_by), (tweet.date_created, None))
+
+    def test_unfollow_and_rebuild(self):
+        """Test unfollowing removes the retweets of a user and a rebuild brings them back"""
+        tweet = Tweet.objects.create(content='some test', user=self.author)
+        Retweet.objects.create(user=self.retweeter, tweet=tweet)
+        rebuild_timeline(self.reader.id)
+        self.assertEqual(self.entry(tweet).retweeted_by, self.retweeter)
+        prune_timeline(self.reader.id, self.retweeter.id)
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.reader).exists())
+
+    @override_settings(FEED_FANOUT_FOLLOWER_THRESHOLD=1)
+    def test_high_follower_retweets_are_pulled(self):
+        """Test retweets of accounts above the threshold are merged at read time once per tweet"""
+        get_user_model().objects.filter(pk=self.retweeter.pk).update(followers_count=1)
+        self.retweeter.refresh_from_db()
+        tweet = Tweet.objects.create(content='some test', user=self.author)
+        TimelineEntry.objects.create(owner=self.reader, tweet=tweet, created=tweet.date_created)
+        retweet = Retweet.objects.create(user=self.retweeter, tweet=tweet)
+        fan_out_retweet(retweet)
+        self.assertIsNone(self.entry(tweet).retweeted_by)
+        timeline = read_timeline(self.reader.id)
+        self.assertEqual(timeline, [tweet])
+        self.assertEqual(timeline[0].timeline_created, retweet.date_created)
+
+
+class TestNotifications(TestCase):
+    def setUp(self):
+        self.recipient = get_user_model().objects.create_user(email='test@gmail.com', username='test_username',
+                                                              firstname='test_firstname', lastname='test_lastname', password='test_password')
+        self.actors = [get_user_model().objects.create_user(email=f'test{i}@gmail.com', username=f'test_username{i}',
+                                                            firstname='test_firstname', lastname='test_lastname', password='test_password')
+                       for i in range(5)]
+        self.tweet = Tweet.objects.create(content='some test', user=self.recipient)
+
+    def test_events_are_folded(self):
+        """Test events are grouped by verb and tweet into unread notifications"""
+        self.assertIsNone(notify(self.recipient.id, self.recipient.id, NotificationEvent.LIKE, self.tweet.id))
+        for actor in self.actors:
+            notify(self.recipient.id, actor.id, NotificationEvent.LIKE, self.tweet.id)
+        notify(self.recipient.id, self.actors[0].id, NotificationEvent.LIKE, self.tweet.id)
+        notify(self.recipient.id, self.actors[0].id, NotificationEvent.FOLLOW)
+        self.assertEqual(aggregate_notifications(batch_size=3), 3)
+        self.assertEqual(aggregate_notifications(), 4)
+        self.assertEqual(aggregate_notifications(), 0)
+
+        like = Notification.objects.get(verb=NotificationEvent.LIKE)
+        self.assertEqual(like.actor_ids, [self.actors[0].id, self.actors[4].id, self.actors[3].id])
+        self.assertEqual(like.actor_count, 5)
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.recipient.unread_notifications, 2)
+        self.assertFalse(NotificationEvent.objects.exists())
+
+    def test_only_the_batch_notifications_are_loaded(self):
+        """Test folding loads the unread notifications of the batch's verbs and tweets, not all of the recipient's"""
+        other_tweets = [Tweet.objects.create(content='some test', user=self.recipient) for i in range(3)]
+        for tweet in other_tweets:
+            notify(self.recipient.id, self.actors[0].id, NotificationEvent.LIKE, tweet.id)
+        aggregate_notifications()
+        notify(self.recipient.id, self.actors[1].id, NotificationEvent.LIKE, self.tweet.id)
+        notify(self.recipient.id, self.actors[1].id, NotificationEvent.LIKE, other_tweets[0].id)
+        with mock.patch.object(Notification, 'from_db', wraps=Notification.from_db) as loaded:
+            aggregate_notifications()
+        self.assertEqual(loaded.call_count, 1)
+        self.assertEqual(Notification.objects.get(tweet=other_tweets[0]).actor_count, 2)
+        self.assertEqual(Notification.objects.get(tweet=self.tweet).actor_count, 1)
+
+    def test_read_notifications_are_not_reopened(self):
+        """Test an event after the notifications were read starts a new notification"""
+        notify(self.recipient.id, self.actors[0].id, NotificationEvent.LIKE, self.tweet.id)
+        aggregate_notifications()
+        mark_notifications_read(self.recipient.id)
+        notify(self.recipient.id, self.actors[1].id, NotificationEvent.LIKE, self.tweet.id)
+        aggregate_notifications()
+        self.assertEqual(list(Notification.objects.order_by('id').values_list('is_read', 'actor_count')),
+                         [(True, 1), (False, 1)])
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.recipient.unread_notifications, 1)
+
+    def test_reconcile_unread_notifications(self):
+        """Test the unread counters are recomputed from the unread notifications"""
+        notify(self.recipient.id, self.actors[0].id, NotificationEvent.FOLLOW)
+        aggregate_notifications()
+        get_user_model().objects.filter(pk=self.recipient.pk).update(unread_notifications=7)
+        self.assertEqual(reconcile_unread_notifications(dry_run=True), 1)
+        self.assertEqual(reconcile_unread_notifications(), 1)
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.recipient.unread_notifications, 1)
+
+
+class TestCounters(TestCase):
+    def setUp(self):
+        self.new_user1 = get_user_model().objects.create_user(email='test@gmail.com', username='test_username',
+                                                              firstname='test_firstname', lastname='test_lastname', password='test_password')
+        self.new_user2 = get_user_model().objects.create_user(email='test2@gmail.com', username='test_username2',
+                                                              firstname='test_firstname2', lastname='test_lastname2', password='test_password2')
+        self.tweet = Tweet.objects.create(content='some test', user=self.new_user1)
+        Like.objects.create(user=self.new_user2, tweet=self.tweet)
+        Reply.objects.create(text='some test', user=self.new_user2, tweet=self.tweet)
+        Follow.objects.create(user=self.new_user1, follower=self.new_user2)
+
+    def test_reconcile_counters_command(self):
+        """Test reconcile_counters repairs counters that drifted from the real counts"""
+        Tweet.objects.filter(pk=self.tweet.pk).update(reply_count=5)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.tweet.refresh_from_db()
+        self.new_user1.refresh_from_db()
+        self.new_user2.refresh_from_db()
+        self.assertEqual((self.tweet.like_count, self.tweet.reply_count), (1, 1))
+        self.assertEqual((self.new_user1.tweet_count, self.new_user1.followers_count), (1, 1))
+        self.assertEqual((self.new_user2.tweet_count, self.new_user2.following_count), (0, 1))
+
+    def test_reconcile_counters_dry_run(self):
+        """Test a dry run reports the drift without changing anything"""
+        output = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=output)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
+        self.assertIn('core.Tweet.like_count: 1 rows drifted', output.getvalue())
+
+    def test_reconcile_counters_counts_the_shards(self):
+        """Test like counts split between the column and shards written after the fold are not drifted"""
+        LikeCounterShard.objects.create(tweet=self.tweet, shard=0, count=1)
+        output = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=output)
+        self.assertIn('core.Tweet.like_count: 0 rows drifted', output.getvalue())
+        Tweet.objects.filter(pk=self.tweet.pk).update(like_count=3)
+        # A like written to a shard between the fold and the reconcile
+        with mock.patch('core.management.commands.reconcile_counters.fold_like_shards'):
+            call_command('reconcile_counters', stdout=StringIO())
+        self.tweet.refresh_from_db()
+        self.assertEqual(like_counts([self.tweet]), {self.tweet.id: 1})
+
+
+class TestShardedLikeCounter(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.new_user = get_user_model().objects.create_user(email='test@gmail.com', username='test_username',
+                                                             firstname='test_firstname', lastname='test_lastname', password='test_password')
+        self.tweet = Tweet.objects.create(content='some test', user=self.new_user)
+
+    @override_settings(LIKE_COUNTER_MODE='sharded', LIKE_COUNTER_SHARDS=4)
+    def test_likes_spread_over_shards(self):
+        """Test likes land on the shards and reads add them to the like_count column"""
+        for i in range(20):
+            add_like(self.tweet.id, 1)
+        add_like(self.tweet.id, -1)
+        self.assertLessEqual(LikeCounterShard.objects.filter(tweet=self.tweet).count(), 4)
+        self.assertEqual(like_counts([self.tweet]), {self.tweet.id: 19})
+
+    @override_settings(LIKE_COUNTER_MODE='sharded')
+    def test_fold_like_counters_command(self):
+        """Test folding moves the shard totals into the like_count column"""
+        add_like(self.tweet.id, 1)
+        add_like(self.tweet.id, 1)
+        call_command('fold_like_counters', stdout=StringIO())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 2)
+        self.assertFalse(LikeCounterShard.objects.exists())
+        self.assertEqual(self.tweet.get_likes, 2)
+
+    @override_settings(LIKE_COUNTER_MODE='buffered')
+    def test_buffered_likes_are_written_on_flush(self):
+        """Test buffered likes only reach the database when the buffer is flushed"""
+        with self.captureOnCommitCallbacks(execute=True):
+            add_like(self.tweet.id, 1)
+            add_like(self.tweet.id, 1)
+        self.assertFalse(LikeCounterShard.objects.exists())
+        like_counter_buffer.flush()
+        self.assertEqual(LikeCounterShard.objects.get(tweet=self.tweet).count, 2)
+
+    def test_failed_flush_keeps_the_likes(self):
+        """Test likes whose shard write fails are written by the next flush, the others right away"""
+        other = Tweet.objects.create(content='other test', user=self.new_user)
+        like_counter_buffer.pending.update({self.tweet.id: 2, other.id: 1})
+        add_to_like_shard = counters.add_to_like_shard
+
+        def failing_once(tweet_id, delta):
+            if tweet_id == self.tweet.id:
+                raise DatabaseError('shard write failed')
+            return add_to_like_shard(tweet_id, delta)
+
+        with mock.patch('core.counters.add_to_like_shard', failing_once), \
+                self.assertLogs('core.counters', 'ERROR'):
+            like_counter_buffer.flush()
+        self.assertFalse(LikeCounterShard.objects.filter(tweet=self.tweet).exists())
+        self.assertEqual(LikeCounterShard.objects.get(tweet=other).count, 1)
+        like_counter_buffer.flush()
+        self.assertEqual(LikeCounterShard.objects.get(tweet=self.tweet).count, 2)
+
+    @override_settings(LIKE_COUNTER_MODE='row')
+    def test_row_mode_updates_the_column(self):
+        """Test the row mode adds likes to the like_count column"""
+        add_like(self.tweet.id, 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+
+
+@override_settings(TWEET_SEARCH_BACKEND='index')
+class TestTweetSearch(TestCase):
+    def setUp(self):
+        self.new_user = get_user_model().objects.create_user(email='test@gmail.com', username='test_username',
+                                                             firstname='test_firstname', lastname='test_lastname', password='test_password')
+
+    def test_tokenize(self):
+        """Test tokenize returns every distinct word once, lowercased"""
+        self.assertEqual(tokenize('Hello, hello WORLD! #django_4'), ['hello', 'world', 'django_4'])
+
+    def test_tokens_follow_the_content(self):
+        """Test saving a tweet replaces its indexed tokens"""
+        tweet = Tweet.objects.create(content='first words', user=self.new_user)
+        tweet.content = 'second words'
+        tweet.save()
+        self.assertEqual(set(tweet.search_tokens.values_list('token', flat=True)), {'second', 'words'})
+
+    def test_rank_and_prefix(self):
+        """Test tweets matching more words rank higher and the last word matches as a prefix"""
+        both = Tweet.objects.create(content='django rest framework', user=self.new_user)
+        one = Tweet.objects.create(content='django only', user=self.new_user)
+        Tweet.objects.create(content='unrelated', user=self.new_user)
+        results = list(search_tweets(Tweet.objects.all(), 'django fram').order_by('-rank', '-id'))
+        self.assertEqual([(tweet, tweet.rank) for tweet in results], [(both, 2), (one, 1)])
+
+    def test_rebuild_search_index_command(self):
+        """Test rebuild_search_index recreates a lost index"""
+        tweet = Tweet.objects.create(content='some test', user=self.new_user)
+        TweetSearchToken.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(list(search_tweets(Tweet.objects.all(), 'test')), [tweet])
+
+
+class TestTrending(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.new_user1 = get_user_model().objects.create_user(email='test@gmail.com', username='test_username',
+                                                              firstname='test_firstname', lastname='test_lastname', password='test_password')
+        self.new_user2 = get_user_model().objects.create_user(email='test2@gmail.com', username='test_username2',
+                                                              firstname='test_firstname2', lastname='test_lastname2', password='test_password2')
+
+    def create_tweet(self, hours_ago):
+        tweet = Tweet.objects.create(content='some test', user=self.new_user1)
+        Tweet.objects.filter(pk=tweet.pk).update(date_created=timezone.now() - datetime.timedelta(hours=hours_ago))
+        return tweet
+
+    def test_engagement_outranks_recency(self):
+        """Test an engaged tweet beats newer quiet ones and old tweets are left out"""
+        engaged = self.create_tweet(hours_ago=5)
+        Like.objects.create(user=self.new_user2, tweet=engaged)
+        Reply.objects.create(text='some test', user=self.new_user2, tweet=engaged)
+        SaveTweet.objects.create(user=self.new_user2, tweet=engaged)
+        quiet = self.create_tweet(hours_ago=1)
+        old = self.create_tweet(hours_ago=100)
+        Like.objects.create(user=self.new_user2, tweet=old)
+        compute_trending()
+        self.assertEqual(list(TrendingTweet.objects.order_by('rank').values_list('tweet_id', flat=True)),
+                         [engaged.id, quiet.id])
+
+    def test_stale_ranking_is_recomputed_in_the_background(self):
+        """Test a missing or stale ranking is served as is while a refresh is scheduled"""
+        first = self.create_tweet(hours_ago=1)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(trending_tweets(20), [first])
+        self.assertEqual(len(callbacks), 1)
+        # What the scheduled thread runs
+        refresh_trending()
+        second = self.create_tweet(hours_ago=0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(trending_tweets(20), [first])
+        self.assertEqual(len(callbacks), 0)
+        cache.set(TRENDING_COMPUTED_KEY, timezone.now() - datetime.timedelta(hours=1))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(trending_tweets(20), [first])
+        self.assertEqual(len(callbacks), 1)
+        refresh_trending()
+        self.assertEqual(trending_tweets(20), [second, first])
+
+    def test_failed_refresh_keeps_the_lock(self):
+        """Test a failed refresh leaves the lock to expire instead of rescheduling on the next request"""
+        self.create_tweet(hours_ago=1)
+        with self.captureOnCommitCallbacks() as callbacks:
+            trending_tweets(20)
+        self.assertEqual(len(callbacks), 1)
+        with mock.patch('core.trending.compute_trending', side_effect=DatabaseError), self.assertLogs('core.trending', 'ERROR'):
+            refresh_trending()
+        self.assertTrue(cache.get(TRENDING_LOCK_KEY))
+        with self.captureOnCommitCallbacks() as callbacks:
+            trending_tweets(20)
+        self.assertEqual(len(callbacks), 0)
+
+    def test_empty_window_falls_back_to_the_newest_tweets(self):
+        """Test an empty ranking counts as computed and the newest tweets are shown instead"""
+        older = self.create_tweet(hours_ago=200)
+        newer = self.create_tweet(hours_ago=100)
+        self.assertEqual(compute_trending(), 0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(trending_tweets(20), [newer, older])
+        self.assertEqual(len(callbacks), 0)
+
+    def test_compute_trending_command(self):
+        """Test the compute_trending command fills the table"""
+        tweet = self.create_tweet(hours_ago=1)
+        call_command('compute_trending', stdout=StringIO())
+        self.assertEqual(TrendingTweet.objects.get().tweet, tweet)
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .counters import add_to_counter
+from .models import Tweet, Reply, REPLY_PATH_SEGMENT
+
+
+def ancestor_ids(path):
+    """Ids of the replies above the reply with this path, from the top of the thread down"""
+    return [int(path[start:start + REPLY_PATH_SEGMENT])
+            for start in range(0, len(path) - REPLY_PATH_SEGMENT, REPLY_PATH_SEGMENT)]
+
+
+def thread_parent(parent):
+    """
+    The reply a reply to parent hangs from. Threads are at most REPLY_MAX_DEPTH replies
+    deep, a reply to the deepest one joins its branch instead
+    """
+    while parent is not None and parent.depth >= settings.REPLY_MAX_DEPTH - 1:
+        parent = parent.parent
+    return parent
+
+
+def count_new_reply(reply):
+    """Add a new reply to the reply count of its tweet and of every reply above it"""
+    add_to_counter(Tweet, reply.tweet_id, 'reply_count', 1)
+    ancestors = ancestor_ids(reply.path)
+    if ancestors:
+        Reply.objects.filter(pk__in=ancestors).update(reply_count=F('reply_count') + 1)
+
+
+def branches(tweet_id, parent_id=None):
+    """The replies to a tweet, or to one of its replies, paged by ('-id', )"""
+    return Reply.objects.filter(tweet_id=tweet_id, parent_id=parent_id)
+
+
+def subtree(reply):
+    """A reply and every reply below it, in depth first order by ('path', )"""
+    return Reply.objects.filter(path__startswith=reply.path)
+
+
+def reconcile_reply_counts(dry_run=False, batch_size=1000):
+    """Set Reply.reply_count back to the size of the thread below every reply where it drifted"""
+    below = Reply._base_manager.filter(path__startswith=OuterRef('path')).exclude(
+        pk=OuterRef('pk')).order_by().values('tweet').annotate(count=Count('pk')).values('count')
+    actual = Coalesce(Subquery(below), 0)
+    drifted = list(Reply._base_manager.annotate(actual=actual).exclude(
+        reply_count=F('actual')).values_list('pk', flat=True))
+    if not dry_run:
+        for start in range(0, len(drifted), batch_size):
+            Reply._base_manager.filter(pk__in=drifted[start:start + batch_size]).update(
+                reply_count=actual)
+    return len(drifted)
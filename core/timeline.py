@@ -0,0 +1,258 @@
+import datetime
+import heapq
+import logging
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q, Subquery
+from users.models import Follow
+from .models import Tweet, Retweet, TimelineEntry
+
+logger = logging.getLogger(__name__)
+
+# Per-process counters used to tune FEED_FANOUT_FOLLOWER_THRESHOLD against real traffic
+feed_stats = Counter()
+_feed_stats_lock = threading.Lock()
+
+
+def record_feed_stats(**values):
+    with _feed_stats_lock:
+        feed_stats.update(values)
+
+
+def get_feed_stats():
+    with _feed_stats_lock:
+        return dict(feed_stats)
+
+
+def is_pulled_account(follower_count):
+    """Tweets of accounts with this many followers are pulled at read time instead of pushed"""
+    return follower_count >= settings.FEED_FANOUT_FOLLOWER_THRESHOLD
+
+
+def pulled_followings(owner_id):
+    """Ids of the followed users whose tweets are merged into the timeline at read time"""
+    return list(Follow.objects.filter(
+        follower_id=owner_id, user__followers_count__gte=settings.FEED_FANOUT_FOLLOWER_THRESHOLD).values_list(
+        'user_id', flat=True))
+
+
+def trim_timeline(owner_id):
+    """Delete everything older than the newest TIMELINE_DEPTH entries of a timeline"""
+    depth = settings.TIMELINE_DEPTH
+    first_dropped = TimelineEntry.objects.filter(owner_id=owner_id).order_by(
+        '-created', '-tweet_id').values_list('created', 'tweet_id')[depth:depth + 1]
+    for created, tweet_id in first_dropped:
+        TimelineEntry.objects.filter(owner_id=owner_id).filter(
+            Q(created__lt=created) | Q(created=created, tweet_id__lte=tweet_id)).delete()
+
+
+def trim_follower_timelines(user_id):
+    """
+    trim_timeline for every follower of a user in one delete, so pushing a tweet
+    costs the same number of queries however many followers its author has
+    """
+    followers, params = Follow.objects.filter(user_id=user_id).values('follower_id').query.sql_with_params()
+    table = connection.ops.quote_name(TimelineEntry._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN ('
+            f'SELECT id FROM (SELECT id, ROW_NUMBER() OVER ('
+            f'PARTITION BY owner_id ORDER BY created DESC, tweet_id DESC) AS position '
+            f'FROM {table} WHERE owner_id IN ({followers})) ranked WHERE position > %s)',
+            [*params, settings.TIMELINE_DEPTH])
+
+
+def fan_out_tweet(tweet):
+    """Push a new tweet into the timeline of every follower of its author"""
+    follower_count = tweet.user.followers_count
+    if is_pulled_account(follower_count):
+        # Followers merge this tweet into their home page when they read it
+        record_feed_stats(fan_out_skipped=1)
+        logger.info('Skipped fan-out of tweet %s: %s followers, threshold %s',
+                    tweet.id, follower_count, settings.FEED_FANOUT_FOLLOWER_THRESHOLD)
+        return
+
+    started = time.perf_counter()
+    follower_ids = list(Follow.objects.filter(
+        user_id=tweet.user_id).values_list('follower_id', flat=True))
+    with transaction.atomic():
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=follower_id, tweet=tweet, created=tweet.date_created)
+             for follower_id in follower_ids],
+            batch_size=1000, ignore_conflicts=True)
+        trim_follower_timelines(tweet.user_id)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    record_feed_stats(fan_out_pushed=1, fan_out_writes=len(follower_ids))
+    logger.info('Fanned out tweet %s to %s followers in %.1fms, threshold %s',
+                tweet.id, len(follower_ids), elapsed_ms, settings.FEED_FANOUT_FOLLOWER_THRESHOLD)
+
+
+def fan_out_retweet(retweet):
+    """
+    Push a reference to a retweeted tweet into the timeline of every follower of the
+    retweeter. A timeline that got the tweet less than RETWEET_DEDUPE_WINDOW seconds
+    ago keeps it where it is, an older entry moves back to the top
+    """
+    follower_count = retweet.user.followers_count
+    if is_pulled_account(follower_count):
+        record_feed_stats(retweet_fan_out_skipped=1)
+        return
+
+    started = time.perf_counter()
+    followers = Follow.objects.filter(user_id=retweet.user_id).values('follower_id')
+    window_start = retweet.date_created - datetime.timedelta(seconds=settings.RETWEET_DEDUPE_WINDOW)
+    follower_ids = list(followers.values_list('follower_id', flat=True))
+    with transaction.atomic():
+        resurfaced = TimelineEntry.objects.filter(
+            tweet_id=retweet.tweet_id, owner__in=followers, created__lt=window_start).update(
+            created=retweet.date_created, retweeted_by_id=retweet.user_id)
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=follower_id, tweet_id=retweet.tweet_id, created=retweet.date_created,
+                           retweeted_by_id=retweet.user_id)
+             for follower_id in follower_ids],
+            batch_size=1000, ignore_conflicts=True)
+        trim_follower_timelines(retweet.user_id)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    record_feed_stats(retweet_fan_out_pushed=1, fan_out_writes=len(follower_ids))
+    logger.info('Fanned out retweet of tweet %s by user %s to %s followers (%s resurfaced) in %.1fms',
+                retweet.tweet_id, retweet.user_id, len(follower_ids), resurfaced, elapsed_ms)
+
+
+def retract_retweet(retweet):
+    """Take an undone retweet out of the timelines it was pushed into"""
+    entries = TimelineEntry.objects.filter(tweet_id=retweet.tweet_id, retweeted_by_id=retweet.user_id)
+    # Followers of the author keep the tweet, where it was first pushed
+    entries.filter(owner__in=Follow.objects.filter(user_id=retweet.tweet.user_id).values('follower_id')).update(
+        created=retweet.tweet.date_created, retweeted_by=None)
+    # Followers of another user who retweeted it keep it as that user's latest retweet
+    other_retweets = Retweet.objects.filter(
+        tweet_id=retweet.tweet_id, user__followers__follower_id=OuterRef('owner_id')).exclude(
+        user_id=retweet.user_id).order_by('-date_created', '-id')
+    entries.filter(Exists(other_retweets)).update(
+        retweeted_by_id=Subquery(other_retweets.values('user_id')[:1]),
+        created=Subquery(other_retweets.values('date_created')[:1]))
+    entries.delete()
+
+
+def followed_positions(user_ids, limit, before=None):
+    """
+    The newest (created, tweet id, retweeted by) positions of the tweets and retweets of
+    user_ids, each list ordered newest first
+    """
+    tweets = Tweet.objects.filter(user_id__in=user_ids)
+    retweets = Retweet.objects.filter(user_id__in=user_ids)
+    if before:
+        created, tweet_id = before
+        tweets = tweets.filter(Q(date_created__lt=created) | Q(date_created=created, id__lt=tweet_id))
+        retweets = retweets.filter(Q(date_created__lt=created) | Q(date_created=created, tweet_id__lt=tweet_id))
+    tweets = [(created, tweet_id, None) for created, tweet_id in tweets.order_by(
+        '-date_created', '-id').values_list('date_created', 'id')[:limit]]
+    retweets = list(retweets.order_by('-date_created', '-tweet_id').values_list(
+        'date_created', 'tweet_id', 'user_id')[:limit])
+    return tweets, retweets
+
+
+def merge_positions(*sources, limit):
+    """Merge lists of positions ordered newest first, keeping the newest position of every tweet"""
+    positions = []
+    seen = set()
+    for position in heapq.merge(*sources, key=lambda position: position[:2], reverse=True):
+        # A tweet retweeted by several followed users, or pushed and pulled, shows up once
+        if position[1] in seen:
+            continue
+        seen.add(position[1])
+        positions.append(position)
+        if len(positions) == limit:
+            break
+    return positions
+
+
+def backfill_timeline(owner_id, followed_id):
+    """Add the latest tweets and retweets of a newly followed user to the follower's timeline"""
+    followed = get_user_model().objects.only('followers_count').get(pk=followed_id)
+    if is_pulled_account(followed.followers_count):
+        return
+    positions = merge_positions(*followed_positions([followed_id], settings.TIMELINE_DEPTH),
+                                limit=settings.TIMELINE_DEPTH)
+    with transaction.atomic():
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=owner_id, tweet_id=tweet_id, created=created, retweeted_by_id=retweeted_by)
+             for created, tweet_id, retweeted_by in positions],
+            batch_size=1000, ignore_conflicts=True)
+        trim_timeline(owner_id)
+
+
+def prune_timeline(owner_id, unfollowed_id):
+    """Remove the tweets and retweets of an unfollowed user from the follower's timeline"""
+    TimelineEntry.objects.filter(owner_id=owner_id).filter(
+        Q(tweet__user_id=unfollowed_id, retweeted_by=None) | Q(retweeted_by_id=unfollowed_id)).delete()
+
+
+def rebuild_timeline(owner_id):
+    """Recreate a user's whole timeline from the Follow, Tweet and Retweet tables"""
+    pushed_ids = Follow.objects.filter(follower_id=owner_id).exclude(
+        user__followers_count__gte=settings.FEED_FANOUT_FOLLOWER_THRESHOLD).values('user_id')
+    positions = merge_positions(*followed_positions(pushed_ids, settings.TIMELINE_DEPTH),
+                                limit=settings.TIMELINE_DEPTH)
+    with transaction.atomic():
+        TimelineEntry.objects.filter(owner_id=owner_id).delete()
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=owner_id, tweet_id=tweet_id, created=created, retweeted_by_id=retweeted_by)
+             for created, tweet_id, retweeted_by in positions],
+            batch_size=1000)
+
+
+def rebuild_all_timelines():
+    owner_ids = get_user_model().objects.values_list('id', flat=True)
+    count = 0
+    for owner_id in owner_ids.iterator():
+        rebuild_timeline(owner_id)
+        count += 1
+    return count
+
+
+def read_timeline(owner_id, limit=None, before=None):
+    """
+    Return the newest tweets of a user's home page, merging the pushed timeline
+    entries with the tweets pulled from high-follower accounts.
+    before is the (created, tweet id) position the page starts after, the returned
+    tweets carry the time they entered the timeline as timeline_created and the
+    followed user who retweeted them, if any, as timeline_retweeted_by
+    """
+    limit = limit or settings.TIMELINE_DEPTH
+    pushed = TimelineEntry.objects.filter(owner_id=owner_id)
+    if before:
+        created, tweet_id = before
+        pushed = pushed.filter(Q(created__lt=created) | Q(created=created, tweet_id__lt=tweet_id))
+    pushed = list(pushed.order_by('-created', '-tweet_id').values_list(
+        'created', 'tweet_id', 'retweeted_by_id')[:limit])
+
+    pulled_ids = pulled_followings(owner_id)
+    pulled_tweets, pulled_retweets = [], []
+    if pulled_ids:
+        pulled_tweets, pulled_retweets = followed_positions(pulled_ids, limit, before)
+
+    started = time.perf_counter()
+    # A tweet pushed before its author crossed the threshold is pulled as well
+    positions = merge_positions(pushed, pulled_tweets, pulled_retweets, limit=limit)
+    merge_ms = (time.perf_counter() - started) * 1000
+
+    record_feed_stats(reads=1, pulled_accounts=len(pulled_ids), pulled_tweets=len(pulled_tweets),
+                      pulled_retweets=len(pulled_retweets))
+    logger.debug('Read timeline of user %s: %s pulled accounts, merged %s tweets in %.2fms',
+                 owner_id, len(pulled_ids), len(positions), merge_ms)
+
+    tweets = Tweet.objects.for_feed().in_bulk([tweet_id for _, tweet_id, _ in positions])
+    retweeter_ids = {retweeted_by for _, _, retweeted_by in positions if retweeted_by}
+    retweeters = get_user_model().objects.in_bulk(retweeter_ids) if retweeter_ids else {}
+    timeline = []
+    for created, tweet_id, retweeted_by in positions:
+        if tweet_id in tweets:
+            tweets[tweet_id].timeline_created = created
+            tweets[tweet_id].timeline_retweeted_by = retweeters.get(retweeted_by)
+            timeline.append(tweets[tweet_id])
+    return timeline
@@ -0,0 +1,104 @@
+import datetime
+import heapq
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+from .models import Tweet, Like, Reply, SaveTweet, TrendingTweet
+
+logger = logging.getLogger(__name__)
+
+TRENDING_LOCK_KEY = 'trending:computing'
+# When the ranking was last computed, kept apart from the rows since an empty ranking has none
+TRENDING_COMPUTED_KEY = 'trending:computed'
+
+
+def trending_score(likes, replies, saves, age_hours):
+    """Weighted engagement decayed by the age of the tweet, like the Hacker News ranking"""
+    weights = settings.TRENDING_WEIGHTS
+    engagement = likes * weights['likes'] + replies * weights['replies'] + saves * weights['saves']
+    return (engagement + 1) / (age_hours + 2) ** settings.TRENDING_GRAVITY
+
+
+def count_engagement(model, since):
+    """Number of rows of model per tweet posted after since, tweets without any are left out"""
+    return dict(model.objects.filter(tweet__date_created__gte=since).values(
+        'tweet_id').annotate(count=Count('id')).values_list('tweet_id', 'count'))
+
+
+def compute_trending(now=None):
+    """Score the tweets of the last TRENDING_WINDOW hours and replace the TrendingTweet table"""
+    started = time.perf_counter()
+    now = now or timezone.now()
+    since = now - datetime.timedelta(hours=settings.TRENDING_WINDOW)
+    likes = count_engagement(Like, since)
+    replies = count_engagement(Reply, since)
+    saves = count_engagement(SaveTweet, since)
+
+    # Tweets nobody engaged with score by age alone, so only the newest can make the list
+    candidates = dict(Tweet.objects.filter(date_created__gte=since).order_by(
+        '-date_created').values_list('id', 'date_created')[:settings.TRENDING_SIZE])
+    engaged = list(set(likes) | set(replies) | set(saves))
+    for start in range(0, len(engaged), 1000):
+        candidates.update(Tweet.objects.filter(id__in=engaged[start:start + 1000]).values_list(
+            'id', 'date_created'))
+
+    scores = {}
+    for tweet_id, date_created in candidates.items():
+        age_hours = (now - date_created).total_seconds() / 3600
+        scores[tweet_id] = trending_score(
+            likes.get(tweet_id, 0), replies.get(tweet_id, 0), saves.get(tweet_id, 0), age_hours)
+    best = heapq.nlargest(settings.TRENDING_SIZE, scores, key=lambda tweet_id: (scores[tweet_id], tweet_id))
+
+    with transaction.atomic():
+        TrendingTweet.objects.all().delete()
+        TrendingTweet.objects.bulk_create(
+            [TrendingTweet(tweet_id=tweet_id, rank=rank, score=scores[tweet_id], computed=now)
+             for rank, tweet_id in enumerate(best, 1)],
+            batch_size=1000)
+    cache.set(TRENDING_COMPUTED_KEY, now, None)
+    logger.info('Ranked %s trending tweets out of %s candidates in %.1fms',
+                len(best), len(candidates), (time.perf_counter() - started) * 1000)
+    return len(best)
+
+
+def refresh_trending():
+    # A thread of its own, like the media workers
+    close_old_connections()
+    try:
+        compute_trending()
+    except Exception:
+        # The lock expires after TRENDING_MAX_AGE seconds, so a failing ranking isn't retried by every request
+        logger.exception('Ranking the trending tweets failed')
+    else:
+        cache.delete(TRENDING_LOCK_KEY)
+    finally:
+        close_old_connections()
+
+
+def schedule_trending_refresh():
+    """Recompute the ranking in a background thread once the request commits, one process at a time"""
+    if not cache.add(TRENDING_LOCK_KEY, True, settings.TRENDING_MAX_AGE):
+        return
+    transaction.on_commit(lambda: threading.Thread(
+        target=refresh_trending, name='trending', daemon=True).start())
+
+
+def trending_tweets(limit):
+    """
+    The limit best ranked tweets. A ranking missing or older than TRENDING_MAX_AGE
+    seconds is recomputed in the background while the current one is served, and
+    the newest tweets stand in while nothing is ranked
+    """
+    computed = cache.get(TRENDING_COMPUTED_KEY)
+    if computed is None or (timezone.now() - computed).total_seconds() >= settings.TRENDING_MAX_AGE:
+        schedule_trending_refresh()
+    tweets = list(Tweet.objects.for_feed().filter(trending__rank__lte=limit).order_by('trending__rank'))
+    if tweets:
+        return tweets
+    # Not ranked yet, or no tweet in the last TRENDING_WINDOW hours
+    return list(Tweet.objects.for_feed().order_by('-date_created', '-id')[:limit])
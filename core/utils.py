@@ -0,0 +1,14 @@
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_related(model, related_name):
+    """
+    Count the rows of a reverse relation as a correlated subquery, so several counts
+    can be annotated on the same queryset without multiplying each other's joins
+    """
+    relation = model._meta.get_field(related_name)
+    field_name = relation.field.name
+    rows = relation.related_model._base_manager.filter(**{field_name: OuterRef('pk')})
+    return Coalesce(Subquery(rows.order_by().values(field_name).annotate(
+        count=Count('pk')).values('count')), 0)
@@ -0,0 +1,253 @@
+import logging
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from .models import Follow
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'FOLLOWGRAPH1'
+# Bumped in the shared cache by every committed follow and unfollow, a graph built at
+# another version misses the follows of another process
+VERSION_KEY = 'follow-graph:version'
+# Native byte order like array.tofile, snapshots are read on the machine that wrote them
+_header = struct.Struct('=dq')  # snapshot time, number of users
+_row = struct.Struct('=qq')  # user id, number of ids
+
+
+def intersect(first, second):
+    """Ids in both sorted arrays, walking them once"""
+    result = array('q')
+    i = j = 0
+    while i < len(first) and j < len(second):
+        if first[i] == second[j]:
+            result.append(first[i])
+            i += 1
+            j += 1
+        elif first[i] < second[j]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def apply_edge(followers, followings, follows, user_id, follower_id):
+    """Add (follows) or remove a follow in the two directions of a graph"""
+    if follows:
+        insert_sorted(followers.setdefault(user_id, array('q')), follower_id)
+        insert_sorted(followings.setdefault(follower_id, array('q')), user_id)
+    else:
+        remove_sorted(followers.get(user_id, array('q')), follower_id)
+        remove_sorted(followings.get(follower_id, array('q')), user_id)
+
+
+def insert_sorted(ids, value):
+    position = bisect_left(ids, value)
+    if position == len(ids) or ids[position] != value:
+        ids.insert(position, value)
+
+
+def remove_sorted(ids, value):
+    position = bisect_left(ids, value)
+    if position < len(ids) and ids[position] == value:
+        del ids[position]
+
+
+class FollowGraph:
+    """
+    The follow graph held in memory as one sorted array of 64-bit ids per user and
+    direction, so follow checks, counts and intersections don't query users_follow.
+    Kept current by the signals in users.signals, rebuilt from the database every
+    FOLLOW_GRAPH_MAX_AGE seconds or as soon as is_current sees the follows of another
+    process, and loaded from the FOLLOW_GRAPH_SNAPSHOT file written by dump_follow_graph
+    when it is fresh enough, which is much faster than reading the table
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.followers = {}
+        self.followings = {}
+        self.built_at = None
+        # The VERSION_KEY the graph has every follow of, None when unknown
+        self.version = None
+        self.rebuilding = False
+        # Follows and unfollows applied while a build reads the table, None when not building
+        self.replay = None
+
+    def build(self):
+        with self.lock:
+            self.replay = []
+        version = cache.get(VERSION_KEY, 0)
+        followers = {}
+        followings = {}
+        try:
+            edges = Follow.objects.order_by('user_id', 'follower_id').values_list('user_id', 'follower_id')
+            # Both directions come out sorted from this ordering
+            for user_id, follower_id in edges.iterator():
+                followers.setdefault(user_id, array('q')).append(follower_id)
+                followings.setdefault(follower_id, array('q')).append(user_id)
+        except Exception:
+            with self.lock:
+                self.replay = None
+            raise
+        with self.lock:
+            # The table may or may not have had them when it was read, both are applied again
+            for follows, user_id, follower_id in self.replay:
+                apply_edge(followers, followings, follows, user_id, follower_id)
+            self.followers, self.followings = followers, followings
+            self.replay = None
+            self.built_at = time.time()
+            self.version = version
+
+    def ensure_loaded(self):
+        """
+        Only the first load waits for the database, a stale graph keeps answering
+        while a background thread rebuilds it
+        """
+        with self.lock:
+            if self.built_at is not None:
+                if time.time() - self.built_at >= settings.FOLLOW_GRAPH_MAX_AGE:
+                    self.start_rebuild()
+                return
+            path = settings.FOLLOW_GRAPH_SNAPSHOT
+            if self.built_at is None and path and os.path.exists(path):
+                try:
+                    self.load(path)
+                except (OSError, ValueError, struct.error, EOFError) as error:
+                    logger.warning('Could not load the follow graph snapshot %s: %s', path, error)
+                else:
+                    if time.time() - self.built_at < settings.FOLLOW_GRAPH_MAX_AGE:
+                        return
+            self.build()
+
+    def is_current(self):
+        """
+        Whether the graph has the follows committed by every process, so a check can
+        trust it. When it doesn't, a rebuild starts once the request commits
+        """
+        self.ensure_loaded()
+        with self.lock:
+            if self.built_at is not None and self.version is not None:
+                if cache.get(VERSION_KEY, 0) == self.version:
+                    return True
+        transaction.on_commit(self.start_rebuild)
+        return False
+
+    def start_rebuild(self):
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+        threading.Thread(target=self.rebuild_in_background, name='follow-graph', daemon=True).start()
+
+    def rebuild_in_background(self):
+        close_old_connections()
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Rebuilding the follow graph failed')
+        finally:
+            self.rebuilding = False
+            close_old_connections()
+
+    def add(self, user_id, follower_id):
+        self.apply(True, user_id, follower_id)
+
+    def remove(self, user_id, follower_id):
+        self.apply(False, user_id, follower_id)
+
+    def apply(self, follows, user_id, follower_id):
+        with self.lock:
+            if self.replay is not None:
+                self.replay.append((follows, user_id, follower_id))
+            if self.built_at is not None:
+                apply_edge(self.followers, self.followings, follows, user_id, follower_id)
+
+    def committed(self):
+        """
+        Bump the shared version once a follow or unfollow this graph applied is committed.
+        The graph stays current when no other process changed the follows in between
+        """
+        if cache.add(VERSION_KEY, 1, None):
+            version = 1
+        else:
+            try:
+                version = cache.incr(VERSION_KEY)
+            except ValueError:
+                # Evicted since the add
+                cache.set(VERSION_KEY, 1, None)
+                version = 1
+        with self.lock:
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+
+    def get_followers(self, user_id):
+        self.ensure_loaded()
+        return self.followers.get(user_id, array('q'))
+
+    def get_followings(self, user_id):
+        self.ensure_loaded()
+        return self.followings.get(user_id, array('q'))
+
+    def is_following(self, follower_id, user_id):
+        followings = self.get_followings(follower_id)
+        position = bisect_left(followings, user_id)
+        return position < len(followings) and followings[position] == user_id
+
+    def follower_count(self, user_id):
+        return len(self.get_followers(user_id))
+
+    def following_count(self, user_id):
+        return len(self.get_followings(user_id))
+
+    def mutual_follows(self, user_id):
+        """Users who follow user_id and are followed back"""
+        return intersect(self.get_followers(user_id), self.get_followings(user_id))
+
+    def common_followings(self, first_id, second_id):
+        return intersect(self.get_followings(first_id), self.get_followings(second_id))
+
+    def dump(self, path):
+        """Write the graph to path atomically, so a worker never loads half a snapshot"""
+        self.ensure_loaded()
+        with self.lock:
+            sections = [self.followers, self.followings]
+            built_at = self.built_at
+            temporary = f'{path}.tmp'
+            with open(temporary, 'wb') as snapshot:
+                snapshot.write(SNAPSHOT_MAGIC)
+                for section in sections:
+                    snapshot.write(_header.pack(built_at, len(section)))
+                    for user_id, ids in section.items():
+                        snapshot.write(_row.pack(user_id, len(ids)))
+                        ids.tofile(snapshot)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        with open(path, 'rb') as snapshot:
+            if snapshot.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError('not a follow graph snapshot')
+            sections = []
+            for i in range(2):
+                built_at, user_count = _header.unpack(snapshot.read(_header.size))
+                section = {}
+                for j in range(user_count):
+                    user_id, length = _row.unpack(snapshot.read(_row.size))
+                    ids = array('q')
+                    ids.fromfile(snapshot, length)
+                    section[user_id] = ids
+                sections.append(section)
+        with self.lock:
+            self.followers, self.followings = sections
+            self.built_at = built_at
+            # Not known which follows the snapshot has, checks wait for a rebuild
+            self.version = None
+
+
+follow_graph = FollowGraph()
@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from users.recommendations import compute_suggestions, compute_all_suggestions
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed follow suggestions, run it nightly from cron'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help='Only recompute the suggestions of these users')
+
+    def handle(self, *args, **options):
+        usernames = options['usernames']
+        if not usernames:
+            count = compute_all_suggestions()
+            self.stdout.write(self.style.SUCCESS(f'Computed the suggestions of {count} users'))
+            return
+
+        for username in usernames:
+            try:
+                user = get_user_model().objects.get(username=username)
+            except get_user_model().DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+            compute_suggestions(user.id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Computed the suggestions of {len(usernames)} users'))
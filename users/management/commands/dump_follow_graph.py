@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from users.graph import follow_graph
+
+
+class Command(BaseCommand):
+    help = 'Write a snapshot of the follow graph that workers load at startup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=settings.FOLLOW_GRAPH_SNAPSHOT,
+                            help='Defaults to FOLLOW_GRAPH_SNAPSHOT')
+
+    def handle(self, *args, **options):
+        if not options['path']:
+            raise CommandError('Give a path or set FOLLOW_GRAPH_SNAPSHOT')
+        follow_graph.build()
+        follow_graph.dump(options['path'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote the follows of {len(follow_graph.followings)} users to {options["path"]}'))
@@ -0,0 +1,116 @@
+import io
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.MEDIA_WORKERS, thread_name_prefix='media')
+        return _executor
+
+
+def upload_storage():
+    """Where uploaded pictures wait for processing, always on the local disk"""
+    return FileSystemStorage(location=settings.MEDIA_UPLOAD_DIR)
+
+
+def render_variant(image, size):
+    """The picture cropped to fill size (width, height) as a progressive JPEG"""
+    variant = ImageOps.fit(image, size, Image.LANCZOS)
+    output = io.BytesIO()
+    variant.save(output, 'JPEG', quality=settings.PICTURE_QUALITY, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def delete_files(names):
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except Exception:
+            logger.exception('Could not delete the old picture %s', name)
+
+
+def process_picture(user_id, field, upload_name):
+    """
+    Resize the upload_name upload into every PICTURE_VARIANTS size of field, push them
+    to the file storage and point the user's picture at them. The sizes of the
+    picture they replace are deleted once the new ones are committed
+    """
+    uploads = upload_storage()
+    try:
+        with uploads.open(upload_name) as upload:
+            image = Image.open(upload)
+            image = ImageOps.exif_transpose(image).convert('RGB')
+        prefix = f'profile_pictures/{user_id}/{field}-{uuid.uuid4().hex[:12]}'
+        variants = {}
+        for size_name, size in settings.PICTURE_VARIANTS[field].items():
+            variants[size_name] = default_storage.save(
+                f'{prefix}-{size_name}.jpg', ContentFile(render_variant(image, size)))
+
+        with transaction.atomic():
+            # Locked so two uploads of the same picture each delete what the other replaced
+            user = get_user_model().objects.select_for_update().filter(pk=user_id).first()
+            if user is None:
+                delete_files(variants.values())
+                return variants
+            replaced = set((getattr(user, f'{field}_variants') or {}).values()) - set(variants.values())
+            # The largest size stands in for the picture where no size is asked for
+            setattr(user, field, variants[max(
+                variants, key=lambda name: settings.PICTURE_VARIANTS[field][name][0])])
+            setattr(user, f'{field}_variants', variants)
+            user.save(update_fields=[field, f'{field}_variants'])
+            transaction.on_commit(lambda: delete_files(replaced))
+        return variants
+    except Exception:
+        logger.exception('Processing %s %s of user %s failed', field, upload_name, user_id)
+        raise
+    finally:
+        uploads.delete(upload_name)
+
+
+def run_job(user_id, field, upload_name):
+    # Pool threads outlive requests, like the database threads of the async views
+    close_old_connections()
+    try:
+        process_picture(user_id, field, upload_name)
+    finally:
+        close_old_connections()
+
+
+def queue_picture(user, field, uploaded_file):
+    """
+    Keep an uploaded picture on the local disk and process it in the MEDIA_WORKERS
+    pool once the request commits. With MEDIA_WORKERS = 0 it is processed right away
+    """
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    upload_name = upload_storage().save(f'{user.id}-{field}-{uuid.uuid4().hex}{extension}', uploaded_file)
+    if not settings.MEDIA_WORKERS:
+        process_picture(user.id, field, upload_name)
+        return
+    transaction.on_commit(lambda: get_executor().submit(run_job, user.id, field, upload_name))
+
+
+def picture_url(user, field, size=None):
+    """Storage URL of one size of a picture, of the original when the picture has no such size"""
+    variants = getattr(user, f'{field}_variants') or {}
+    if size in variants:
+        return default_storage.url(variants[size])
+    picture = getattr(user, field)
+    return picture.url if picture else None
@@ -0,0 +1,17 @@
+# Generated by Django 4.0 on 2026-10-18 06:13
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_customuser_background_picture'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='customuser',
+            options={'verbose_name': 'User', 'verbose_name_plural': 'Users'},
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0 on 2026-10-18 06:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_customuser_followers_count_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuggestedUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('mutual_count', models.PositiveIntegerField(default=0)),
+                ('suggested', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='suggested_to', to='users.customuser')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='suggestions', to='users.customuser')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='suggesteduser',
+            index=models.Index(fields=['user', 'rank'], name='suggestion_user_rank_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='suggesteduser',
+            constraint=models.UniqueConstraint(fields=('user', 'suggested'), name='A user is suggested once to each user'),
+        ),
+    ]
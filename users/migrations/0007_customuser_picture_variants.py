@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_suggesteduser'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='background_picture_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='picture_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -43,8 +43,17 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     picture = models.ImageField(
         blank=True, default='profile_pictures/default_profile.png')
     background_picture = models.ImageField(blank=True, default='profile_pictures/default_background_picture.png')
+    # Storage names of the resized copies of the pictures by size, see users.media
+    picture_variants = models.JSONField(blank=True, default=dict)
+    background_picture_variants = models.JSONField(blank=True, default=dict)
     is_active = models.BooleanField(default=False)
     is_staff = models.BooleanField(default=False)
+    # Kept up to date by the views, reconcile_counters repairs any drift
+    tweet_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # Notifications not read yet, kept up to date by core.notifications
+    unread_notifications = models.PositiveIntegerField(default=0)
 
     objects = CustomAccountManager()
     USERNAME_FIELD = 'email'
@@ -74,3 +83,27 @@ class Follow(models.Model):
 
     def __str__(self):
         return f'User {self.follower.username} followed {self.user.username}'
+
+
+class SuggestedUser(models.Model):
+    """A precomputed follow suggestion, see users.recommendations"""
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='suggestions')
+    suggested = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='suggested_to')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    # Followed users who follow the suggested user
+    mutual_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'suggested'], name='A user is suggested once to each user'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'rank'], name='suggestion_user_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f'user {self.suggested_id} suggested to {self.user_id} at #{self.rank}'
@@ -0,0 +1,99 @@
+import heapq
+import math
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from .graph import follow_graph
+from .models import SuggestedUser
+
+# Set for a user who followed or unfollowed someone since their suggestions were computed
+SUGGESTIONS_STALE_KEY = 'suggestions:stale:{}'
+
+
+def suggestion_score(mutual_count, follows_you, followers_count):
+    """Friends of friends first, then the users following you back, then popular users"""
+    weights = settings.SUGGESTION_WEIGHTS
+    return (mutual_count * weights['mutual'] + follows_you * weights['follows_you']
+            + math.log1p(followers_count) * weights['popularity'])
+
+
+def compute_suggestions(user_id):
+    """Score the users a user could follow and replace their SuggestedUser rows"""
+    user_model = get_user_model()
+    size = settings.SUGGESTIONS_PER_USER
+    followings = follow_graph.get_followings(user_id)
+    excluded = {user_id, *followings}
+
+    # Users followed by the users this user follows, with how many of them follow each
+    mutual = Counter()
+    for following_id in followings:
+        mutual.update(follow_graph.get_followings(following_id))
+    follows_you = set(follow_graph.get_followers(user_id))
+    candidates = [candidate for candidate in set(mutual) | follows_you if candidate not in excluded]
+
+    followers_counts = {}
+    for start in range(0, len(candidates), 1000):
+        followers_counts.update(user_model.objects.filter(
+            id__in=candidates[start:start + 1000], is_active=True).values_list('id', 'followers_count'))
+    # Popular users fill the list of users with a small network
+    followers_counts.update(user_model.objects.filter(is_active=True).exclude(id=user_id).exclude(
+        followers__follower_id=user_id).order_by('-followers_count', 'id').values_list(
+        'id', 'followers_count')[:size])
+
+    scores = {
+        candidate: suggestion_score(mutual.get(candidate, 0), candidate in follows_you, followers_count)
+        for candidate, followers_count in followers_counts.items()
+    }
+    best = heapq.nlargest(size, scores, key=lambda candidate: (scores[candidate], -candidate))
+    with transaction.atomic():
+        SuggestedUser.objects.filter(user_id=user_id).delete()
+        SuggestedUser.objects.bulk_create([
+            SuggestedUser(user_id=user_id, suggested_id=candidate, rank=rank,
+                          score=scores[candidate], mutual_count=mutual.get(candidate, 0))
+            for rank, candidate in enumerate(best, 1)])
+    return len(best)
+
+
+def compute_all_suggestions():
+    user_ids = get_user_model().objects.filter(is_active=True).values_list('id', flat=True)
+    count = 0
+    for user_id in user_ids.iterator():
+        compute_suggestions(user_id)
+        count += 1
+    return count
+
+
+def drop_suggestion(user_id, followed_id):
+    """
+    Take a user who was just followed out of the suggestions right away, the scores
+    of the others are recomputed on the next read
+    """
+    SuggestedUser.objects.filter(user_id=user_id, suggested_id=followed_id).delete()
+
+
+def mark_suggestions_stale(user_id):
+    cache.set(SUGGESTIONS_STALE_KEY.format(user_id), True, None)
+
+
+def suggested_users(user_id, limit):
+    """
+    The best limit suggestions of a user, computed on the first request of a new user
+    and again on the first request after they followed or unfollowed someone
+    """
+    def read():
+        # Ranks have gaps where drop_suggestion took a user out
+        return [suggestion.suggested for suggestion in SuggestedUser.objects.filter(
+            user_id=user_id, suggested__is_active=True).select_related(
+            'suggested').order_by('rank')[:limit]]
+
+    key = SUGGESTIONS_STALE_KEY.format(user_id)
+    # A graph missing the follows of another process would compute the same stale list
+    if cache.get(key) and follow_graph.is_current():
+        cache.delete(key)
+        compute_suggestions(user_id)
+    users = read()
+    if not users and compute_suggestions(user_id):
+        users = read()
+    return users
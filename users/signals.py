@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.db import transaction
+from django.dispatch import receiver
+from .models import Follow
+from .graph import follow_graph
+from .recommendations import mark_suggestions_stale
+from .typeahead import typeahead_index
+
+
+@receiver(post_save, sender=get_user_model())
+def index_user(sender, instance, raw=False, **kwargs):
+    if not raw:
+        typeahead_index.update_user(instance)
+
+
+@receiver(post_delete, sender=get_user_model())
+def unindex_user(sender, instance, **kwargs):
+    typeahead_index.remove_user(instance.id)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follower(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        typeahead_index.add_followers(instance.user_id, 1)
+        follow_graph.add(instance.user_id, instance.follower_id)
+        transaction.on_commit(follow_graph.committed)
+        transaction.on_commit(lambda: mark_suggestions_stale(instance.follower_id))
+
+
+@receiver(post_delete, sender=Follow)
+def count_lost_follower(sender, instance, **kwargs):
+    typeahead_index.add_followers(instance.user_id, -1)
+    follow_graph.remove(instance.user_id, instance.follower_id)
+    transaction.on_commit(follow_graph.committed)
+    transaction.on_commit(lambda: mark_suggestions_stale(instance.follower_id))
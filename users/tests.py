@@ -1,7 +1,19 @@
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.db import IntegrityError
-from .models import Follow
+from io import StringIO
+from django.core.management import call_command
+import os
+import tempfile
+from array import array
+from unittest import mock
+from django.test import override_settings
+from django.core.cache import cache
+from . import graph
+from .graph import FollowGraph, follow_graph, intersect
+from .models import Follow, SuggestedUser
+from .recommendations import compute_suggestions, drop_suggestion, suggested_users
+from .typeahead import typeahead_index
 
 
 class TestNewSuperUser(TestCase):
@@ -107,3 +119,189 @@ class TestFollow(TestCase):
         """Test a user can't follow the other user more than once"""
         with self.assertRaises(IntegrityError):
             Follow.objects.create(user=self.new_user1, follower=self.new_user2)        
+
+
+class TestTypeaheadIndex(TestCase):
+    def setUp(self):
+        self.users = [get_user_model().objects.create_user(email=f'test{i}@gmail.com', username=username, firstname=firstname,
+                                                           lastname='test_lastname', password='test_password')
+                      for i, (username, firstname) in enumerate([('ali', 'mohammad'), ('alice', 'alice'), ('bob', 'alireza')])]
+        typeahead_index.build()
+
+    def test_exact_username_then_followers(self):
+        """Test an exact username match comes first, then the most followed prefix matches"""
+        ali, alice, bob = self.users
+        Follow.objects.create(user=bob, follower=alice)
+        self.assertEqual(typeahead_index.search('Ali', 10), [ali.id, alice.id, bob.id])
+        self.assertEqual(typeahead_index.search('ali', 1), [ali.id])
+
+    def test_index_follows_user_changes(self):
+        """Test created, renamed and deleted users are reflected without a rebuild"""
+        ali, alice, bob = self.users
+        carol = get_user_model().objects.create_user(email='carol@gmail.com', username='carol', firstname='c',
+                                                     lastname='test_lastname', password='test_password')
+        bob.username = 'bobby'
+        bob.save()
+        alice.delete()
+        self.assertEqual(typeahead_index.search('car', 10), [carol.id])
+        self.assertEqual(typeahead_index.search('bobb', 10), [bob.id])
+        self.assertEqual(typeahead_index.search('alic', 10), [])
+
+    def test_stale_index_is_rebuilt_in_the_background(self):
+        """Test a stale index keeps answering without queries while a thread rebuilds it"""
+        ali, alice, bob = self.users
+        with override_settings(TYPEAHEAD_INDEX_MAX_AGE=-1), mock.patch('users.typeahead.threading.Thread') as thread:
+            with self.assertNumQueries(0):
+                self.assertEqual(typeahead_index.search('ali', 1), [ali.id])
+                self.assertEqual(typeahead_index.search('ali', 1), [ali.id])
+        thread.assert_called_once_with(target=typeahead_index.rebuild_in_background, name='typeahead-index', daemon=True)
+        typeahead_index.rebuilding = False
+
+    def test_changes_during_a_build_are_replayed(self):
+        """Test a user renamed while the table is read is found under the new name after the build"""
+        ali, alice, bob = self.users
+        rows = list(get_user_model().objects.values_list('id', 'username', 'firstname', 'lastname', 'followers_count'))
+
+        def read_while_renaming():
+            bob.username = 'bobby'
+            bob.save()
+            yield from rows
+
+        with mock.patch('users.typeahead.get_user_model') as user_model:
+            user_model.return_value.objects.values_list.return_value.iterator = read_while_renaming
+            typeahead_index.build()
+        self.assertEqual(typeahead_index.search('bobb', 10), [bob.id])
+        self.assertEqual(typeahead_index.search('bob', 10), [bob.id])
+        self.assertIsNone(typeahead_index.replay)
+
+
+class TestSuggestions(TestCase):
+    def setUp(self):
+        self.users = [get_user_model().objects.create_user(email=f'test{i}@gmail.com', username=f'test_username{i}', firstname='test_firstname',
+                                                           lastname='test_lastname', password='test_password', is_active=True)
+                      for i in range(6)]
+
+    def follow(self, user, follower):
+        Follow.objects.create(user=user, follower=follower)
+        get_user_model().objects.filter(pk=user.pk).update(followers_count=user.followers.count())
+
+    def test_friends_of_friends_ranking(self):
+        """Test users followed by more of your followings rank first, then your followers, then popular users"""
+        me, friend1, friend2, fof, fan, popular = self.users
+        for friend in (friend1, friend2):
+            self.follow(friend, me)
+            self.follow(fof, friend)
+        self.follow(popular, friend1)
+        self.follow(me, fan)
+        compute_suggestions(me.id)
+        self.assertEqual(suggested_users(me.id, 3), [fof, fan, popular])
+        self.assertEqual(SuggestedUser.objects.get(user=me, suggested=fof).mutual_count, 2)
+        drop_suggestion(me.id, fof.id)
+        self.assertEqual(suggested_users(me.id, 3), [fan, popular])
+
+    def test_unfollow_recomputes_the_suggestions(self):
+        """Test the suggestions are recomputed on the first read after an unfollow"""
+        me, friend1, friend2, fof, fan, popular = self.users
+        for friend in (friend1, friend2):
+            self.follow(friend, me)
+            self.follow(fof, friend)
+        compute_suggestions(me.id)
+        self.assertNotIn(friend1, suggested_users(me.id, 5))
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.get(user=friend1, follower=me).delete()
+        self.assertIn(friend1, suggested_users(me.id, 5))
+        self.assertEqual(SuggestedUser.objects.get(user=me, suggested=fof).mutual_count, 1)
+
+    def test_compute_suggestions_command(self):
+        """Test the command precomputes suggestions for every active user"""
+        call_command('compute_suggestions', stdout=StringIO())
+        self.assertEqual(SuggestedUser.objects.filter(user=self.users[0]).count(), 5)
+
+
+class TestFollowGraph(TestCase):
+    def setUp(self):
+        self.users = [get_user_model().objects.create_user(email=f'test{i}@gmail.com', username=f'test_username{i}', firstname='test_firstname',
+                                                           lastname='test_lastname', password='test_password')
+                      for i in range(3)]
+        first, second, third = self.users
+        Follow.objects.create(user=second, follower=first)
+        Follow.objects.create(user=first, follower=second)
+        Follow.objects.create(user=third, follower=first)
+        follow_graph.build()
+
+    def test_queries(self):
+        """Test follow checks, counts and mutual follows"""
+        first, second, third = self.users
+        self.assertTrue(follow_graph.is_following(first.id, second.id))
+        self.assertFalse(follow_graph.is_following(third.id, first.id))
+        self.assertEqual((follow_graph.follower_count(first.id), follow_graph.following_count(first.id)), (1, 2))
+        self.assertEqual(list(follow_graph.mutual_follows(first.id)), [second.id])
+        self.assertEqual(list(intersect(array('q', [1, 3, 5, 7]), array('q', [2, 3, 7, 9]))), [3, 7])
+
+    def test_signals_keep_the_graph_current(self):
+        """Test new and deleted follows are applied without a rebuild"""
+        first, second, third = self.users
+        Follow.objects.create(user=first, follower=third)
+        Follow.objects.get(user=second, follower=first).delete()
+        self.assertTrue(follow_graph.is_following(third.id, first.id))
+        self.assertFalse(follow_graph.is_following(first.id, second.id))
+        self.assertEqual(list(follow_graph.get_followers(first.id)), [second.id, third.id])
+
+    def test_snapshot(self):
+        """Test a fresh snapshot loads into the same graph and a stale one is rebuilt from the database"""
+        first, second, third = self.users
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.snapshot')
+            call_command('dump_follow_graph', path, stdout=StringIO())
+            with override_settings(FOLLOW_GRAPH_SNAPSHOT=path):
+                graph = FollowGraph()
+                graph.ensure_loaded()
+                self.assertEqual(graph.followings, follow_graph.followings)
+                self.assertEqual(graph.followers, follow_graph.followers)
+                Follow.objects.create(user=first, follower=third)
+                with override_settings(FOLLOW_GRAPH_MAX_AGE=0):
+                    graph = FollowGraph()
+                    self.assertTrue(graph.is_following(third.id, first.id))
+
+    def test_follows_of_other_processes_stale_the_graph(self):
+        """Test the graph is current after its own follows and stale after a version bump it didn't apply"""
+        first, second, third = self.users
+        self.assertTrue(follow_graph.is_current())
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(user=first, follower=third)
+        self.assertTrue(follow_graph.is_current())
+        cache.set(graph.VERSION_KEY, cache.get(graph.VERSION_KEY, 0) + 1, None)
+        with mock.patch('users.graph.threading.Thread') as thread, self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(follow_graph.is_current())
+        thread.assert_called_once_with(target=follow_graph.rebuild_in_background, name='follow-graph', daemon=True)
+        follow_graph.rebuilding = False
+
+    def test_follows_during_a_build_are_replayed(self):
+        """Test a follow and an unfollow applied while the table is read end up in the rebuilt graph"""
+        first, second, third = self.users
+        edges = list(Follow.objects.order_by('user_id', 'follower_id').values_list('user_id', 'follower_id'))
+
+        def read_while_following():
+            # Both happen after the table was read, a snapshot of the edges before them
+            follow_graph.add(first.id, third.id)
+            follow_graph.remove(second.id, first.id)
+            yield from edges
+
+        with mock.patch('users.graph.Follow') as follow:
+            follow.objects.order_by.return_value.values_list.return_value.iterator = read_while_following
+            follow_graph.build()
+        self.assertTrue(follow_graph.is_following(third.id, first.id))
+        self.assertFalse(follow_graph.is_following(first.id, second.id))
+        self.assertIsNone(follow_graph.replay)
+
+    def test_stale_graph_is_rebuilt_in_the_background(self):
+        """Test a stale graph keeps answering without queries while a thread rebuilds it"""
+        first, second, third = self.users
+        graph = FollowGraph()
+        graph.build()
+        with override_settings(FOLLOW_GRAPH_MAX_AGE=0), mock.patch('users.graph.threading.Thread') as thread:
+            with self.assertNumQueries(0):
+                self.assertTrue(graph.is_following(first.id, second.id))
+                self.assertTrue(graph.is_following(first.id, third.id))
+        thread.assert_called_once_with(target=graph.rebuild_in_background, name='follow-graph', daemon=True)
+        self.assertTrue(graph.rebuilding)
@@ -0,0 +1,148 @@
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Exact username, username prefix, first or last name prefix
+EXACT_USERNAME, USERNAME_PREFIX, NAME_PREFIX = 3, 2, 1
+
+
+class TypeaheadIndex:
+    """
+    Sorted (prefix key, user id) entries of every username, first name and last name, so
+    the users matching a prefix are one bisect away instead of a scan of the users table.
+    Kept current by the signals in users.signals and rebuilt from the database every
+    TYPEAHEAD_INDEX_MAX_AGE seconds to pick up changes made by other processes. Only
+    the first build blocks, a stale index keeps answering while a thread rebuilds it
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entries = []
+        self.users = {}
+        self.built_at = None
+        self.rebuilding = False
+        # Changes the signals applied while a build reads the table, None when not building
+        self.replay = None
+
+    def build(self):
+        with self.lock:
+            self.replay = []
+        entries = []
+        indexed = {}
+        try:
+            users = get_user_model().objects.values_list(
+                'id', 'username', 'firstname', 'lastname', 'followers_count')
+            for user_id, username, firstname, lastname, followers_count in users.iterator():
+                keys = self.get_keys(username, firstname, lastname)
+                indexed[user_id] = (keys, followers_count)
+                entries += [(key, user_id) for key in keys]
+        except Exception:
+            with self.lock:
+                self.replay = None
+            raise
+        entries.sort()
+        with self.lock:
+            # The table may or may not have had them when it was read, both are applied again
+            for change, *args in self.replay:
+                change(entries, indexed, *args)
+            self.entries, self.users = entries, indexed
+            self.replay = None
+            self.built_at = time.monotonic()
+
+    def ensure_built(self):
+        with self.lock:
+            if self.built_at is None:
+                self.build()
+            elif time.monotonic() - self.built_at > settings.TYPEAHEAD_INDEX_MAX_AGE and not self.rebuilding:
+                self.rebuilding = True
+                threading.Thread(target=self.rebuild_in_background, name='typeahead-index', daemon=True).start()
+
+    def rebuild_in_background(self):
+        close_old_connections()
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Rebuilding the typeahead index failed')
+        finally:
+            self.rebuilding = False
+            close_old_connections()
+
+    def apply(self, change, *args):
+        """Run change on the live index and keep it for the build in progress, if any"""
+        with self.lock:
+            if self.replay is not None:
+                self.replay.append((change, *args))
+            if self.built_at is not None:
+                change(self.entries, self.users, *args)
+
+    @staticmethod
+    def get_keys(username, firstname, lastname):
+        return {'u' + username.lower(), 'n' + firstname.lower(), 'n' + lastname.lower()}
+
+    def update_user(self, user):
+        keys = self.get_keys(user.username, user.firstname, user.lastname)
+        self.apply(index_user, user.id, keys, user.followers_count)
+
+    def remove_user(self, user_id):
+        self.apply(unindex_user, user_id)
+
+    def add_followers(self, user_id, delta):
+        self.apply(count_followers, user_id, delta)
+
+    def scan(self, prefix):
+        position = bisect_left(self.entries, (prefix, ))
+        while position < len(self.entries) and self.entries[position][0].startswith(prefix):
+            yield self.entries[position]
+            position += 1
+
+    def search(self, query, limit):
+        """Ids of the best limit users matching query, exact username matches first then by followers"""
+        query = query.lower()
+        self.ensure_built()
+        with self.lock:
+            tiers = {}
+            for key, user_id in self.scan('u' + query):
+                tier = EXACT_USERNAME if key[1:] == query else USERNAME_PREFIX
+                tiers[user_id] = max(tiers.get(user_id, 0), tier)
+            for key, user_id in self.scan('n' + query):
+                tiers.setdefault(user_id, NAME_PREFIX)
+            return heapq.nlargest(
+                limit, tiers, key=lambda user_id: (tiers[user_id], self.users[user_id][1], -user_id))
+
+
+def index_user(entries, users, user_id, keys, followers_count):
+    """Add a new user to an index or move a renamed one"""
+    old_keys, _ = users.get(user_id, (set(), 0))
+    users[user_id] = (keys, followers_count)
+    # Saves that don't touch a name leave the entries alone
+    unindex_keys(entries, user_id, old_keys - keys)
+    for key in keys - old_keys:
+        insort(entries, (key, user_id))
+
+
+def unindex_user(entries, users, user_id):
+    keys, _ = users.pop(user_id, (set(), 0))
+    unindex_keys(entries, user_id, keys)
+
+
+def unindex_keys(entries, user_id, keys):
+    for key in keys:
+        position = bisect_left(entries, (key, user_id))
+        if position < len(entries) and entries[position] == (key, user_id):
+            del entries[position]
+
+
+def count_followers(entries, users, user_id, delta):
+    if user_id in users:
+        keys, followers_count = users[user_id]
+        users[user_id] = (keys, max(followers_count + delta, 0))
+
+
+typeahead_index = TypeaheadIndex()